@@ -0,0 +1,7 @@
+"""
+Benchmarks for the toyhttp package.
+
+Each module can be run as a script, e.g.:
+
+    $ python -m benchmarks.bench_parser
+"""
@@ -0,0 +1,64 @@
+"""
+Compare request throughput of L{toyhttp.client.ConnectionPool} reusing
+keep-alive connections with opening a new connection for every request, both
+against a local L{toyhttp.server.HTTPFactory} server in the same process.
+
+    $ python -m benchmarks.bench_client [number of requests] [concurrency]
+"""
+
+import sys
+import time
+
+from twisted.internet import defer, reactor
+
+from toyhttp.client import ConnectionPool
+from toyhttp.server import HTTPFactory, Response
+
+
+def handler(method, path, headers, body):
+    return Response(200, "Hello world!", {"Content-Type": "text/plain"})
+
+
+@defer.inlineCallbacks
+def bench(url, pool, count, concurrency):
+    remaining = [count]
+
+    @defer.inlineCallbacks
+    def worker():
+        while remaining[0]:
+            remaining[0] -= 1
+            response = yield pool.request("GET", url)
+            assert response.code == 200
+
+    start = time.time()
+    yield defer.gatherResults([worker() for i in range(concurrency)])
+    elapsed = time.time() - start
+    yield pool.closeCachedConnections()
+    defer.returnValue(elapsed)
+
+
+@defer.inlineCallbacks
+def run(count, concurrency):
+    factory = HTTPFactory(handler, maxRequestsPerConnection=None)
+    port = reactor.listenTCP(0, factory, interface="127.0.0.1")
+    url = "http://127.0.0.1:%d/" % (port.getHost().port,)
+    try:
+        for name, pool in [
+                ("new connection per request",
+                 ConnectionPool(persistent=False, maxPerHost=concurrency)),
+                ("pooled keep-alive",
+                 ConnectionPool(maxPerHost=concurrency))]:
+            elapsed = yield bench(url, pool, count, concurrency)
+            print "%-28s %10.0f requests/sec" % (name, count / elapsed)
+    finally:
+        yield port.stopListening()
+        reactor.stop()
+
+
+def main(count=5000, concurrency=10):
+    reactor.callWhenRunning(run, count, concurrency)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
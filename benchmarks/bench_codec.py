@@ -0,0 +1,111 @@
+"""
+Measure the throughput of the message parsing and rendering shared by the
+server and client in L{toyhttp.codec}.
+
+    $ python -m benchmarks.bench_codec [number of messages]
+"""
+
+import sys
+import time
+
+from toyhttp import codec
+from toyhttp.codec import (RequestParser, ResponseParser, Headers,
+                           renderResponseHead, renderRequestHead)
+
+
+REQUEST = ("GET /some/path?x=y HTTP/1.1\r\n"
+           "Host: localhost:8080\r\n"
+           "User-Agent: Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101\r\n"
+           "Accept: text/html,application/xhtml+xml;q=0.9,*/*;q=0.8\r\n"
+           "Accept-Language: en-US,en;q=0.5\r\n"
+           "Accept-Encoding: gzip, deflate\r\n"
+           "Connection: keep-alive\r\n"
+           "\r\n")
+
+RESPONSE = ("HTTP/1.1 200 OK\r\n"
+            "Content-Length: 12\r\n"
+            "Content-Type: text/plain\r\n"
+            "Date: Tue, 15 Nov 1994 08:12:31 GMT\r\n"
+            "Set-Cookie: a=1\r\n"
+            "Set-Cookie: b=2\r\n"
+            "\r\n"
+            "Hello world!")
+
+RESPONSE_HEADERS = {"Content-Type": "text/plain",
+                    "Date": "Tue, 15 Nov 1994 08:12:31 GMT",
+                    "Cache-Control": "max-age=60"}
+
+REQUEST_HEADERS = {"User-Agent": "toyhttp",
+                   "Accept": "*/*",
+                   "Accept-Encoding": "gzip"}
+
+CHUNK_SIZE = 4096
+
+
+def chunks(data):
+    return [data[i:i + CHUNK_SIZE] for i in xrange(0, len(data), CHUNK_SIZE)]
+
+
+def parse(parser, data, kind):
+    messages = 0
+    start = time.time()
+    for chunk in data:
+        parser.feed(chunk)
+        while True:
+            event = parser.nextEvent()
+            if event is None:
+                break
+            if event[0] is kind:
+                messages += 1
+    return messages, time.time() - start
+
+
+def benchParseRequest(count):
+    return parse(RequestParser(), chunks(REQUEST * count), codec.REQUEST)
+
+
+def benchParseResponse(count):
+    parser = ResponseParser()
+    for i in xrange(count):
+        parser.expectResponse("GET")
+    return parse(parser, chunks(RESPONSE * count), codec.RESPONSE)
+
+
+def benchRenderResponse(count):
+    start = time.time()
+    for i in xrange(count):
+        renderResponseHead(200, RESPONSE_HEADERS, 12)
+    return count, time.time() - start
+
+
+def benchRenderMultiValued(count):
+    headers = Headers(RESPONSE_HEADERS)
+    headers.add("Set-Cookie", "a=1")
+    headers.add("Set-Cookie", "b=2")
+    start = time.time()
+    for i in xrange(count):
+        renderResponseHead(200, headers, 12)
+    return count, time.time() - start
+
+
+def benchRenderRequest(count):
+    start = time.time()
+    for i in xrange(count):
+        renderRequestHead("GET", "/some/path", "localhost:8080",
+                          REQUEST_HEADERS)
+    return count, time.time() - start
+
+
+def main(count=100000):
+    for name, bench in [("parse request", benchParseRequest),
+                        ("parse response", benchParseResponse),
+                        ("render response head", benchRenderResponse),
+                        ("render multi-valued head", benchRenderMultiValued),
+                        ("render request head", benchRenderRequest)]:
+        messages, elapsed = bench(count)
+        assert messages == count, (name, messages)
+        print "%-26s %10.0f messages/sec" % (name, messages / elapsed)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
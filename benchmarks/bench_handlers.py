@@ -0,0 +1,101 @@
+"""
+Compare the throughput and latency of handlers written in different styles:
+returning a L{Deferred}, decorated with L{defer.inlineCallbacks} (like
+C{demo2.resolve}), and undecorated generator coroutines, which the server
+adapts itself.  A handler returning its response directly is the baseline.
+
+Each handler (except the baseline) waits for a Deferred fired on the next
+reactor iteration, as it would for a database or cache driver, so the
+differences are the cost of each style.  The server runs in a child process,
+driven by L{benchmarks.loadgen.LoadGenerator}.
+
+    $ python -m benchmarks.bench_handlers [number of requests] [concurrency]
+"""
+
+import sys
+
+from twisted.internet import defer, task
+
+from benchmarks.bench_server import startServer
+from benchmarks.loadgen import LoadGenerator
+from toyhttp.router import Router
+from toyhttp.server import HTTPFactory, Response
+
+
+HANDLERS = ["plain", "deferred", "inlineCallbacks", "coroutine"]
+
+
+def buildRouter(reactor):
+    router = Router()
+
+    def hello():
+        return Response(200, "Hello world!", {"Content-Type": "text/plain"})
+
+    def query():
+        return task.deferLater(reactor, 0, lambda: "Hello world!")
+
+    @router.route("GET", "/plain")
+    def plain(method, path, headers, body):
+        return hello()
+
+    @router.route("GET", "/deferred")
+    def deferred(method, path, headers, body):
+        return query().addCallback(lambda result: hello())
+
+    @router.route("GET", "/inlineCallbacks")
+    @defer.inlineCallbacks
+    def inline(method, path, headers, body):
+        yield query()
+        defer.returnValue(hello())
+
+    @router.route("GET", "/coroutine")
+    def coroutine(method, path, headers, body):
+        yield query()
+        defer.returnValue(hello())
+
+    return router
+
+
+def serve():
+    from twisted.internet import reactor
+    factory = HTTPFactory(buildRouter(reactor), maxRequestsPerConnection=None)
+    port = reactor.listenTCP(0, factory, interface="127.0.0.1", backlog=1024)
+    sys.stdout.write("%d\n" % (port.getHost().port,))
+    sys.stdout.flush()
+    reactor.run()
+
+
+@defer.inlineCallbacks
+def run(reactor, port, count, concurrency):
+    try:
+        for name in HANDLERS:
+            yield LoadGenerator(reactor, "127.0.0.1", port, path="/" + name,
+                                count=count // 10,
+                                concurrency=concurrency).run()
+            result = yield LoadGenerator(reactor, "127.0.0.1", port,
+                                         path="/" + name, count=count,
+                                         concurrency=concurrency).run()
+            summary = result.summary()
+            print "%-16s %10.0f requests/sec  p50 %7.3fms  p99 %7.3fms" % (
+                name, summary["requestsPerSecond"],
+                summary["latency"]["p50"], summary["latency"]["p99"])
+    finally:
+        reactor.stop()
+
+
+def main(count=10000, concurrency=10):
+    from twisted.internet import reactor
+    process, port = startServer("benchmarks.bench_handlers")
+    try:
+        reactor.callWhenRunning(run, reactor, port, count, concurrency)
+        reactor.run()
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ["--serve"]:
+        serve()
+    else:
+        main(*[int(arg) for arg in sys.argv[1:]])
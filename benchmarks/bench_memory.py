@@ -0,0 +1,101 @@
+"""
+Measure the memory taken up by pending requests: connections whose handler
+has been called but hasn't produced its response yet, as when handlers wait
+on a slow backend.
+
+Each connection gets a typical browser request, and its handler returns a
+L{Deferred} that never fires.  The handler either takes the method, path,
+headers and body of the request, whose headers are then parsed up front, or
+is marked with L{toyhttp.server.takesRequest} and gets a
+L{toyhttp.server.Request} whose headers it never reads.  Each kind of handler
+is measured in a child process of its own, as the growth of its resident set
+size.
+
+    $ python -m benchmarks.bench_memory [number of requests]
+"""
+
+import gc
+import resource
+import subprocess
+import sys
+
+from twisted.internet import defer, task
+from twisted.test.proto_helpers import StringTransport
+
+from toyhttp.server import HTTPFactory, takesRequest
+
+
+REQUEST = ("GET /items/42?x=y HTTP/1.1\r\n"
+           "Host: localhost:8080\r\n"
+           "User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:60.0) "
+           "Gecko/20100101 Firefox/60.0\r\n"
+           "Accept: text/html,application/xhtml+xml,application/xml;q=0.9,"
+           "*/*;q=0.8\r\n"
+           "Accept-Language: en-US,en;q=0.5\r\n"
+           "Accept-Encoding: gzip, deflate\r\n"
+           "Cookie: session=0123456789abcdef; theme=dark\r\n"
+           "Connection: keep-alive\r\n"
+           "\r\n")
+
+HANDLERS = ["arguments", "request"]
+
+
+def pending(method, path, headers, body):
+    # Keep hold of the request, as a handler that goes on to use it once its
+    # backend answers would:
+    d = defer.Deferred()
+    d.addCallback(lambda result: (method, path, headers, body))
+    return d
+
+
+@takesRequest
+def pendingRequest(request):
+    d = defer.Deferred()
+    d.addCallback(lambda result: request)
+    return d
+
+
+def maxRSS():
+    """
+    @return: The peak resident set size of this process, in bytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(name, count):
+    """
+    Make C{count} requests pending with the named kind of handler.
+
+    @return: The memory they take up, in bytes per request.
+    """
+    handler = {"arguments": pending, "request": pendingRequest}[name]
+    factory = HTTPFactory(handler)
+    clock = task.Clock()
+    connections = []
+    gc.collect()
+    before = maxRSS()
+    for i in xrange(count):
+        protocol = factory.buildProtocol(None)
+        protocol.reactor = clock
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived(REQUEST)
+        connections.append(protocol)
+    gc.collect()
+    return (maxRSS() - before) / float(count)
+
+
+def main(count=10000):
+    for name in HANDLERS:
+        output = subprocess.check_output(
+            [sys.executable, "-m", "benchmarks.bench_memory", "--measure",
+             name, str(count)])
+        print "%-10s %8.0f bytes per pending request" % (name,
+                                                        float(output))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["--measure"]:
+        print measure(sys.argv[2], int(sys.argv[3]))
+    else:
+        main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,81 @@
+"""
+Measure the cost of recording L{toyhttp.metrics.Metrics}, by comparing the
+request throughput of a L{toyhttp.server.HTTP} connection fed pipelined
+requests in memory without metrics, with them (timing the phases of one
+request in every C{Metrics.sampleEvery}), and timing every request.  The
+differences are a few microseconds per request, no more than the noise of
+a busy machine, so each is timed in many short rounds, interleaved, in CPU
+time, and the best round is kept.
+
+    $ python -m benchmarks.bench_metrics [number of requests] [rounds]
+"""
+
+import sys
+import time
+
+from twisted.internet import task
+from twisted.test.proto_helpers import StringTransport
+
+from toyhttp.metrics import Metrics
+from toyhttp.router import Router
+from toyhttp.server import HTTPFactory, Response
+
+
+REQUEST = ("GET /items/42?x=y HTTP/1.1\r\n"
+           "Host: localhost:8080\r\n"
+           "Accept: */*\r\n"
+           "\r\n")
+
+BATCH = 100
+
+
+class NullTransport(StringTransport):
+    """
+    A transport discarding what is written to it.
+    """
+
+    def write(self, data):
+        pass
+
+    def writeSequence(self, data):
+        pass
+
+
+def bench(factory, count):
+    protocol = factory.buildProtocol(None)
+    protocol.reactor = task.Clock()
+    protocol.makeConnection(NullTransport())
+    data = REQUEST * BATCH
+    start = time.clock()
+    for i in xrange(count // BATCH):
+        protocol.dataReceived(data)
+    return time.clock() - start
+
+
+def main(count=20000, rounds=20):
+    router = Router()
+    router.add("GET", "/items/{id}",
+               lambda method, path, headers, body, id: Response(
+                   200, id, {"Content-Type": "text/plain"}))
+    names = ["without metrics", "with metrics", "timing every request"]
+    factories = [HTTPFactory(router, maxRequestsPerConnection=None,
+                             metrics=metrics)
+                 for metrics in [None, Metrics(routeLabel=router.label),
+                                 Metrics(routeLabel=router.label,
+                                         sampleEvery=1)]]
+    # Warm up, then take the best of many runs of each, interleaved so
+    # that both see the same machine load.
+    for factory in factories:
+        bench(factory, count // 10)
+    elapsed = [min(times) for times in zip(*[
+        [bench(factory, count) for factory in factories]
+        for i in range(rounds)])]
+    baseline = count / elapsed[0]
+    for name, seconds in zip(names, elapsed):
+        rate = count / seconds
+        print "%-20s %10.0f requests/sec  overhead: %4.1f%%" % (
+            name, rate, 100 * (1 - rate / baseline))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,92 @@
+"""
+Compare request parsing throughput of L{toyhttp.codec.RequestParser} with the
+original C{LineReceiver}-based parsing loop it replaced.
+
+    $ python -m benchmarks.bench_parser [number of requests]
+"""
+
+import re
+import sys
+import time
+
+from twisted.protocols import basic
+from twisted.test.proto_helpers import StringTransport
+
+from toyhttp.codec import RequestParser
+from toyhttp import codec
+
+
+REQUEST = ("GET /some/path?x=y HTTP/1.1\r\n"
+           "Host: localhost:8080\r\n"
+           "User-Agent: Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101\r\n"
+           "Accept: text/html,application/xhtml+xml;q=0.9,*/*;q=0.8\r\n"
+           "Accept-Language: en-US,en;q=0.5\r\n"
+           "Accept-Encoding: gzip, deflate\r\n"
+           "Connection: keep-alive\r\n"
+           "\r\n")
+
+CHUNK_SIZE = 4096
+
+
+class LegacyParser(basic.LineReceiver):
+    """
+    The parsing loop from the original C{HTTP.lineReceived}.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.requests = 0
+
+    def lineReceived(self, line):
+        if line == "":
+            l0Toks = self.lines[0].split()
+            headers = dict()
+            for hline in self.lines[1:]:
+                tokens = [x.strip() for x in hline.split(":")]
+                headers[tokens[0]] = tokens[1]
+            if len(l0Toks) == 3 and re.match("HTTP/\d\.\d", l0Toks[2]) != None:
+                self.requests += 1
+            self.lines = []
+        else:
+            self.lines.append(line)
+
+
+def chunks(data):
+    return [data[i:i + CHUNK_SIZE] for i in xrange(0, len(data), CHUNK_SIZE)]
+
+
+def benchLegacy(data):
+    protocol = LegacyParser()
+    protocol.makeConnection(StringTransport())
+    start = time.time()
+    for chunk in data:
+        protocol.dataReceived(chunk)
+    return protocol.requests, time.time() - start
+
+
+def benchRequestParser(data):
+    parser = RequestParser()
+    requests = 0
+    start = time.time()
+    for chunk in data:
+        parser.feed(chunk)
+        while True:
+            event = parser.nextEvent()
+            if event is None:
+                break
+            if event[0] is codec.REQUEST:
+                requests += 1
+    return requests, time.time() - start
+
+
+def main(count=100000):
+    data = chunks(REQUEST * count)
+    for name, bench in [("LineReceiver (legacy)", benchLegacy),
+                        ("RequestParser", benchRequestParser)]:
+        requests, elapsed = bench(data)
+        assert requests == count, (name, requests)
+        print "%-22s %10.0f requests/sec" % (name, requests / elapsed)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
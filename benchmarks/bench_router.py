@@ -0,0 +1,81 @@
+"""
+Compare dispatch throughput of L{toyhttp.router.Router} with trying each
+route's regular expression in turn, with thousands of routes.
+
+    $ python -m benchmarks.bench_router [number of resources] [requests]
+
+Each resource has a static, a parameterised and a two-parameter route.
+"""
+
+import random
+import re
+import sys
+import time
+
+from toyhttp.router import Router
+
+
+def handler(method, path, headers, body, **params):
+    return params
+
+
+def patterns(resources):
+    for i in xrange(resources):
+        yield "/api/res%d" % (i,)
+        yield "/api/res%d/{id}" % (i,)
+        yield "/api/res%d/{id}/items/{item}" % (i,)
+
+
+def paths(resources, count):
+    rng = random.Random(0)
+    choices = []
+    for i in xrange(count):
+        n = rng.randrange(resources)
+        choices.append(rng.choice([
+            "/api/res%d" % (n,),
+            "/api/res%d/42?verbose=1" % (n,),
+            "/api/res%d/42/items/7" % (n,)]))
+    return choices
+
+
+class RegexRouter(object):
+    """
+    Match a path against each route's regular expression in turn.
+    """
+
+    def __init__(self):
+        self.routes = []
+
+    def add(self, method, pattern, handler):
+        regex = re.sub(r"\\{(\w+)\\}", r"(?P<\1>[^/]+)", re.escape(pattern))
+        self.routes.append((method, re.compile(regex + "$"), handler))
+
+    def __call__(self, method, path, headers, body):
+        path = path.partition("?")[0]
+        for routeMethod, regex, handler in self.routes:
+            match = regex.match(path)
+            if match is not None and routeMethod == method:
+                return handler(method, path, headers, body,
+                               **match.groupdict())
+
+
+def bench(router, requests):
+    start = time.time()
+    for path in requests:
+        router("GET", path, {}, "")
+    return time.time() - start
+
+
+def main(resources=1000, count=2000):
+    requests = paths(resources, count)
+    print "%d routes" % (resources * 3,)
+    for name, router in [("regex scan", RegexRouter()),
+                         ("Router", Router())]:
+        for pattern in patterns(resources):
+            router.add("GET", pattern, handler)
+        elapsed = bench(router, requests)
+        print "%-12s %10.0f requests/sec" % (name, count / elapsed)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
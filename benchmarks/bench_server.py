@@ -0,0 +1,218 @@
+"""
+Measure the throughput and latency of L{toyhttp.server.HTTPFactory} under
+load, in a number of scenarios, and write the results as JSON so runs can be
+compared across commits.
+
+The server runs in a child process, listening on localhost, so it doesn't
+share a CPU with the load generator (L{benchmarks.loadgen.LoadGenerator}).
+The scenarios are:
+
+    - C{tiny}: a small C{GET} response over keep-alive connections.
+    - C{close}: the same, with a new connection for every request.
+    - C{large}: a 1MB C{GET} response.
+    - C{upload}: a C{POST} with a 64KB body.
+    - C{slow}: a handler returning a L{Deferred} that fires after 10ms.
+
+    $ python -m benchmarks.bench_server [-n requests] [-c concurrency]
+          [-o results.json] [scenario ...]
+
+Without C{-o} the JSON is written to standard output; a one-line summary of
+each scenario is always written to standard error.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+
+from twisted.internet import defer
+
+from benchmarks.loadgen import LoadGenerator
+from toyhttp.router import Router
+from toyhttp.server import HTTPFactory, Response
+
+
+LARGE_BODY = "x" * (1024 * 1024)
+UPLOAD_BODY = "x" * (64 * 1024)
+SLOW_DELAY = 0.01
+
+# Maps scenario names to the keyword arguments of LoadGenerator, and the
+# fraction of the requested number of requests to send:
+SCENARIOS = [
+    ("tiny", dict(path="/tiny"), 1),
+    ("close", dict(path="/tiny", keepAlive=False), 1),
+    ("large", dict(path="/large"), 0.1),
+    ("upload", dict(method="POST", path="/upload", body=UPLOAD_BODY), 0.5),
+    ("slow", dict(path="/slow"), 0.5),
+]
+
+
+def buildRouter(reactor):
+    """
+    @return: The handler of the benchmark server.
+    """
+    router = Router()
+    text = {"Content-Type": "text/plain"}
+
+    @router.route("GET", "/tiny")
+    def tiny(method, path, headers, body):
+        return Response(200, "Hello world!", text)
+
+    @router.route("GET", "/large")
+    def large(method, path, headers, body):
+        return Response(200, LARGE_BODY, {"Content-Type":
+                                          "application/octet-stream"})
+
+    @router.route("POST", "/upload")
+    def upload(method, path, headers, body):
+        return Response(200, str(len(body)), text)
+
+    @router.route("GET", "/slow")
+    def slow(method, path, headers, body):
+        d = defer.Deferred()
+        reactor.callLater(SLOW_DELAY, d.callback,
+                          Response(200, "Hello world!", text))
+        return d
+
+    return router
+
+
+def serve():
+    """
+    Run the benchmark server on a free port of localhost, writing the port
+    number to standard output once listening.
+    """
+    from twisted.internet import reactor
+    factory = HTTPFactory(buildRouter(reactor),
+                          maxRequestsPerConnection=None,
+                          maxBodySize=len(UPLOAD_BODY))
+    port = reactor.listenTCP(0, factory, interface="127.0.0.1", backlog=1024)
+    sys.stdout.write("%d\n" % (port.getHost().port,))
+    sys.stdout.flush()
+    reactor.run()
+
+
+def startServer(module="benchmarks.bench_server"):
+    """
+    Start a benchmark server in a child process, running C{module} with the
+    same interpreter and module path and the C{--serve} option.
+
+    @return: The C{subprocess.Popen} of the child, and its port.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(path for path in sys.path if path)
+    process = subprocess.Popen(
+        [sys.executable, "-m", module, "--serve"],
+        stdout=subprocess.PIPE, env=env,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    line = process.stdout.readline()
+    if not line:
+        raise RuntimeError("The benchmark server failed to start")
+    return process, int(line)
+
+
+def revision():
+    """
+    @return: The git commit being benchmarked, or C{None}.
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@defer.inlineCallbacks
+def runScenarios(reactor, port, names, count, concurrency):
+    """
+    Run the named scenarios in turn against the server at C{port}.
+
+    @return: A L{Deferred} firing with a list of scenario results.
+    """
+    results = []
+    for name, options, fraction in SCENARIOS:
+        if name not in names:
+            continue
+        requests = max(int(count * fraction), 1)
+        # A short warm-up first, not measured:
+        yield LoadGenerator(reactor, "127.0.0.1", port,
+                            count=min(requests // 10 + 1, 100),
+                            concurrency=concurrency, **options).run()
+        result = yield LoadGenerator(reactor, "127.0.0.1", port,
+                                     count=requests, concurrency=concurrency,
+                                     **options).run()
+        summary = result.summary()
+        summary["name"] = name
+        results.append(summary)
+        latency = summary["latency"]
+        sys.stderr.write(
+            "%-8s %10.0f requests/sec  p50 %8.3fms  p99 %8.3fms  "
+            "p999 %8.3fms  %d errors\n" % (
+                name, summary["requestsPerSecond"], latency["p50"] or 0,
+                latency["p99"] or 0, latency["p999"] or 0,
+                summary["errors"]))
+    defer.returnValue(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--requests", type=int, default=5000,
+                        help="Requests per scenario (some send fewer).")
+    parser.add_argument("-c", "--concurrency", type=int, default=10,
+                        help="Concurrent connections.")
+    parser.add_argument("-o", "--output",
+                        help="A file to write the JSON results to.")
+    parser.add_argument("--serve", action="store_true",
+                        help=argparse.SUPPRESS)
+    parser.add_argument("scenarios", nargs="*",
+                        metavar="scenario",
+                        help="Scenarios to run: %s (default: all)." %
+                        (", ".join(name for name, _, _ in SCENARIOS),))
+    args = parser.parse_args(argv)
+    if args.serve:
+        serve()
+        return
+    names = set(args.scenarios or [name for name, _, _ in SCENARIOS])
+    unknown = names - set(name for name, _, _ in SCENARIOS)
+    if unknown:
+        parser.error("unknown scenarios: %s" % (", ".join(sorted(unknown)),))
+
+    from twisted.internet import reactor
+    process, port = startServer()
+    results = []
+
+    def run():
+        d = runScenarios(reactor, port, names, args.requests,
+                         args.concurrency)
+        d.addCallback(results.extend)
+        d.addErrback(lambda failure: failure.printTraceback())
+        d.addBoth(lambda ignored: reactor.stop())
+
+    try:
+        reactor.callWhenRunning(run)
+        reactor.run()
+    finally:
+        process.terminate()
+        process.wait()
+
+    report = {"revision": revision(),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "requests": args.requests,
+              "concurrency": args.concurrency,
+              "scenarios": results}
+    output = json.dumps(report, indent=2, sort_keys=True,
+                        separators=(",", ": "))
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Measure L{toyhttp.websocket} connections:
+
+    - C{receive}: messages per second a connection receives from a client,
+      fed masked frames in memory, 100 at a time.
+    - C{echo}: the same, with every message sent back.
+    - C{push}: messages per second sent to a connection, as a dashboard
+      pushing updates does.
+    - The memory taken up by idle connections, after the handshake, against
+      idle keep-alive HTTP connections, each measured in a child process of
+      its own as the growth of its resident set size.
+
+    $ python -m benchmarks.bench_websocket [messages] [connections]
+"""
+
+import gc
+import os
+import subprocess
+import sys
+import time
+
+from twisted.internet import task
+
+from benchmarks.bench_memory import maxRSS
+from benchmarks.bench_metrics import NullTransport
+from toyhttp.server import HTTPFactory, Response
+from toyhttp.websocket import TEXT, WebSocketHandler, accept, encodeFrame
+
+
+HANDSHAKE = ("GET /updates HTTP/1.1\r\n"
+             "Host: localhost:8080\r\n"
+             "Upgrade: websocket\r\n"
+             "Connection: Upgrade\r\n"
+             "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+             "Sec-WebSocket-Version: 13\r\n"
+             "\r\n")
+
+REQUEST = "GET /updates HTTP/1.1\r\nHost: localhost:8080\r\n\r\n"
+
+MESSAGE = u'{"metric": "requests", "value": 12345, "time": 1500000000}'
+
+BATCH = 100
+
+
+class Counter(WebSocketHandler):
+    """
+    Count the messages received, and optionally echo them.
+    """
+
+    def __init__(self, echo=False):
+        self.echo = echo
+        self.received = 0
+
+    def messageReceived(self, message):
+        self.received += 1
+        if self.echo:
+            self.socket.sendMessage(message)
+
+
+def buildFactory(echo=False):
+    """
+    @return: A factory accepting WebSocket handshakes with a L{Counter},
+        appended to the factory's C{handlers}, and answering other requests
+        with a small response.
+    """
+    def handle(method, path, headers, body):
+        if "Upgrade" in headers:
+            handler = Counter(echo)
+            factory.handlers.append(handler)
+            return accept(method, headers, handler)
+        return Response(200, "Hello world!", {"Content-Type": "text/plain"})
+
+    factory = HTTPFactory(handle, maxRequestsPerConnection=None)
+    factory.handlers = []
+    return factory
+
+
+def connect(factory, data=HANDSHAKE, clock=task.Clock()):
+    """
+    Send C{data} on a new in-memory connection to C{factory}.
+
+    @return: The connection's protocol.
+    """
+    protocol = factory.buildProtocol(None)
+    protocol.reactor = clock
+    protocol.makeConnection(NullTransport())
+    protocol.dataReceived(data)
+    return protocol
+
+
+def benchReceive(count, echo):
+    factory = buildFactory(echo)
+    protocol = connect(factory)
+    handler = factory.handlers[0]
+    data = encodeFrame(TEXT, MESSAGE.encode("utf-8"),
+                       key=os.urandom(4)) * BATCH
+    start = time.time()
+    for i in xrange(count // BATCH):
+        protocol.dataReceived(data)
+    elapsed = time.time() - start
+    assert handler.received == count // BATCH * BATCH
+    return elapsed
+
+
+def benchPush(count):
+    factory = buildFactory()
+    connect(factory)
+    socket = factory.handlers[0].socket
+    start = time.time()
+    for i in xrange(count):
+        socket.sendMessage(MESSAGE)
+    return time.time() - start
+
+
+def measure(kind, count):
+    """
+    Open C{count} idle connections of the given kind, C{"websocket"} or
+    C{"http"}.
+
+    @return: The memory they take up, in bytes per connection.
+    """
+    factory = buildFactory()
+    data = HANDSHAKE if kind == "websocket" else REQUEST
+    connections = []
+    gc.collect()
+    before = maxRSS()
+    for i in xrange(count):
+        connections.append(connect(factory, data))
+    gc.collect()
+    return (maxRSS() - before) / float(count)
+
+
+def main(count=100000, connections=10000):
+    benches = [("receive", lambda: benchReceive(count, False)),
+               ("echo", lambda: benchReceive(count, True)),
+               ("push", lambda: benchPush(count))]
+    for name, bench in benches:
+        elapsed = min(bench() for i in range(5))
+        print "%-10s %10.0f messages/sec" % (name, count / elapsed)
+    for kind in ["websocket", "http"]:
+        output = subprocess.check_output(
+            [sys.executable, "-m", "benchmarks.bench_websocket", "--measure",
+             kind, str(connections)])
+        print "%-10s %10.0f bytes per idle connection (%d connections)" % (
+            kind, float(output), connections)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["--measure"]:
+        print measure(sys.argv[2], int(sys.argv[3]))
+    else:
+        main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,231 @@
+"""
+A load generator for HTTP servers.
+
+L{LoadGenerator} keeps a number of connections busy, each sending the same
+request as soon as the response to its previous one has arrived, and records
+the latency of every response.  The request is rendered once, and responses
+are parsed by L{toyhttp.codec.ResponseParser} without assembling their
+bodies, so the generator costs as little as possible per request.
+"""
+
+import math
+import time
+
+from twisted.internet import defer, protocol
+
+from toyhttp.codec import (ResponseParser, ParseError, RESPONSE, END,
+                           isPersistent, renderRequestHead)
+
+
+def percentile(ordered, fraction):
+    """
+    @param ordered: A sorted list of values.
+
+    @return: The smallest value at least C{fraction} of the values don't
+        exceed, or C{None} if there are none.
+    """
+    if not ordered:
+        return None
+    index = int(math.ceil(len(ordered) * fraction)) - 1
+    return ordered[min(max(index, 0), len(ordered) - 1)]
+
+
+class Result(object):
+    """
+    The outcome of a L{LoadGenerator} run.
+
+    @ivar latencies: The latency of each successful request, in seconds,
+        from sending it (or, for a request on a new connection, from starting
+        to connect) until its response has been received in full.
+
+    @ivar errors: The number of requests that failed: the connection could
+        not be made or was lost, the response was malformed, or its status
+        code wasn't the expected one.
+
+    @ivar elapsed: The duration of the run, in seconds.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.elapsed = None
+
+    def summary(self):
+        """
+        @return: A dictionary describing the run, suitable for JSON, with
+            latencies in milliseconds.
+        """
+        ordered = sorted(self.latencies)
+
+        def ms(seconds):
+            if seconds is None:
+                return None
+            return round(seconds * 1000, 3)
+
+        latency = {"mean": None}
+        if ordered:
+            latency["mean"] = ms(sum(ordered) / len(ordered))
+        for name, fraction in [("p50", 0.5), ("p99", 0.99),
+                               ("p999", 0.999), ("max", 1.0)]:
+            latency[name] = ms(percentile(ordered, fraction))
+        return {"requests": len(ordered),
+                "errors": self.errors,
+                "seconds": round(self.elapsed, 3),
+                "requestsPerSecond": round(len(ordered) / self.elapsed, 1),
+                "latency": latency}
+
+
+class _LoadProtocol(protocol.Protocol):
+    """
+    A connection of a L{LoadGenerator}, sending requests one at a time.
+    """
+
+    def __init__(self, generator, started):
+        self.generator = generator
+        self.started = started
+        self.parser = ResponseParser()
+        self.code = None
+        self.inFlight = False
+
+    def connectionMade(self):
+        self._send()
+
+    def _send(self):
+        generator = self.generator
+        if self.started is None:
+            if not generator._take():
+                self.transport.loseConnection()
+                return
+            self.started = generator.clock()
+        self.inFlight = True
+        self.parser.expectResponse(generator.method)
+        self.transport.write(generator.request)
+
+    def dataReceived(self, data):
+        parser = self.parser
+        parser.feed(data)
+        try:
+            while self.inFlight:
+                event = parser.nextEvent()
+                if event is None:
+                    return
+                kind, value = event
+                if kind is RESPONSE:
+                    self.code = value[1]
+                    self.persistent = isPersistent(value[0],
+                                                   parser.connection)
+                elif kind is END and self.code >= 200:
+                    self._responseComplete()
+        except ParseError:
+            self.transport.loseConnection()
+
+    def _responseComplete(self):
+        generator = self.generator
+        self.inFlight = False
+        generator._responded(self.code, generator.clock() - self.started)
+        self.started = None
+        if generator.keepAlive and self.persistent:
+            self._send()
+        else:
+            self.transport.loseConnection()
+
+    def connectionLost(self, reason):
+        if self.inFlight:
+            self.inFlight = False
+            self.generator.result.errors += 1
+        self.generator._connectionClosed()
+
+
+class LoadGenerator(object):
+    """
+    Send the same request to a server a number of times, over C{concurrency}
+    concurrent connections.
+
+    @ivar keepAlive: Whether to reuse connections for further requests, if
+        the server keeps them open; otherwise every request gets a new
+        connection, and asks for it to be closed.
+
+    @ivar expectedCode: The status code of successful responses.
+    """
+
+    def __init__(self, reactor, host, port, method="GET", path="/",
+                 headers=None, body="", count=1000, concurrency=10,
+                 keepAlive=True, expectedCode=200, clock=time.time):
+        self.reactor = reactor
+        self.host = host
+        self.port = port
+        self.method = method
+        self.count = count
+        self.concurrency = concurrency
+        self.keepAlive = keepAlive
+        self.expectedCode = expectedCode
+        self.clock = clock
+        head = renderRequestHead(method, path, "%s:%d" % (host, port),
+                                 headers or {}, len(body) or None,
+                                 close=not keepAlive)
+        self.request = head + body
+        self.result = None
+        self._remaining = 0
+        self._connections = 0
+        self._started = None
+        self._done = None
+
+    def run(self):
+        """
+        Send the requests.
+
+        @return: A L{Deferred} firing with a L{Result} once every request has
+            been answered or has failed.
+        """
+        self.result = Result()
+        self._remaining = self.count
+        self._done = defer.Deferred()
+        self._started = self.clock()
+        for i in range(min(self.concurrency, self.count)):
+            self._connect()
+        return self._done
+
+    def _take(self):
+        """
+        Take one of the remaining requests.
+
+        @return: Whether there was one left.
+        """
+        if not self._remaining:
+            return False
+        self._remaining -= 1
+        return True
+
+    def _connect(self):
+        if not self._take():
+            self._finishIfDone()
+            return
+        self._connections += 1
+        creator = protocol.ClientCreator(self.reactor, _LoadProtocol, self,
+                                         self.clock())
+        d = creator.connectTCP(self.host, self.port)
+        d.addErrback(self._connectFailed)
+
+    def _connectFailed(self, reason):
+        self.result.errors += 1
+        self._connectionClosed()
+
+    def _responded(self, code, latency):
+        if code == self.expectedCode:
+            self.result.latencies.append(latency)
+        else:
+            self.result.errors += 1
+
+    def _connectionClosed(self):
+        self._connections -= 1
+        if self._remaining:
+            self._connect()
+        else:
+            self._finishIfDone()
+
+    def _finishIfDone(self):
+        if self._connections or self._done is None:
+            return
+        self.result.elapsed = self.clock() - self._started
+        d, self._done = self._done, None
+        d.callback(self.result)
@@ -5,14 +5,17 @@ Run a trivial HTTP server at <http://127.0.0.1:8080/>.
 
 This requires tests 1-13 of test_server.py to be passing; it demonstrates that
 handlers can return Deferreds by doing a DNS lookup in response to a
-form. Multiple DNS requests can run in parallel.
+form. Multiple DNS requests can run in parallel; lookups are cached, and
+concurrent lookups of the same hostname share one query.
 """
 
-import sys, urlparse
+import sys
 
 from twisted.internet import reactor, defer
 from twisted.python import log
 from toyhttp import server
+from toyhttp.resolver import CachingResolver
+from toyhttp.router import Router, parseQuery
 
 FORM = """\
 <html>
@@ -26,39 +29,41 @@ FORM = """\
 </html>
 """
 
+resolver = CachingResolver()
+
+
 def renderResult(message, hostname):
     result = FORM % {"message": message, "hostname": hostname}
     return server.Response(200, result, {"content-type": "text/html"})
 
 
+# A HTTP handler that does DNS lookups:
+dnsResolver = Router()
+
+
+@dnsResolver.route("GET", "/")
+def form(method, path, headers, body):
+    return renderResult("Please enter a hostname, e.g. www.google.com:", "")
+
+
+@dnsResolver.route("GET", "/resolve")
 @defer.inlineCallbacks
-def resolve(parsedPath):
-    arguments = urlparse.parse_qs(parsedPath.query)
+def resolve(method, path, headers, body):
+    arguments = parseQuery(path)
     hostname = arguments["hostname"][0]
     try:
-        ip = yield reactor.resolve(hostname)
+        ip = yield resolver.resolve(hostname)
     except Exception, e:
         message = str(e)
     else:
         message = "<b>%s</b> has IP address <b>%s</b>." % (hostname, ip)
+    message += " (%d cache hits, %d misses)" % (resolver.hits,
+                                                resolver.misses)
 
     # This is how inlineCallbacks returns a result:
     defer.returnValue(renderResult(message, hostname))
 
 
-def dnsResolver(method, path, headers, body):
-    """
-    A HTTP handler that does DNS lookups.
-    """
-    parsedPath = urlparse.urlparse(path)
-    if parsedPath.path == "/":
-        return renderResult("Please enter a hostname, e.g. www.google.com:", "")
-    elif parsedPath.path == "/resolve":
-        return resolve(parsedPath)
-    else:
-        return server.Response(404, "Bad path.", {"content-type": "text/plain"})
-
-
 if __name__ == '__main__':
     print "Point your browser at http://localhost:8080/"
     log.startLogging(sys.stdout)
@@ -0,0 +1,187 @@
+"""
+Admission control: limits on the load a server takes on, shedding the rest.
+
+Pass an L{AdmissionControl} to L{toyhttp.server.HTTPFactory} as C{admission}
+to limit:
+
+    - The number of concurrent connections.  Connections beyond the limit
+      are either answered with a 503 response straight away and closed, or,
+      with C{pauseAccepting}, not accepted at all until a connection closes:
+      the listening port stops reading, and the kernel queues new
+      connections in its listen backlog.
+    - The number of handler calls in flight, i.e. whose response, or the
+      Deferred firing with it, hasn't been produced yet.  Requests beyond the
+      limit are answered with a 503 response without calling the handler.
+
+The 503 responses are rendered once, and carry a C{Retry-After} header.
+Shedding excess load this way keeps the latency of admitted requests bounded
+when traffic spikes, rather than every request slowing down together.
+"""
+
+from twisted.internet.protocol import Protocol
+
+from toyhttp.codec import _HEAD_END
+from toyhttp.server import _serviceUnavailable
+
+
+class _Rejected(Protocol):
+    """
+    A connection over the limit: answer it with a 503 response and close it.
+
+    The response is written as soon as the connection is made, but closing
+    waits for the request head, so the kernel isn't left holding unread data
+    (which would make it reset the connection, possibly before the client
+    has read the response), or for C{lingerTimeout} seconds.
+    """
+
+    def __init__(self, response, reactor, lingerTimeout):
+        self.response = response
+        self.reactor = reactor
+        self.lingerTimeout = lingerTimeout
+        self._tail = ""
+        self._lingerCall = None
+
+    def connectionMade(self):
+        self.transport.write(self.response.renderHead("close") +
+                             self.response.body)
+        self._lingerCall = self.reactor.callLater(
+            self.lingerTimeout, self.transport.abortConnection)
+
+    def dataReceived(self, data):
+        data = self._tail + data
+        if _HEAD_END in data:
+            self.transport.loseConnection()
+        else:
+            self._tail = data[-3:]
+
+    def connectionLost(self, reason):
+        if self._lingerCall is not None and self._lingerCall.active():
+            self._lingerCall.cancel()
+        self._lingerCall = None
+
+
+class AdmissionControl(object):
+    """
+    Limits on the connections and handler calls of an
+    L{toyhttp.server.HTTPFactory}.
+
+    @ivar maxConnections: The largest number of concurrent connections, or
+        C{None} for no limit.
+
+    @ivar maxInFlight: The largest number of handler calls in flight, or
+        C{None} for no limit.
+
+    @ivar pauseAccepting: Whether to stop accepting connections while there
+        are C{maxConnections} of them, rather than answering further ones
+        with a 503 response.  This needs the listening port, see
+        L{listening}.
+
+    @ivar response: The 503 response sent to connections and requests over
+        the limits.
+
+    @ivar connections: The number of open connections.
+
+    @ivar inFlight: The number of handler calls in flight.
+
+    @ivar rejectedConnections: The number of connections answered with a
+        503 response.
+
+    @ivar rejectedRequests: The number of requests answered with a 503
+        response because C{maxInFlight} handler calls were in flight.
+    """
+
+    lingerTimeout = 5
+
+    def __init__(self, maxConnections=None, maxInFlight=None,
+                 pauseAccepting=False, retryAfter=1, reactor=None):
+        """
+        @param retryAfter: Seconds for the C{Retry-After} header of 503
+            responses.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.maxConnections = maxConnections
+        self.maxInFlight = maxInFlight
+        self.pauseAccepting = pauseAccepting
+        self.response = _serviceUnavailable(retryAfter)
+        self.connections = 0
+        self.inFlight = 0
+        self.rejectedConnections = 0
+        self.rejectedRequests = 0
+        self._port = None
+        self._paused = False
+
+    def listening(self, port):
+        """
+        Set the listening port to pause while there are C{maxConnections}
+        connections, if C{pauseAccepting} is set.
+
+        @param port: The L{twisted.internet.interfaces.IListeningPort} of the
+            factory, e.g. as returned by C{reactor.listenTCP}; it must also
+            have the C{stopReading} and C{startReading} methods of the
+            reactor's own ports.
+        """
+        self._port = port
+        self._update()
+
+    def admitConnection(self):
+        """
+        @return: Whether to accept a new connection, rather than answering it
+            with L{rejectedProtocol}.
+        """
+        if (self.maxConnections is not None and
+                self.connections >= self.maxConnections):
+            self.rejectedConnections += 1
+            return False
+        return True
+
+    def rejectedProtocol(self):
+        """
+        @return: A protocol answering a connection over the limit with a 503
+            response.
+        """
+        return _Rejected(self.response, self.reactor, self.lingerTimeout)
+
+    def connectionMade(self):
+        self.connections += 1
+        self._update()
+
+    def connectionLost(self):
+        self.connections -= 1
+        self._update()
+
+    def _update(self):
+        """
+        Pause or resume accepting connections, depending on how many there
+        are.
+        """
+        if not self.pauseAccepting or self._port is None:
+            return
+        full = (self.maxConnections is not None and
+                self.connections >= self.maxConnections)
+        if full and not self._paused:
+            self._paused = True
+            self._port.stopReading()
+        elif not full and self._paused:
+            self._paused = False
+            self._port.startReading()
+
+    def acquire(self):
+        """
+        Start a handler call, unless C{maxInFlight} are in flight already.
+
+        @return: Whether the call may go ahead; if so, L{release} must be
+            called once it has produced its response.
+        """
+        if self.maxInFlight is not None and self.inFlight >= self.maxInFlight:
+            self.rejectedRequests += 1
+            return False
+        self.inFlight += 1
+        return True
+
+    def release(self):
+        """
+        A handler call started by L{acquire} has finished.
+        """
+        self.inFlight -= 1
@@ -0,0 +1,283 @@
+"""
+An in-memory cache of handler responses, shared by the connections of a
+server.
+
+Pass a L{ResponseCache} to L{toyhttp.server.HTTPFactory} as
+C{responseCache}.  Responses to C{GET} and C{HEAD} requests are stored
+keyed on the method, the path (including the query) and the values of the
+request headers named in C{vary}.  They are stored as
+L{toyhttp.server.PrerenderedResponse}s, so a hit skips both the handler and
+rendering the response head.  A C{HEAD} request is also answered by the
+stored response to the same C{GET} request, which the server writes without
+its body.
+
+What is stored, and for how long, follows C{Cache-Control}:
+
+    - A response's C{max-age} (or C{s-maxage}) gives its lifetime; without
+      one the cache's default C{ttl} is used.
+    - Responses marked C{no-store}, C{private} or C{no-cache}, responses
+      setting cookies, responses varying on headers the cache doesn't key
+      on, streamed responses, and responses with codes that aren't
+      cacheable by default are not stored.
+    - Requests marked C{no-store}, and requests with credentials or
+      conditional or range headers, bypass the cache.  Requests marked
+      C{no-cache} skip the stored response, but the fresh response replaces
+      it.
+
+While a miss is waiting for a handler's Deferred, further requests for the
+same key wait for the same response instead of calling the handler again.
+If the response can't be shared after all, each of them calls the handler
+for itself.
+
+The cache holds at most C{maxBytes} of rendered responses, evicting the
+least recently used first.
+"""
+
+import collections
+import time
+
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.python.failure import Failure
+
+from toyhttp.codec import Headers
+from toyhttp.server import Response, PrerenderedResponse
+
+
+# Responses with these codes may be stored without explicit freshness
+# information (RFC 7231, section 6.1), less partial content:
+_CACHEABLE_CODES = frozenset([200, 203, 204, 300, 301, 404, 405, 410, 414,
+                              501])
+
+# Requests with any of these headers are always passed to the handler:
+_BYPASS_HEADERS = ("Authorization", "If-None-Match", "If-Modified-Since",
+                   "If-Match", "If-Unmodified-Since", "If-Range", "Range")
+
+
+def _parseDirectives(value):
+    """
+    Parse a C{Cache-Control} header.
+
+    @return: A dictionary mapping lowercased directive names to their
+        values, or C{None} for directives without one.
+    """
+    directives = {}
+    if value:
+        for directive in value.split(","):
+            name, sep, argument = directive.partition("=")
+            name = name.strip().lower()
+            if name:
+                directives[name] = argument.strip().strip('"') if sep else None
+    return directives
+
+
+class ResponseCache(object):
+    """
+    A byte-bounded LRU cache of rendered responses.
+
+    @ivar hits: The number of requests answered from the cache.
+
+    @ivar misses: The number of requests the handler was called for because
+        nothing was stored for them.
+
+    @ivar coalesced: The number of requests that waited for the response to
+        an identical request already being handled.
+
+    @ivar bypassed: The number of requests the cache didn't apply to.
+
+    @ivar size: The number of bytes of responses stored.
+    """
+
+    def __init__(self, maxBytes=32 * 1024 * 1024, ttl=60, vary=(),
+                 maxEntrySize=1024 * 1024, methods=("GET", "HEAD"),
+                 clock=time.time):
+        """
+        @param maxBytes: The most bytes of rendered responses to keep.
+
+        @param ttl: Seconds a response without a C{max-age} is kept, or
+            C{None} to only store responses that have one.
+
+        @param vary: The names of the request headers, besides the method and
+            path, that responses depend on.
+
+        @param maxEntrySize: Larger responses are not stored.
+
+        @param methods: The request methods whose responses are stored.
+
+        @param clock: A function returning the current time, in seconds.
+        """
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.vary = tuple(vary)
+        self._varyNames = frozenset(name.lower() for name in vary)
+        self.maxEntrySize = maxEntrySize
+        self.methods = frozenset(methods)
+        self._clock = clock
+        # Maps keys to (response, expiry time) tuples, least recently used
+        # first:
+        self._entries = collections.OrderedDict()
+        # Maps the keys of misses waiting for a Deferred to lists of the
+        # (Deferred, arguments) of identical requests waiting with them:
+        self._inFlight = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bypassed = 0
+
+    def __len__(self):
+        """
+        @return: The number of responses stored.
+        """
+        return len(self._entries)
+
+    def clear(self):
+        """
+        Forget all stored responses.
+        """
+        self._entries.clear()
+        self.size = 0
+
+    def fetch(self, handler, method, path, headers, body):
+        """
+        Get the response to a request from the cache, or else from
+        C{handler}, storing it if possible.
+
+        @param handler: A function taking the method, path, headers and body
+            of a request and returning a response, or a Deferred firing with
+            one.
+
+        @return: A response, or a Deferred firing with one.
+        """
+        if method not in self.methods:
+            self.bypassed += 1
+            return handler(method, path, headers, body)
+        requestHeaders = headers
+        if not isinstance(requestHeaders, Headers):
+            requestHeaders = Headers(headers)
+        directives = _parseDirectives(requestHeaders.get("Cache-Control"))
+        if "no-store" in directives or any(
+                name in requestHeaders for name in _BYPASS_HEADERS):
+            self.bypassed += 1
+            return handler(method, path, headers, body)
+
+        key = (method, path) + tuple(
+            requestHeaders.get(name) for name in self.vary)
+        if "no-cache" not in directives:
+            response = self._lookup(key)
+            if (response is None and method == "HEAD" and
+                    "GET" in self.methods):
+                response = self._lookup(("GET",) + key[1:])
+            if response is not None:
+                self.hits += 1
+                return response
+        waiting = self._inFlight.get(key)
+        if waiting is not None:
+            self.coalesced += 1
+            d = Deferred()
+            waiting.append((d, (method, path, headers, body)))
+            return d
+
+        self.misses += 1
+        result = handler(method, path, headers, body)
+        if not isinstance(result, Deferred):
+            return self._store(key, result)
+        self._inFlight[key] = []
+        d = Deferred()
+        result.addBoth(self._handled, key, handler, d)
+        return d
+
+    def _lookup(self, key):
+        """
+        @return: The fresh response stored for C{key}, or C{None}.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        response, expires = entry
+        if expires <= self._clock():
+            self.size -= response.size()
+            return None
+        # Re-insert as the most recently used entry.
+        self._entries[key] = entry
+        return response
+
+    def _handled(self, result, key, handler, d):
+        """
+        The handler's Deferred for a miss has fired; pass the result on to
+        every request waiting for it.
+        """
+        waiting = self._inFlight.pop(key)
+        if isinstance(result, Failure):
+            d.errback(result)
+            for waiter, args in waiting:
+                waiter.errback(result)
+            return
+        response = self._store(key, result)
+        d.callback(response)
+        shared = isinstance(response, PrerenderedResponse)
+        for waiter, args in waiting:
+            if shared:
+                waiter.callback(response)
+            else:
+                maybeDeferred(handler, *args).chainDeferred(waiter)
+
+    def _store(self, key, response):
+        """
+        Store a response if it is cacheable.
+
+        @return: The response to write: the stored L{PrerenderedResponse}, or
+            C{response} itself if it wasn't stored.
+        """
+        ttl = self._freshness(response)
+        if ttl is None:
+            return response
+        if not isinstance(response, PrerenderedResponse):
+            response = PrerenderedResponse(response.code, response.body,
+                                           response.headers)
+        size = response.size()
+        if size > self.maxEntrySize:
+            return response
+        entries = self._entries
+        old = entries.pop(key, None)
+        if old is not None:
+            self.size -= old[0].size()
+        entries[key] = (response, self._clock() + ttl)
+        self.size += size
+        while self.size > self.maxBytes:
+            evicted, expires = entries.popitem(last=False)[1]
+            self.size -= evicted.size()
+        return response
+
+    def _freshness(self, response):
+        """
+        @return: The number of seconds C{response} may be stored for, or
+            C{None} if it mustn't be.
+        """
+        if (not isinstance(response, Response) or
+                not isinstance(response.body, str) or
+                response.code not in _CACHEABLE_CODES):
+            return None
+        headers = response.headers
+        if not isinstance(headers, Headers):
+            headers = Headers(headers)
+        if "Set-Cookie" in headers:
+            return None
+        vary = headers.get("Vary")
+        if vary:
+            for name in vary.split(","):
+                if name.strip().lower() not in self._varyNames:
+                    # Including "*".
+                    return None
+        directives = _parseDirectives(headers.get("Cache-Control"))
+        if ("no-store" in directives or "private" in directives or
+                "no-cache" in directives):
+            return None
+        for name in ("s-maxage", "max-age"):
+            maxAge = directives.get(name)
+            if maxAge is not None:
+                try:
+                    ttl = int(maxAge)
+                except ValueError:
+                    return None
+                return ttl if ttl > 0 else None
+        return self.ttl or None
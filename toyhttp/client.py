@@ -1,24 +1,307 @@
 """
 A toy HTTP client implementation.
 
-At this point you should know enough to manage on your own: you get to
-write both tests and code!
+L{getPage} sends a request and fires with the response.  Requests go through
+a L{ConnectionPool}, which keeps connections open between requests when the
+server allows it, opens at most C{maxPerHost} connections to each host, and
+queues further requests to a host until one of its connections is free.
+Responses are parsed by L{toyhttp.codec.ResponseParser}, which shares its
+machinery with the parser the server uses for requests.
+"""
 
-Some suggestions:
+import collections
+import urlparse
 
-* Since much of the byte-processing code in a client and server is similar
-  (HTTP requests and responses are mostly the same, except for the first
-  line), you might want to share the implementations. That is, refactor the
-  server protocol to rely on a parsing and rendering protocol base class that
-  can be specialized to support both client and server protocols. The base
-  protocol would know how to parse incoming data into a first line, a
-  dictionary of headers, and a body. It would also know how to write out a
-  first line, a dictionary of headers and a body to a transport.
+from twisted.internet.defer import Deferred, DeferredList, fail, succeed
+from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
+from twisted.internet.protocol import Protocol
+from twisted.python.failure import Failure
 
-* ClientCreator or endpoints will make your implementation simpler.
-"""
+from toyhttp.codec import (ResponseParser, ParseError, RESPONSE, DATA,
+                           isPersistent, renderRequestHead)
+from toyhttp.server import Response
+from toyhttp.timer import TimerWheel
+
+
+# Requests with these methods can safely be sent again if a reused connection
+# turns out to have been closed by the server:
+_IDEMPOTENT = frozenset(["GET", "HEAD", "OPTIONS", "TRACE", "PUT", "DELETE"])
+
+
+class ResponseFailed(Exception):
+    """
+    The response to a request couldn't be received completely.
+
+    @ivar reason: A L{Failure} describing why: the connection was lost, or
+        the server sent something that isn't a valid response.
+
+    @ivar received: Whether any of the response had been received.
+    """
+
+    def __init__(self, reason, received):
+        Exception.__init__(self, reason, received)
+        self.reason = reason
+        self.received = received
+
+
+class HTTPClientProtocol(Protocol):
+    """
+    The client side of a HTTP connection, sending one request at a time.
+
+    @ivar persistent: Whether the connection may be used for another request
+        now that the last response has been received.
+
+    @ivar closed: A Deferred firing with C{None} once the connection is lost.
+    """
+
+    def __init__(self):
+        self._parser = ResponseParser()
+        # The Deferred for the pending response:
+        self._finished = None
+        # The version, code and headers of the response being received:
+        self._response = None
+        self._body = None
+        self._received = False
+        self._close = False
+        self.persistent = False
+        self.closed = Deferred()
+
+    def request(self, method, path, headers, body, host, close=False):
+        """
+        Send a request.
+
+        @param host: The value for the C{Host} header.
+
+        @param close: Whether to ask the server to close the connection after
+            responding.
+
+        @return: A Deferred firing with a L{Response}, or failing with
+            L{ResponseFailed}.
+        """
+        d = self._finished = Deferred()
+        self._received = False
+        self._close = close
+        self.persistent = False
+        self._parser.expectResponse(method)
+        head = renderRequestHead(method, path, host, headers,
+                                 None if body is None else len(body), close)
+        if body:
+            self.transport.writeSequence([head, body])
+        else:
+            self.transport.write(head)
+        return d
+
+    def dataReceived(self, data):
+        if self._finished is None:
+            # Nothing was asked for.
+            self.transport.loseConnection()
+            return
+        self._received = True
+        self._parser.feed(data)
+        self._processResponse()
+
+    def _processResponse(self):
+        parser = self._parser
+        try:
+            while self._finished is not None:
+                event = parser.nextEvent()
+                if event is None:
+                    return
+                kind, value = event
+                if kind is DATA:
+                    self._body.append(value)
+                elif kind is RESPONSE:
+                    version, code, reason, headers = value
+                    self._response = version, code, headers
+                    self._body = []
+                elif self._response[1] >= 200:
+                    # The end of the final, rather than an interim, response.
+                    self._responseComplete()
+        except ParseError:
+            self._fail(Failure())
+            self.transport.loseConnection()
+
+    def _responseComplete(self):
+        version, code, headers = self._response
+        parser = self._parser
+        self.persistent = (not self._close and not parser.untilClose and
+                           not parser.pending() and
+                           isPersistent(version, parser.connection))
+        response = Response(code, "".join(self._body), headers)
+        d, self._finished = self._finished, None
+        self._response = self._body = None
+        d.callback(response)
+
+    def _fail(self, reason):
+        d, self._finished = self._finished, None
+        d.errback(ResponseFailed(reason, self._received))
 
-def getPage(url, method="GET", headers={}, body=None):
+    def connectionLost(self, reason):
+        self.connected = 0
+        self.persistent = False
+        if self._finished is not None and self._parser.connectionLost():
+            # The end of a body extending to the end of the connection.
+            self._processResponse()
+        if self._finished is not None:
+            self._fail(reason)
+        self.closed.callback(None)
+
+
+class ConnectionPool(object):
+    """
+    Persistent connections to HTTP servers, shared by the requests sent to
+    each.
+
+    @ivar maxPerHost: The number of connections opened to each host (and
+        port).  Requests sent while all of them are busy wait for one to be
+        free.
+
+    @ivar idleTimeout: Seconds an unused connection is kept open.
+
+    @ivar persistent: Whether to keep connections open at all; if C{False},
+        every request is sent on a new connection, which is closed after the
+        response.
+    """
+
+    def __init__(self, reactor=None, maxPerHost=4, idleTimeout=60,
+                 persistent=True):
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self.maxPerHost = maxPerHost
+        self.idleTimeout = idleTimeout
+        self.persistent = persistent
+        self._timers = TimerWheel(reactor)
+        # Maps (host, port) keys to:
+        # - the number of connections open or being opened,
+        self._open = {}
+        # - a list of unused connections, most recently used last,
+        self._idle = {}
+        # - a deque of Deferreds waiting for a connection.
+        self._waiting = {}
+        # Maps unused connections to their idle timers:
+        self._idleTimers = {}
+
+    def request(self, method, url, headers={}, body=None):
+        """
+        Send a request.
+
+        @return: A Deferred firing with a L{Response}.
+        """
+        parsed = urlparse.urlsplit(url)
+        if parsed.scheme != "http":
+            return fail(ValueError("Unsupported URL scheme: %r" %
+                                   (parsed.scheme,)))
+        key = (parsed.hostname, parsed.port or 80)
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        d = self._acquire(key)
+        d.addCallback(self._send, key, method, path, parsed.netloc, headers,
+                      body)
+        return d
+
+    def closeCachedConnections(self):
+        """
+        Close the unused connections.
+
+        @return: A Deferred firing once they are all closed.
+        """
+        closing = []
+        for idle in self._idle.values():
+            for protocol in idle:
+                closing.append(protocol.closed)
+                protocol.transport.loseConnection()
+        return DeferredList(closing)
+
+    def _acquire(self, key):
+        """
+        Get a connection to send a request on.
+
+        @return: A Deferred firing with the connection and whether it has
+            been used before.
+        """
+        idle = self._idle.get(key)
+        while idle:
+            protocol = idle.pop()
+            self._idleTimers.pop(protocol).cancel()
+            if protocol.connected:
+                return succeed((protocol, True))
+        if self._open.get(key, 0) < self.maxPerHost:
+            return self._connect(key)
+        d = Deferred()
+        self._waiting.setdefault(key, collections.deque()).append(d)
+        return d
+
+    def _connect(self, key):
+        self._open[key] = self._open.get(key, 0) + 1
+        protocol = HTTPClientProtocol()
+        protocol.closed.addCallback(lambda ignored: self._lost(key, protocol))
+
+        def failed(reason):
+            self._lost(key, None)
+            return reason
+
+        d = connectProtocol(TCP4ClientEndpoint(self._reactor, *key), protocol)
+        d.addCallbacks(lambda protocol: (protocol, False), failed)
+        return d
+
+    def _send(self, connection, key, method, path, host, headers, body):
+        protocol, reused = connection
+        d = protocol.request(method, path, headers, body, host,
+                             close=not self.persistent)
+        d.addBoth(self._responded, protocol, reused, key, method, path, host,
+                  headers, body)
+        return d
+
+    def _responded(self, result, protocol, reused, key, method, path, host,
+                   headers, body):
+        if isinstance(result, Failure):
+            protocol.transport.loseConnection()
+            if (reused and result.check(ResponseFailed) and
+                    not result.value.received and method in _IDEMPOTENT):
+                # The server closed the connection, which had been idle,
+                # before it got the request; try again.
+                d = self._acquire(key)
+                d.addCallback(self._send, key, method, path, host, headers,
+                              body)
+                return d
+        elif protocol.persistent:
+            self._release(key, protocol)
+        else:
+            protocol.transport.loseConnection()
+        return result
+
+    def _release(self, key, protocol):
+        """
+        A connection is free for another request.
+        """
+        waiting = self._waiting.get(key)
+        if waiting:
+            waiting.popleft().callback((protocol, True))
+            return
+        self._idle.setdefault(key, []).append(protocol)
+        self._idleTimers[protocol] = self._timers.schedule(
+            self.idleTimeout, protocol.transport.loseConnection)
+
+    def _lost(self, key, protocol):
+        """
+        A connection has been closed, or couldn't be opened.
+        """
+        self._open[key] -= 1
+        idle = self._idle.get(key)
+        if idle and protocol in idle:
+            idle.remove(protocol)
+            self._idleTimers.pop(protocol).cancel()
+        waiting = self._waiting.get(key)
+        if waiting and self._open[key] < self.maxPerHost:
+            self._connect(key).chainDeferred(waiting.popleft())
+
+
+_defaultPool = None
+
+
+def getPage(url, method="GET", headers={}, body=None, pool=None):
     """
     Send a HTTP request to the given url, using the given method, headers and
     optional body.
@@ -34,7 +317,15 @@ def getPage(url, method="GET", headers={}, body=None):
     @param body: Optional, the request body as bytes. If included, a
         Content-Length header will be added automatically.
 
+    @param pool: The L{ConnectionPool} to send the request with; by default a
+        pool shared by all callers.
+
     @return: A Deferred that fires with a Response object on success, or fires
        with an appropriate error.
     """
-    raise NotImplementedError()
+    global _defaultPool
+    if pool is None:
+        if _defaultPool is None:
+            _defaultPool = ConnectionPool()
+        pool = _defaultPool
+    return pool.request(method, url, headers, body)
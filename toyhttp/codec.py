@@ -0,0 +1,1006 @@
+"""
+Parsing and rendering of HTTP/1.x messages, shared by the server (which
+parses requests and renders responses) and the client (which does the
+opposite).
+
+The parser works on a single C{bytearray} per connection: incoming data is
+appended to it, the end of the message head is found with one scan for
+C{"\\r\\n\\r\\n"} (resuming where the previous scan stopped), and the head is
+then picked apart with precompiled patterns, without splitting it into a list
+of lines first.  Message bodies are framed by C{Content-Length} or chunked
+C{Transfer-Encoding} and handed out piece by piece as they arrive.
+"""
+
+import collections
+import re
+import urlparse
+
+from twisted.web.http import RESPONSES
+
+
+_REQUEST_LINE = re.compile(r"(\S+)[ \t]+(\S+)[ \t]+(HTTP/\d\.\d)[ \t]*\r\n")
+_STATUS_LINE = re.compile(
+    r"(HTTP/\d\.\d)[ \t]+(\d\d\d)(?:[ \t]+([^\r\n]*))?\r\n")
+_HEADER = re.compile(r"^([^:\r\n]+):[ \t]*([^\r\n]*)\r\n", re.M)
+# Matches header lines that are all valid, without picking them apart:
+_HEADER_LINES = re.compile(r"(?:[^:\r\n]+:[^\r\n]*\r\n)*\Z")
+# The headers the parser itself cares about, found without parsing the rest:
+_FRAMING_HEADER = re.compile(
+    r"^[ \t]*(content-length|transfer-encoding|connection|expect)[ \t]*:"
+    r"[ \t]*([^\r\n]*)\r\n", re.M | re.I)
+_CHUNK_SIZE = re.compile(r"([0-9a-fA-F]+)[ \t]*(?:;[^\r\n]*)?\Z")
+
+# Lengths of the header names the parser itself cares about, so other headers
+# can be skipped without lowercasing them:
+_SPECIAL_LENGTHS = frozenset(map(len, ["content-length", "transfer-encoding",
+                                       "connection", "expect"]))
+
+_HEAD_END = b"\r\n\r\n"
+_CRLF = b"\r\n"
+
+# Events returned by RequestParser.nextEvent() and ResponseParser.nextEvent():
+REQUEST = "request"
+RESPONSE = "response"
+DATA = "data"
+END = "end"
+
+# Parser states:
+_HEAD = 0
+_LENGTH = 1
+_CHUNK_SIZE_LINE = 2
+_CHUNK_DATA = 3
+_CHUNK_DATA_END = 4
+_TRAILERS = 5
+_DONE = 6
+_UNTIL_CLOSE = 7
+
+
+class ParseError(Exception):
+    """
+    Bytes were received that can't be parsed as a HTTP message.
+    """
+
+
+class BadRequest(ParseError):
+    """
+    The client sent bytes that can't be parsed as a HTTP request.
+
+    @cvar code: The status code of the response rejecting the request.
+    """
+
+    code = 400
+
+
+class RequestURITooLong(BadRequest):
+    """
+    A request line exceeded L{RequestParser.maxRequestLineSize}.
+    """
+
+    code = 414
+
+
+class HeaderFieldsTooLarge(BadRequest):
+    """
+    A request head exceeded L{RequestParser.maxHeadSize} or
+    L{RequestParser.maxHeaderCount}.
+    """
+
+    code = 431
+
+
+class BadResponse(ParseError):
+    """
+    The server sent bytes that can't be parsed as a HTTP response.
+    """
+
+
+def isPersistent(version, connection):
+    """
+    Whether a message with the given HTTP version and (lowercased)
+    C{Connection} header allows its connection to be reused.
+    """
+    tokens = ()
+    if connection is not None:
+        tokens = [t.strip() for t in connection.split(",")]
+    if version >= "HTTP/1.1":
+        return "close" not in tokens
+    return "keep-alive" in tokens
+
+
+# Lowercased header names, so the usual ones aren't lowercased over and over.
+# Peers can send any names, so only so many are remembered.
+_LOWER_NAMES = {}
+_MAX_LOWER_NAMES = 1000
+
+
+def _lower(name):
+    lowered = _LOWER_NAMES.get(name)
+    if lowered is None:
+        lowered = name.lower()
+        if len(_LOWER_NAMES) < _MAX_LOWER_NAMES:
+            _LOWER_NAMES[name] = lowered
+    return lowered
+
+
+class Headers(dict):
+    """
+    The headers of a HTTP message.
+
+    This is a dictionary mapping header names, as sent, to values, so it can
+    be iterated over and compared like one, but headers can also be looked
+    up (and replaced or deleted) by name case-insensitively.
+
+    A header that appears several times maps to its values joined with
+    C{", "}, which RFC 7230 makes equivalent to the separate values, except
+    for C{Set-Cookie}; L{getAll} returns the separate values.
+    """
+
+    # Maps lowercased names to names as stored; built when first needed:
+    _index = None
+    # Maps the names of headers with several values to the values:
+    _multi = None
+
+    def __init__(self, fields=()):
+        """
+        @param fields: A dictionary, or a sequence of C{(name, value)} pairs
+            which may repeat names.
+        """
+        dict.__init__(self)
+        if hasattr(fields, "iteritems"):
+            fields = fields.iteritems()
+        for name, value in fields:
+            self.add(name, value)
+
+    def _key(self, name):
+        """
+        @return: The name a header is stored under, or C{None}.
+        """
+        if dict.__contains__(self, name):
+            return name
+        index = self._index
+        if index is None:
+            index = self._buildIndex()
+        return index.get(_lower(name))
+
+    def _buildIndex(self):
+        index = self._index = {}
+        for name in dict.keys(self):
+            lowered = _lower(name)
+            key = index.get(lowered)
+            if key is None:
+                index[lowered] = name
+            else:
+                # The same header with names differing in case.
+                for value in self._values(name):
+                    self._append(key, value)
+                dict.__delitem__(self, name)
+                if self._multi:
+                    self._multi.pop(name, None)
+        return index
+
+    def _values(self, key):
+        multi = self._multi and self._multi.get(key)
+        if multi:
+            return list(multi)
+        return [dict.__getitem__(self, key)]
+
+    def _append(self, key, value):
+        """
+        Add another value for the header stored under C{key}.
+        """
+        if self._multi is None:
+            self._multi = {}
+        existing = dict.__getitem__(self, key)
+        values = self._multi.get(key)
+        if values is None:
+            values = self._multi[key] = [existing]
+        values.append(value)
+        dict.__setitem__(self, key, existing + ", " + value)
+
+    def _discard(self, key):
+        dict.__delitem__(self, key)
+        if self._multi:
+            self._multi.pop(key, None)
+        if self._index is not None:
+            del self._index[_lower(key)]
+
+    def __getitem__(self, name):
+        key = self._key(name)
+        if key is None:
+            raise KeyError(name)
+        return dict.__getitem__(self, key)
+
+    def get(self, name, default=None):
+        key = self._key(name)
+        if key is None:
+            return default
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, name):
+        return self._key(name) is not None
+
+    has_key = __contains__
+
+    def __setitem__(self, name, value):
+        key = self._key(name)
+        if key is not None:
+            self._discard(key)
+        dict.__setitem__(self, name, value)
+        if self._index is not None:
+            self._index[_lower(name)] = name
+
+    def __delitem__(self, name):
+        key = self._key(name)
+        if key is None:
+            raise KeyError(name)
+        self._discard(key)
+
+    def pop(self, name, *default):
+        key = self._key(name)
+        if key is None:
+            if default:
+                return default[0]
+            raise KeyError(name)
+        value = dict.__getitem__(self, key)
+        self._discard(key)
+        return value
+
+    def setdefault(self, name, value=None):
+        key = self._key(name)
+        if key is None:
+            self[name] = value
+            return value
+        return dict.__getitem__(self, key)
+
+    def update(self, fields=(), **kwargs):
+        if hasattr(fields, "iteritems"):
+            fields = fields.iteritems()
+        for name, value in fields:
+            self[name] = value
+        for name, value in kwargs.iteritems():
+            self[name] = value
+
+    def clear(self):
+        dict.clear(self)
+        self._index = self._multi = None
+
+    def copy(self):
+        return Headers(self.fields())
+
+    def getAll(self, name):
+        """
+        @return: The list of values of a header, in the order they were
+            added; empty if there is no such header.
+        """
+        key = self._key(name)
+        if key is None:
+            return []
+        return self._values(key)
+
+    def add(self, name, value):
+        """
+        Add a value for a header, keeping any values it already has.
+        """
+        key = self._key(name)
+        if key is None:
+            dict.__setitem__(self, name, value)
+            if self._index is not None:
+                self._index[_lower(name)] = name
+        else:
+            self._append(key, value)
+
+    def fields(self):
+        """
+        @return: A list of C{(name, value)} pairs, one for each value of each
+            header, as they are rendered.
+        """
+        multi = self._multi
+        if not multi:
+            return self.items()
+        fields = []
+        for name, value in self.iteritems():
+            values = multi.get(name)
+            if values is None:
+                fields.append((name, value))
+            else:
+                fields.extend([(name, value) for value in values])
+        return fields
+
+
+# Creates an empty Headers without the overhead of calling __init__:
+_newHeaders = dict.__new__
+
+
+def parseHeaders(lines):
+    """
+    Parse header lines, such as those left unparsed by a L{RequestParser}
+    with C{lazyHeaders} set, which have already been checked to be valid.
+
+    @param lines: The header lines, each ending with CRLF.
+
+    @return: The L{Headers}.
+    """
+    headers = _newHeaders(Headers)
+    store = dict.__setitem__
+    fields = _HEADER.findall(lines)
+    for name, value in fields:
+        store(headers, name.strip(), value.rstrip())
+    if len(headers) != len(fields):
+        # Some headers were repeated; add them up properly.
+        headers = Headers([(name.strip(), value.rstrip())
+                           for name, value in fields])
+    return headers
+
+
+def parseQuery(path):
+    """
+    Parse the query string of a request path.
+
+    @return: A dictionary mapping argument names to lists of values.
+    """
+    query = path.partition("?")[2]
+    if not query:
+        return {}
+    return urlparse.parse_qs(query)
+
+
+def parseCookies(header):
+    """
+    Parse the value of a C{Cookie} header.
+
+    @param header: The value, or C{None}.
+
+    @return: A dictionary mapping cookie names to values.  If a name is
+        repeated, its first value is kept, as the most specific one.
+    """
+    cookies = {}
+    if not header:
+        return cookies
+    for pair in header.split(";"):
+        name, sep, value = pair.partition("=")
+        name = name.strip()
+        if not sep or not name or name in cookies:
+            continue
+        value = value.strip()
+        if len(value) > 1 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+        cookies[name] = value
+    return cookies
+
+
+class _MessageParser(object):
+    """
+    The parts of incremental parsing that are the same for requests and
+    responses: buffering, finding and picking apart the message head, and
+    framing the body.
+
+    Subclasses implement C{_parseHead}, using L{_findHead}, L{_parseHeaders}
+    and L{_setFraming}.
+
+    @ivar bodyLength: After a head has been parsed, the length of the body
+        taken from its C{Content-Length} header (C{0} if there is no body), or
+        C{None} if the body uses chunked transfer-encoding or extends to the
+        end of the connection.
+
+    @ivar connection: After a head has been parsed, the lowercased value of
+        its C{Connection} header, or C{None}.
+
+    These limits, each of which may be C{None} to disable it, bound the
+    memory taken up by the lines of chunked bodies; like the limits on heads,
+    they are checked as soon as the buffered bytes exceed them:
+
+    @ivar maxChunkLineSize: The longest chunk-size line accepted, in bytes,
+        without its CRLF.
+
+    @ivar maxHeadSize: The largest trailer section accepted, in bytes.
+
+    @ivar maxHeaderCount: The largest number of trailer lines accepted.
+    """
+
+    _error = ParseError
+    # The error raised for trailers over the limits:
+    _tooLarge = ParseError
+    _headEvent = None
+
+    maxChunkLineSize = 4096
+    maxHeadSize = None
+    maxHeaderCount = None
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # Offset of the first unconsumed byte in _buffer:
+        self._start = 0
+        # Offset from which to resume scanning for the end of the head, or of
+        # a line:
+        self._scanned = 0
+        self._state = _HEAD
+        # Bytes left in the current body or chunk:
+        self._remaining = 0
+        # Bytes and lines of trailers read so far:
+        self._trailerSize = 0
+        self._trailerCount = 0
+        self._closed = False
+        self.bodyLength = 0
+        self.connection = None
+
+    def feed(self, data):
+        """
+        Add bytes received from the peer.
+        """
+        self._buffer += data
+
+    def pending(self):
+        """
+        @return: The number of buffered bytes not yet consumed by a parsed
+            event.
+        """
+        return len(self._buffer) - self._start
+
+    def unparsed(self):
+        """
+        Consume the buffered bytes not yet consumed by a parsed event, e.g.
+        those following a request after which the connection switched to
+        another protocol.
+        """
+        return self._read(self.pending()) or ""
+
+    def nextEvent(self):
+        """
+        Parse the next event from the buffer.
+
+        Each message produces a head event, followed by zero or more C{(DATA,
+        bytes)} events carrying the body as it arrives, and finally an C{(END,
+        None)} event.
+
+        @return: The next event, or C{None} if more data is needed.
+
+        @raise ParseError: If the buffered bytes aren't a valid message.
+        """
+        while True:
+            state = self._state
+            if state == _HEAD:
+                head = self._parseHead()
+                if head is None:
+                    return None
+                return self._headEvent, head
+            elif state == _DONE:
+                self._state = _HEAD
+                return END, None
+            elif state == _LENGTH or state == _CHUNK_DATA:
+                data = self._read(self._remaining)
+                if data is None:
+                    return None
+                self._remaining -= len(data)
+                if not self._remaining:
+                    if state == _LENGTH:
+                        self._state = _DONE
+                    else:
+                        self._state = _CHUNK_DATA_END
+                return DATA, data
+            elif state == _UNTIL_CLOSE:
+                data = self._read(self.pending())
+                if data is None:
+                    if self._closed:
+                        self._state = _HEAD
+                        return END, None
+                    return None
+                return DATA, data
+            elif state == _CHUNK_SIZE_LINE:
+                line = self._readLine(self.maxChunkLineSize, self._error,
+                                      "Chunk size line too long")
+                if line is None:
+                    return None
+                match = _CHUNK_SIZE.match(line)
+                if match is None:
+                    raise self._error("Bad chunk size")
+                self._remaining = int(match.group(1), 16)
+                if self._remaining:
+                    self._state = _CHUNK_DATA
+                else:
+                    self._state = _TRAILERS
+                    self._trailerSize = self._trailerCount = 0
+            elif state == _CHUNK_DATA_END:
+                line = self._readLine(0, self._error,
+                                      "Missing CRLF after chunk")
+                if line is None:
+                    return None
+                self._state = _CHUNK_SIZE_LINE
+            else:
+                limit = self.maxHeadSize
+                if limit is not None:
+                    limit -= self._trailerSize
+                line = self._readLine(limit, self._tooLarge,
+                                      "Trailers too large")
+                if line is None:
+                    return None
+                if not line:
+                    # An empty line ends the (ignored) trailers.
+                    self._state = _DONE
+                    continue
+                self._trailerSize += len(line) + 2
+                self._trailerCount += 1
+                if (self.maxHeaderCount is not None and
+                        self._trailerCount > self.maxHeaderCount):
+                    raise self._tooLarge("Too many trailers")
+
+    def connectionLost(self):
+        """
+        The connection has been closed.  If the current body extends to the
+        end of the connection it is now complete, and L{nextEvent} returns
+        its remaining data and its L{END} event.
+
+        @return: Whether the connection was closed between messages, or at
+            the end of a body extending to the end of the connection.
+        """
+        self._closed = True
+        if self._state == _UNTIL_CLOSE:
+            return True
+        return self._state == _HEAD and not self.pending()
+
+    def _findHead(self):
+        """
+        Consume the next message head from the buffer.
+
+        @return: The head, including the CRLF ending its last line but not
+            the empty line after it, or C{None} if the buffer doesn't hold a
+            complete head yet.
+        """
+        buf = self._buffer
+        start = self._start
+        # Peers may send stray CRLFs between pipelined messages.
+        while buf.startswith(_CRLF, start):
+            start += 2
+        self._start = start
+        end = buf.find(_HEAD_END, max(start, self._scanned - 3))
+        if end == -1:
+            self._scanned = len(buf)
+            if start == len(buf):
+                self._compact()
+            return None
+
+        # Include the CRLF ending the last line in the head, so every line
+        # has the same terminator.
+        head = str(buf[start:end + 2])
+        self._start = self._scanned = end + 4
+        self._compact()
+        return head
+
+    def _parseHeaders(self, head, pos):
+        """
+        Parse the header lines of a head, starting at offset C{pos}.
+
+        @return: The L{Headers}, and the values of the C{Content-Length},
+            C{Transfer-Encoding}, C{Connection} and C{Expect} headers (or
+            C{None} for those that are missing).
+        """
+        headers = _newHeaders(Headers)
+        # Bypass Headers' case-insensitive lookups while parsing.
+        store = dict.__setitem__
+        contentLength = transferEncoding = connection = expect = None
+        if pos < len(head):
+            fields = _HEADER.findall(head, pos)
+            # Every line must be a header; findall() skips those that aren't.
+            if len(fields) != head.count("\n", pos):
+                raise self._error("Bad header line")
+            for name, value in fields:
+                # strip() only copies when there is whitespace to remove.
+                name = name.strip()
+                value = value.rstrip()
+                store(headers, name, value)
+                if len(name) not in _SPECIAL_LENGTHS:
+                    continue
+                lowered = _lower(name)
+                if lowered == "content-length":
+                    if contentLength is not None and contentLength != value:
+                        raise self._error("Conflicting content-lengths")
+                    contentLength = value
+                elif lowered == "transfer-encoding":
+                    transferEncoding = (value if transferEncoding is None
+                                        else transferEncoding + ", " + value)
+                elif lowered == "connection":
+                    connection = (value if connection is None
+                                  else connection + ", " + value)
+                elif lowered == "expect":
+                    expect = value
+            if len(headers) != len(fields):
+                # Some headers were repeated; add them up properly.
+                headers = Headers([(name.strip(), value.rstrip())
+                                   for name, value in fields])
+        self.connection = connection and connection.lower()
+        return headers, contentLength, transferEncoding, expect
+
+    def _scanHeaders(self, head, pos):
+        """
+        Like L{_parseHeaders}, but only check that the header lines are valid
+        and pick out the headers the parser itself needs, leaving the lines
+        to be parsed by L{parseHeaders} if they are needed.
+
+        @return: The header lines, and the values of the C{Content-Length},
+            C{Transfer-Encoding}, C{Connection} and C{Expect} headers (or
+            C{None} for those that are missing).
+        """
+        if _HEADER_LINES.match(head, pos) is None:
+            raise self._error("Bad header line")
+        contentLength = transferEncoding = connection = expect = None
+        for name, value in _FRAMING_HEADER.findall(head, pos):
+            lowered = _lower(name)
+            value = value.rstrip()
+            if lowered == "content-length":
+                if contentLength is not None and contentLength != value:
+                    raise self._error("Conflicting content-lengths")
+                contentLength = value
+            elif lowered == "transfer-encoding":
+                transferEncoding = (value if transferEncoding is None
+                                    else transferEncoding + ", " + value)
+            elif lowered == "connection":
+                connection = (value if connection is None
+                              else connection + ", " + value)
+            else:
+                expect = value
+        self.connection = connection and connection.lower()
+        return head[pos:], contentLength, transferEncoding, expect
+
+    def _setFraming(self, contentLength, transferEncoding):
+        """
+        Get ready to read a body framed by the given C{Content-Length} and
+        C{Transfer-Encoding} header values, either of which may be C{None}.
+        """
+        if transferEncoding is not None:
+            if transferEncoding.lower() != "chunked":
+                raise self._error("Unsupported transfer-encoding")
+            self.bodyLength = None
+            self._state = _CHUNK_SIZE_LINE
+        elif contentLength is not None:
+            if not contentLength.isdigit():
+                raise self._error("Bad content-length")
+            self.bodyLength = self._remaining = int(contentLength)
+            self._state = _LENGTH if self._remaining else _DONE
+        else:
+            self.bodyLength = 0
+            self._state = _DONE
+
+    def _parseHead(self):
+        """
+        Parse the next message head from the buffer and set up framing of
+        its body.
+
+        @return: The value of the head event, or C{None} if the buffer
+            doesn't hold a complete head yet.
+        """
+        raise NotImplementedError()
+
+    def _read(self, size):
+        """
+        Consume up to C{size} buffered bytes.
+
+        @return: The bytes, or C{None} if the buffer is empty.
+        """
+        start = self._start
+        available = len(self._buffer) - start
+        if not available:
+            return None
+        if size > available:
+            size = available
+        data = str(self._buffer[start:start + size])
+        self._start = start + size
+        self._compact()
+        return data
+
+    def _readLine(self, limit, error, message):
+        """
+        Consume a CRLF-terminated line.  Only the bytes received since the
+        last call are searched for its end.
+
+        @param limit: The longest line accepted, without its terminator, or
+            C{None} for no limit.
+
+        @param error: The exception class to raise, with C{message}, if the
+            line is longer.
+
+        @return: The line without its terminator, or C{None} if the buffer
+            doesn't hold a complete line.
+        """
+        buf = self._buffer
+        start = self._start
+        end = buf.find(_CRLF, max(start, self._scanned - 1))
+        if end == -1:
+            self._scanned = len(buf)
+            if limit is not None and len(buf) - start > limit + 1:
+                raise error(message)
+            return None
+        if limit is not None and end - start > limit:
+            raise error(message)
+        line = str(buf[start:end])
+        self._start = self._scanned = end + 2
+        self._compact()
+        return line
+
+    def _compact(self):
+        """
+        Drop consumed bytes from the front of the buffer once they make up
+        most of it, so pipelined requests don't cause quadratic copying.
+        """
+        start = self._start
+        if start == len(self._buffer):
+            self._buffer = bytearray()
+            self._start = self._scanned = 0
+        elif start > 4096 and start * 2 > len(self._buffer):
+            del self._buffer[:start]
+            self._start = 0
+            self._scanned -= start
+
+
+class RequestParser(_MessageParser):
+    """
+    An incremental parser for a stream of (possibly pipelined) HTTP requests.
+
+    Feed it bytes as they arrive with L{feed}, and pull parsed events out with
+    L{nextEvent}.  Data belonging to events that haven't been pulled yet stays
+    buffered, so callers can stop pulling while they are busy answering a
+    request.
+
+    Each request produces a C{(REQUEST, (method, path, version, headers))}
+    event, where C{headers} maps header names (as sent) to values.  Request
+    bodies without C{Content-Length} or C{Transfer-Encoding} are empty.
+
+    @ivar expectContinue: After a L{REQUEST} event, whether the request has
+        an C{Expect: 100-continue} header.
+
+    @ivar lazyHeaders: Whether to leave headers unparsed: the C{headers} of
+        L{REQUEST} events are then the header lines of the request, checked
+        to be valid but otherwise as received, to be parsed with
+        L{parseHeaders} if they are needed at all.
+
+    These limits, each of which may be C{None} to disable it, bound the
+    memory a request head can take up; they are checked as soon as the
+    buffered bytes exceed them, without waiting for the rest of the head:
+
+    @ivar maxRequestLineSize: The longest request line accepted, in bytes,
+        without its CRLF; longer ones raise L{RequestURITooLong}.
+
+    @ivar maxHeadSize: The largest request head accepted, in bytes; larger
+        ones raise L{HeaderFieldsTooLarge}.  It also limits the trailers of
+        chunked bodies.
+
+    @ivar maxHeaderCount: The largest number of header lines accepted in a
+        request head; more raise L{HeaderFieldsTooLarge}.  It also limits
+        the trailers of chunked bodies.
+
+    Chunk-size lines longer than C{maxChunkLineSize} raise L{BadRequest}.
+    """
+
+    _error = BadRequest
+    _tooLarge = HeaderFieldsTooLarge
+    _headEvent = REQUEST
+
+    maxRequestLineSize = 8190
+    maxHeadSize = 64 * 1024
+    maxHeaderCount = 100
+    lazyHeaders = False
+
+    def __init__(self):
+        _MessageParser.__init__(self)
+        self.expectContinue = False
+
+    def _parseHead(self):
+        head = self._findHead()
+        if head is None:
+            self._checkPartialHead()
+            return None
+        if self.maxHeadSize is not None and len(head) > self.maxHeadSize:
+            raise HeaderFieldsTooLarge("Request head too large")
+        self._checkRequestLine(head, 0)
+        match = _REQUEST_LINE.match(head)
+        if match is None:
+            raise BadRequest("Bad request line")
+        if (self.maxHeaderCount is not None and
+                head.count("\n", match.end()) > self.maxHeaderCount):
+            raise HeaderFieldsTooLarge("Too many headers")
+        method, path, version = match.groups()
+        if self.lazyHeaders:
+            headers, contentLength, transferEncoding, expect = (
+                self._scanHeaders(head, match.end()))
+        else:
+            headers, contentLength, transferEncoding, expect = (
+                self._parseHeaders(head, match.end()))
+        self._setFraming(contentLength, transferEncoding)
+        self.expectContinue = (expect is not None and
+                               expect.lower() == "100-continue")
+        return method, path, version, headers
+
+    def _checkPartialHead(self):
+        """
+        Check the limits against the start of a head that hasn't been
+        received in full yet.
+        """
+        size = self.pending()
+        if self.maxRequestLineSize is not None and (
+                size > self.maxRequestLineSize):
+            self._checkRequestLine(self._buffer, self._start)
+        if self.maxHeadSize is not None and size > self.maxHeadSize:
+            raise HeaderFieldsTooLarge("Request head too large")
+
+    def _checkRequestLine(self, data, start):
+        """
+        Check that the request line starting at offset C{start} of C{data}
+        doesn't exceed L{maxRequestLineSize}.
+        """
+        limit = self.maxRequestLineSize
+        if limit is None or len(data) - start <= limit:
+            return
+        if data.find(_CRLF, start, start + limit + 2) == -1:
+            raise RequestURITooLong("Request line too long")
+
+
+class ResponseParser(_MessageParser):
+    """
+    An incremental parser for the responses to a sequence of HTTP requests.
+
+    Whether a response has a body depends on the request it answers, so call
+    L{expectResponse} for every request sent.  Each response produces a
+    C{(RESPONSE, (version, code, reason, headers))} event, where C{code} is
+    an integer.  Interim (1xx) responses produce their own events, without a
+    body, ahead of the final response.
+
+    @ivar untilClose: After a L{RESPONSE} event, whether the body extends to
+        the end of the connection, in which case L{connectionLost} must be
+        called to end it.
+    """
+
+    _error = BadResponse
+    _tooLarge = BadResponse
+    _headEvent = RESPONSE
+
+    def __init__(self):
+        _MessageParser.__init__(self)
+        self._methods = collections.deque()
+        self.untilClose = False
+
+    def expectResponse(self, method):
+        """
+        A request with the given method has been sent.
+        """
+        self._methods.append(method)
+
+    def _parseHead(self):
+        head = self._findHead()
+        if head is None:
+            return None
+        if not self._methods:
+            raise BadResponse("Unexpected response")
+        match = _STATUS_LINE.match(head)
+        if match is None:
+            raise BadResponse("Bad status line")
+        version, code, reason = match.groups()
+        code = int(code)
+        headers, contentLength, transferEncoding, expect = (
+            self._parseHeaders(head, match.end()))
+        self.untilClose = False
+        if code < 200:
+            self.bodyLength = 0
+            self._state = _DONE
+            return version, code, reason or "", headers
+        method = self._methods.popleft()
+        if method == "HEAD" or code in NO_BODY_CODES:
+            self.bodyLength = 0
+            self._state = _DONE
+        elif contentLength is None and (
+                transferEncoding is None or
+                transferEncoding.lower() != "chunked"):
+            self.bodyLength = None
+            self.untilClose = True
+            self._state = _UNTIL_CLOSE
+        else:
+            self._setFraming(contentLength, transferEncoding)
+        return version, code, reason or "", headers
+
+
+# Responses with these codes never have a body, so they must not announce a
+# Content-Length of their own:
+NO_BODY_CODES = frozenset([100, 101, 204, 304])
+
+# Reason phrases of codes missing from twisted.web.http.RESPONSES:
+_EXTRA_REASONS = {429: "Too Many Requests",
+                  431: "Request Header Fields Too Large"}
+
+_STATUS_LINES = dict((code, "HTTP/1.1 %d %s\r\n" % (code, reason))
+                     for code, reason in RESPONSES.items() +
+                     _EXTRA_REASONS.items())
+
+LAST_CHUNK = "0\r\n\r\n"
+
+
+def statusLine(code):
+    """
+    Return the pre-encoded status line, including the reason phrase and
+    trailing CRLF, for a HTTP status code.
+    """
+    line = _STATUS_LINES.get(code)
+    if line is None:
+        line = _STATUS_LINES[code] = "HTTP/1.1 %d Unknown Status\r\n" % (code,)
+    return line
+
+
+def renderHeaders(headers, parts):
+    """
+    Render header lines, appending them to the list C{parts}.
+
+    @param headers: L{Headers}, a dictionary, or a sequence of C{(name,
+        value)} pairs.
+    """
+    if isinstance(headers, Headers):
+        headers = headers.fields()
+    elif hasattr(headers, "iteritems"):
+        headers = headers.iteritems()
+    for name, value in headers:
+        parts.append(name + ": " + value + "\r\n")
+
+
+def renderResponseHead(code, headers, length=None, chunked=False,
+                       connection=None):
+    """
+    Render the head of a response, including the blank line ending it.
+
+    @param length: The length of the body, for a C{Content-Length} header,
+        or C{None}.
+
+    @param chunked: Whether to announce a chunked body, if C{length} is
+        C{None}.
+
+    @param connection: A value for a C{Connection} header, or C{None}.
+    """
+    parts = [statusLine(code)]
+    if length is not None:
+        parts.append("Content-Length: %d\r\n" % (length,))
+    elif chunked:
+        parts.append("Transfer-Encoding: chunked\r\n")
+    renderHeaders(headers, parts)
+    if connection is not None:
+        parts.append("Connection: " + connection + "\r\n")
+    parts.append("\r\n")
+    return "".join(parts)
+
+
+def renderRequestHead(method, path, host, headers, length=None,
+                      close=False):
+    """
+    Render the head of a request, including the blank line ending it.
+
+    @param host: A value for the C{Host} header, added unless C{headers} has
+        one.
+
+    @param length: The length of the body, for a C{Content-Length} header
+        (which replaces any in C{headers}), or C{None} if there is no body.
+
+    @param close: Whether to ask the server to close the connection after
+        responding.
+    """
+    if isinstance(headers, Headers):
+        headers = headers.fields()
+    elif hasattr(headers, "iteritems"):
+        headers = headers.iteritems()
+    parts = ["%s %s HTTP/1.1\r\n" % (method, path)]
+    hasHost = False
+    for name, value in headers:
+        lowered = _lower(name)
+        if lowered == "host":
+            hasHost = True
+        elif lowered == "content-length":
+            continue
+        parts.append(name + ": " + value + "\r\n")
+    if not hasHost:
+        parts.append("Host: " + host + "\r\n")
+    if length is not None:
+        parts.append("Content-Length: %d\r\n" % (length,))
+    if close:
+        parts.append("Connection: close\r\n")
+    parts.append("\r\n")
+    return "".join(parts)
+
+
+def encodeChunk(data):
+    """
+    @return: The pieces of a chunk of a chunked body carrying C{data}, for
+        C{writeSequence}.
+    """
+    return ["%x\r\n" % (len(data),), data, "\r\n"]
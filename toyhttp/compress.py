@@ -0,0 +1,305 @@
+"""
+Negotiated gzip and deflate compression of response bodies.
+
+Pass a L{Compressor} to L{toyhttp.server.HTTPFactory} as C{compressor}.
+Responses are compressed when the client's C{Accept-Encoding} allows it,
+their content type is in the allowlist, and their body is at least
+C{minSize} bytes, or of unknown length.  Empty bodies, and the responses
+to C{HEAD} requests, which are written without their body, are left as
+they are.
+
+    - Bodies up to C{offloadSize} bytes are compressed in the reactor
+      thread; larger ones are compressed in the server's handler pool
+      (C{zlib} releases the GIL while it works), and sent uncompressed if
+      the pool is saturated.
+    - Streamed bodies are compressed a slice at a time as they are written,
+      so the compressed body is never held in memory as a whole.
+    - Compressed bodies are kept in an LRU cache bounded by C{cacheBytes},
+      so a body sent over and over (e.g. from a
+      L{toyhttp.cache.ResponseCache}) is only compressed once.
+
+Compressed responses get a weak version of their C{ETag}, since they are
+no longer byte-for-byte the same as the uncompressed ones.
+"""
+
+import collections
+import zlib
+
+from twisted.internet.defer import CancelledError
+from twisted.web.iweb import IBodyProducer
+
+from toyhttp.codec import Headers
+from toyhttp.offload import PoolSaturated
+from toyhttp.server import Response, StreamingResponse
+
+
+GZIP = "gzip"
+DEFLATE = "deflate"
+
+# The window bits telling zlib which container to use:
+_WBITS = {GZIP: 16 + zlib.MAX_WBITS, DEFLATE: zlib.MAX_WBITS}
+
+# Compressed responses must not claim these codes' semantics:
+_COMPRESSIBLE_CODES = frozenset([200, 201, 202, 203, 300, 301, 400, 403, 404,
+                                 405, 410, 500])
+
+_DEFAULT_TYPES = ("text/", "application/json", "application/javascript",
+                  "application/xml", "application/xhtml+xml",
+                  "image/svg+xml")
+
+# Parsed Accept-Encoding headers; clients send only a few different ones.
+_NEGOTIATED = {}
+_MAX_NEGOTIATED = 100
+
+
+def negotiate(acceptEncoding):
+    """
+    Choose a content-coding for a response.
+
+    @param acceptEncoding: The request's C{Accept-Encoding} header, or
+        C{None}.
+
+    @return: L{GZIP}, L{DEFLATE}, or C{None} to leave the body as it is.
+    """
+    if not acceptEncoding:
+        return None
+    encoding = _NEGOTIATED.get(acceptEncoding, False)
+    if encoding is not False:
+        return encoding
+    qualities = {}
+    for coding in acceptEncoding.split(","):
+        coding, sep, params = coding.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, sep, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    encoding = None
+    best = 0.0
+    for coding in (GZIP, DEFLATE):
+        quality = qualities.get(coding, qualities.get("*", 0.0))
+        if quality > best:
+            encoding, best = coding, quality
+    if len(_NEGOTIATED) < _MAX_NEGOTIATED:
+        _NEGOTIATED[acceptEncoding] = encoding
+    return encoding
+
+
+class _CompressedBody(object):
+    """
+    A streamed body compressing another, file-like or iterable, body a piece
+    at a time as it is iterated over.
+    """
+
+    def __init__(self, body, encoding, level, sliceSize):
+        self._body = body
+        if hasattr(body, "read"):
+            self._pieces = iter(lambda: body.read(sliceSize), "")
+        else:
+            self._pieces = iter(body)
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                            _WBITS[encoding])
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        compressor = self._compressor
+        if compressor is None:
+            raise StopIteration()
+        for data in self._pieces:
+            data = compressor.compress(data)
+            if data:
+                return data
+        self._compressor = None
+        return compressor.flush()
+
+    def close(self):
+        close = getattr(self._body, "close", None)
+        if close is not None:
+            close()
+
+
+class Compressor(object):
+    """
+    Compress response bodies according to the client's C{Accept-Encoding}.
+
+    @ivar compressed: The number of responses compressed.
+
+    @ivar cacheHits: The number of responses whose compressed body was taken
+        from the cache.
+    """
+
+    sliceSize = 64 * 1024
+
+    def __init__(self, minSize=1024, contentTypes=_DEFAULT_TYPES, level=6,
+                 offloadSize=256 * 1024, cacheBytes=16 * 1024 * 1024):
+        """
+        @param minSize: Smaller bodies aren't compressed.
+
+        @param contentTypes: The content types, or prefixes of content
+            types ending in C{/}, of the responses to compress.
+
+        @param level: The C{zlib} compression level.
+
+        @param offloadSize: Bodies larger than this are compressed in a
+            thread.
+
+        @param cacheBytes: The most bytes of uncompressed and compressed
+            bodies kept in the cache of compressed bodies.
+        """
+        self.minSize = minSize
+        self._types = frozenset(t for t in contentTypes
+                                if not t.endswith("/"))
+        self._prefixes = tuple(t for t in contentTypes if t.endswith("/"))
+        self.level = level
+        self.offloadSize = offloadSize
+        self.cacheBytes = cacheBytes
+        # Maps (encoding, body) to compressed bodies, least recently used
+        # first:
+        self._cache = collections.OrderedDict()
+        self._cacheSize = 0
+        self.compressed = 0
+        self.cacheHits = 0
+
+    def compress(self, response, acceptEncoding, pool=None, headOnly=False):
+        """
+        Compress a response if it is worth it and the client accepts it.
+
+        @param acceptEncoding: The request's C{Accept-Encoding} header, or
+            C{None}.
+
+        @param pool: The L{toyhttp.offload.HandlerPool} to compress large
+            bodies in, or C{None} to compress them in the calling thread.
+
+        @param headOnly: Whether only the head of the response will be
+            written, as for a C{HEAD} request; the body is then left as it
+            is.
+
+        @return: The response to send, or a Deferred firing with it.
+        """
+        if not self._compressible(response):
+            return response
+        headers = Headers(response.headers)
+        headers.add("Vary", "Accept-Encoding")
+        encoding = negotiate(acceptEncoding)
+        body = response.body
+        if (encoding is None or headOnly or
+                (not body and isinstance(body, (str, tuple, list)))):
+            # Nothing will be written that compressing would shrink:
+            return self._replace(response, body, headers)
+
+        if not isinstance(body, str):
+            self.compressed += 1
+            body = _CompressedBody(body, encoding, self.level, self.sliceSize)
+            return StreamingResponse(response.code, body,
+                                     self._encoded(headers, encoding))
+
+        key = (encoding, body)
+        compressed = self._cache.pop(key, None)
+        if compressed is not None:
+            self.cacheHits += 1
+            self._cache[key] = compressed
+            return self._compressed(response, headers, encoding, compressed)
+        if pool is None or len(body) <= self.offloadSize:
+            compressed = self._compress(body, encoding)
+            self._store(key, compressed)
+            return self._compressed(response, headers, encoding, compressed)
+
+        try:
+            d = pool.submit(self._compress, body, encoding)
+        except PoolSaturated:
+            return self._replace(response, body, headers)
+
+        def compressed(compressed):
+            self._store(key, compressed)
+            return self._compressed(response, headers, encoding, compressed)
+
+        def failed(reason):
+            if reason.check(CancelledError):
+                # The connection was lost; there is no one to answer.
+                return reason
+            return self._replace(response, body, headers)
+
+        return d.addCallbacks(compressed, failed)
+
+    def _compressible(self, response):
+        """
+        Whether a response is worth compressing, ignoring the request.
+        """
+        if response.code not in _COMPRESSIBLE_CODES:
+            return False
+        body = response.body
+        if isinstance(response, StreamingResponse):
+            if IBodyProducer.providedBy(body):
+                return False
+            if (response.length is not None and
+                    response.length < self.minSize):
+                return False
+        elif not isinstance(body, str) or len(body) < self.minSize:
+            return False
+        headers = response.headers
+        if not isinstance(headers, Headers):
+            headers = Headers(headers)
+        if ("Content-Encoding" in headers or "Content-Range" in headers or
+                "no-transform" in headers.get("Cache-Control", "")):
+            return False
+        contentType = headers.get("Content-Type")
+        if contentType is None:
+            return False
+        contentType = contentType.partition(";")[0].strip().lower()
+        return (contentType in self._types or
+                contentType.startswith(self._prefixes))
+
+    def _compress(self, body, encoding):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                      _WBITS[encoding])
+        return compressor.compress(body) + compressor.flush()
+
+    def _compressed(self, response, headers, encoding, compressed):
+        """
+        @return: A response with a compressed body, unless compression
+            didn't make it smaller.
+        """
+        if len(compressed) >= len(response.body):
+            return self._replace(response, response.body, headers)
+        self.compressed += 1
+        return Response(response.code, compressed,
+                        self._encoded(headers, encoding))
+
+    def _encoded(self, headers, encoding):
+        """
+        Update the headers of a response for its compressed body.
+        """
+        headers["Content-Encoding"] = encoding
+        headers.pop("Content-Length", None)
+        etag = headers.get("ETag")
+        if etag is not None and not etag.startswith("W/"):
+            headers["ETag"] = "W/" + etag
+        return headers
+
+    def _replace(self, response, body, headers):
+        """
+        @return: A copy of C{response} with a new body and headers.
+        """
+        if isinstance(response, StreamingResponse):
+            length = response.length if body is response.body else None
+            return StreamingResponse(response.code, body, headers, length)
+        return Response(response.code, body, headers)
+
+    def _store(self, key, compressed):
+        size = len(key[1]) + len(compressed)
+        if size > self.cacheBytes // 8:
+            return
+        cache = self._cache
+        if key in cache:
+            return
+        cache[key] = compressed
+        self._cacheSize += size
+        while self._cacheSize > self.cacheBytes:
+            (encoding, body), old = cache.popitem(last=False)
+            self._cacheSize -= len(body) + len(old)
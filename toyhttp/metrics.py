@@ -0,0 +1,327 @@
+"""
+Server metrics, exposed in the Prometheus text format.
+
+Pass a L{Metrics} to L{toyhttp.server.HTTPFactory} as C{metrics} and its
+connections record:
+
+    - The number of open connections, and of connections made.
+    - Bytes received and sent.
+    - Responses, by status code.
+    - Connections aborted by each kind of timeout.
+    - Latency histograms, by route, of three phases of one request in
+      every C{sampleEvery}: C{parse}, from the first byte of the request
+      until it has been received in full; C{handler}, until the handler has
+      produced the response; and C{write}, until the response has been
+      handed to the transport in full.
+
+Requests for C{Metrics.path} (by default C{/metrics}) are answered with the
+metrics rather than passed to the handler.
+
+Counting is a few additions and dictionary lookups per request.  Timing
+the phases of a request costs as much again, in reading the clock and
+labelling the route, so it is only done for a sample of the requests; the
+durations are appended to a list, and sorted into the histogram buckets in
+batches, with a binary search each.  C{benchmarks/bench_metrics.py}
+measures the cost against a trivial handler.
+"""
+
+import bisect
+import collections
+import functools
+import itertools
+import time
+
+from toyhttp.server import Response
+
+
+# Latency histogram bucket boundaries, in seconds:
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PHASES = ("parse", "handler", "write")
+
+_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    """
+    Escape a label value.
+    """
+    return (value.replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Histogram(object):
+    """
+    Counts of observed values falling in each of a set of buckets.
+
+    Values may also be appended to C{pending}, which is cheaper than
+    L{observe} (its C{append} can be called without a Python method call);
+    they are only counted once L{flush} is called.
+
+    @ivar counts: The number of values in each bucket (not cumulative), the
+        last being for values above all the boundaries.
+
+    @ivar pending: Values recorded but not counted yet.
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count", "pending", "_bucket")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.pending = []
+        self._bucket = functools.partial(bisect.bisect_left, buckets)
+
+    def observe(self, value):
+        self.counts[self._bucket(value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def flush(self):
+        """
+        Count the values in C{pending}.
+        """
+        pending = self.pending
+        if not pending:
+            return
+        counts = self.counts
+        for index in map(self._bucket, pending):
+            counts[index] += 1
+        self.sum += sum(pending)
+        self.count += len(pending)
+        del pending[:]
+
+    def render(self, name, labels, lines):
+        """
+        Append the Prometheus sample lines of the histogram to C{lines}.
+
+        @param labels: The rendered labels, e.g. C{'route="/"'}.
+        """
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append('%s_bucket{%s,le="%s"} %d' %
+                         (name, labels, _number(bound), cumulative))
+        lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels,
+                                                    self.count))
+        lines.append("%s_sum{%s} %s" % (name, labels, _number(self.sum)))
+        lines.append("%s_count{%s} %d" % (name, labels, self.count))
+
+
+class Metrics(object):
+    """
+    Counters and histograms describing a server's connections and requests.
+
+    @ivar path: The request path the metrics are served at, or C{None}.
+
+    @ivar routeLabel: A function called with the method and path of a
+        request, returning the name of its route for the latency histograms
+        (e.g. L{toyhttp.router.Router.label}), or C{None}.  Once
+        C{maxRoutes} routes have been seen, further ones are counted as
+        C{"other"}.
+
+    @ivar sampleEvery: The phases of one request in this many are timed,
+        starting with the first; 1 to time every request, or C{None} for no
+        latency histograms.  The histograms' counts are of the requests
+        timed.  It can't be changed once the metrics are created.
+
+    @ivar maxPending: The number of requests whose phases are recorded
+        before the durations are counted in the histograms (which rendering
+        also does).
+    """
+
+    maxPending = 1000
+
+    def __init__(self, path="/metrics", routeLabel=None,
+                 buckets=DEFAULT_BUCKETS, maxRoutes=100, sampleEvery=20,
+                 clock=time.time):
+        self.path = path
+        self.routeLabel = routeLabel
+        self.buckets = tuple(buckets)
+        self.maxRoutes = maxRoutes
+        self.sampleEvery = sampleEvery
+        self.clock = clock
+        self.connectionsActive = 0
+        self.connectionsTotal = 0
+        self.bytesReceived = 0
+        self.bytesSent = 0
+        # Maps status codes to the number of responses with them:
+        self.responses = collections.defaultdict(int)
+        # Maps kinds of timeouts to the number of connections they aborted:
+        self.timeouts = collections.defaultdict(int)
+        # Maps (route, phase) to histograms:
+        self._latencies = {}
+        # Maps routes to the histograms of their phases, in PHASES order:
+        self._routes = {}
+        # Maps routes to the append methods of the pending values of those
+        # histograms, and labels returned by routeLabel to the same for the
+        # route they are recorded under, up to maxRoutes of them:
+        self._recorders = {}
+        # Requests recorded since the histograms were last flushed:
+        self._unflushed = 0
+        if sampleEvery is None:
+            samples = itertools.repeat(False)
+        else:
+            samples = itertools.cycle([True] + [False] * (sampleEvery - 1))
+        # Called for each request as it starts, returning whether to time
+        # its phases, recording them with recorders; like the recorders, it
+        # is a builtin's method, cheaper to call than one of ours:
+        self.sampled = samples.next
+
+    def recorders(self, method, path):
+        """
+        Start recording a request whose phases are timed.
+
+        @return: Functions recording how long each phase of the request
+            took, in L{PHASES} order.
+        """
+        if self.routeLabel is None:
+            route = "*"
+        else:
+            route = self.routeLabel(method, path)
+        recorders = self._recorders.get(route)
+        if recorders is None:
+            recorders = self._addRecorders(route)
+        self._unflushed += 1
+        if self._unflushed >= self.maxPending:
+            self.flush()
+        return recorders
+
+    def _addRecorders(self, label):
+        """
+        @param label: A label returned by C{routeLabel}.
+
+        @return: The recorders of the route L{label} is recorded under.
+        """
+        route = self._bounded(label)
+        recorders = self._recorders.get(route)
+        if recorders is None:
+            recorders = self._recorders[route] = tuple(
+                histogram.pending.append
+                for histogram in self._histograms(route))
+        if len(self._recorders) < 2 * self.maxRoutes:
+            self._recorders[label] = recorders
+        return recorders
+
+    def flush(self):
+        """
+        Count the pending durations in the histograms.
+        """
+        self._unflushed = 0
+        for histogram in self._latencies.itervalues():
+            histogram.flush()
+
+    def _bounded(self, route):
+        """
+        @param route: A label returned by C{routeLabel}, or C{None}.
+
+        @return: The label to record a request for C{route} under.
+        """
+        if route is None:
+            route = "none"
+        if route not in self._routes and len(self._routes) >= self.maxRoutes:
+            return "other"
+        return route
+
+    def _histograms(self, route):
+        histograms = self._routes.get(route)
+        if histograms is None:
+            histograms = self._routes[route] = tuple(
+                self._histogram(route, phase) for phase in PHASES)
+        return histograms
+
+    def _histogram(self, route, phase):
+        histogram = self._latencies.get((route, phase))
+        if histogram is None:
+            histogram = self._latencies[route, phase] = Histogram(
+                self.buckets)
+        return histogram
+
+    def responseWritten(self, code, size):
+        """
+        Record a response with the given code, whose head (and body, if
+        written in one piece) is C{size} bytes.
+        """
+        self.responses[code] += 1
+        self.bytesSent += size
+
+    def timedOut(self, kind):
+        """
+        Record a connection aborted by a timeout of the given kind.
+        """
+        self.timeouts[kind] += 1
+
+    def render(self, handlerPool=None):
+        """
+        Render the metrics in the Prometheus text format.
+
+        @param handlerPool: A L{toyhttp.offload.HandlerPool} whose queue to
+            describe too, or C{None}.
+        """
+        self.flush()
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for labels, value in samples:
+                if labels:
+                    lines.append("%s{%s} %s" % (name, labels, _number(value)))
+                else:
+                    lines.append("%s %s" % (name, _number(value)))
+
+        metric("toyhttp_connections_active", "gauge",
+               "Open connections.", [("", self.connectionsActive)])
+        metric("toyhttp_connections_total", "counter",
+               "Connections made.", [("", self.connectionsTotal)])
+        metric("toyhttp_received_bytes_total", "counter",
+               "Bytes received.", [("", self.bytesReceived)])
+        metric("toyhttp_sent_bytes_total", "counter",
+               "Bytes of responses sent.", [("", self.bytesSent)])
+        metric("toyhttp_responses_total", "counter",
+               "Responses, by status code.",
+               [('code="%d"' % (code,), count)
+                for code, count in sorted(self.responses.iteritems())])
+        metric("toyhttp_timeouts_total", "counter",
+               "Connections aborted by timeouts, by kind.",
+               [('kind="%s"' % (kind,), count)
+                for kind, count in sorted(self.timeouts.iteritems())])
+        name = "toyhttp_request_phase_seconds"
+        lines.append("# HELP %s Latency of each phase of requests, by "
+                     "route." % (name,))
+        lines.append("# TYPE %s histogram" % (name,))
+        for (route, phase), histogram in sorted(self._latencies.iteritems()):
+            histogram.render(name, 'route="%s",phase="%s"' %
+                             (_escape(route), phase), lines)
+        if handlerPool is not None:
+            waits = handlerPool.waits
+            metric("toyhttp_handler_pool_queued", "gauge",
+                   "Calls waiting for a thread.", [("", handlerPool.queued)])
+            metric("toyhttp_handler_pool_calls_total", "counter",
+                   "Calls that have started running in a thread.",
+                   [("", waits.count)])
+            metric("toyhttp_handler_pool_wait_seconds_total", "counter",
+                   "Total time calls waited for a thread.",
+                   [("", waits.total)])
+            metric("toyhttp_handler_pool_rejected_total", "counter",
+                   "Calls rejected because the queue was full.",
+                   [("", waits.rejected)])
+        lines.append("")
+        return "\n".join(lines)
+
+    def response(self, handlerPool=None):
+        """
+        @return: A L{Response} with the rendered metrics.
+        """
+        return Response(200, self.render(handlerPool),
+                        {"Content-Type": _CONTENT_TYPE,
+                         "Cache-Control": "no-store"})
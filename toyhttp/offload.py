@@ -0,0 +1,185 @@
+"""
+Run blocking request handlers in a thread pool, so they don't stall every
+other connection served by the reactor.
+
+Which handlers run in the pool depends on the execution mode of the
+L{toyhttp.server.HTTPFactory}:
+
+    - L{REACTOR} (the default): handlers run in the reactor thread, except
+      those marked with L{blocking}.
+    - L{THREADS}: handlers run in the pool, except those marked with
+      L{nonblocking}.  Handlers that return Deferreds (or otherwise use
+      Twisted APIs) must be marked C{nonblocking}, since Twisted APIs may
+      only be used from the reactor thread.
+
+Handlers are marked by their C{blocking} attribute, which the decorators
+below set on functions; classes of callable handlers can set it themselves.
+"""
+
+import threading
+import time
+
+from twisted.internet.defer import Deferred
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+
+REACTOR = "reactor"
+THREADS = "threads"
+
+
+def blocking(handler):
+    """
+    Mark a handler as blocking, so it is run in the thread pool.
+    """
+    handler.blocking = True
+    return handler
+
+
+def nonblocking(handler):
+    """
+    Mark a handler as non-blocking, so it is run in the reactor thread even
+    in L{THREADS} mode.
+    """
+    handler.blocking = False
+    return handler
+
+
+def runsInPool(handler, execution):
+    """
+    Whether a handler should be run in the pool in the given execution mode.
+    """
+    marked = getattr(handler, "blocking", None)
+    if marked is None:
+        return execution == THREADS
+    return marked
+
+
+class PoolSaturated(Exception):
+    """
+    A handler couldn't be run because the pool's queue is full.
+    """
+
+
+class WaitStats(object):
+    """
+    Statistics on how long calls waited in the queue for a free thread.
+
+    @ivar count: The number of calls that have started running.
+
+    @ivar total: Their total waiting time, in seconds.
+
+    @ivar maximum: The longest wait, in seconds.
+
+    @ivar rejected: The number of calls rejected because the queue was full.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.rejected = 0
+
+    def record(self, wait):
+        self.count += 1
+        self.total += wait
+        if wait > self.maximum:
+            self.maximum = wait
+
+    def mean(self):
+        """
+        @return: The mean waiting time in seconds, or C{0.0} if no call has
+            run yet.
+        """
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+
+class HandlerPool(object):
+    """
+    A bounded pool of threads running blocking handlers.
+
+    The threads are only started when the first handler is submitted, and
+    are stopped when the reactor shuts down.
+
+    @ivar maxQueued: The number of calls allowed to wait for a free thread,
+        or C{None} for no limit.  Further calls are rejected with
+        L{PoolSaturated}, which the server answers with a 503 response.
+
+    @ivar queued: The number of calls currently waiting for a free thread.
+
+    @ivar waits: The L{WaitStats} of the calls run in the pool.
+    """
+
+    def __init__(self, maxThreads=10, maxQueued=100, reactor=None,
+                 threadPool=None, clock=time.time):
+        """
+        @param maxThreads: The number of threads in the pool.
+
+        @param threadPool: The L{ThreadPool} to use, instead of creating one
+            with C{maxThreads} threads.
+
+        @param clock: A function returning the current time in seconds,
+            called from the pool's threads.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        if threadPool is None:
+            threadPool = ThreadPool(0, maxThreads, "toyhttp-handlers")
+        self._threadPool = threadPool
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._started = False
+        self.maxQueued = maxQueued
+        self.queued = 0
+        self.waits = WaitStats()
+
+    def submit(self, f, *args, **kwargs):
+        """
+        Call C{f} with C{args} and C{kwargs} in a thread from the pool.
+
+        @return: A Deferred firing with the result of the call.  Cancelling
+            it while the call is still queued means C{f} is never called.
+
+        @raise PoolSaturated: If C{maxQueued} calls are already waiting.
+        """
+        with self._lock:
+            if self.maxQueued is not None and self.queued >= self.maxQueued:
+                self.waits.rejected += 1
+                raise PoolSaturated()
+            self.queued += 1
+        if not self._started:
+            self._started = True
+            self._threadPool.start()
+            self._reactor.addSystemEventTrigger("during", "shutdown",
+                                                self.stop)
+        submitted = self._clock()
+        # Set from the reactor thread if the Deferred is cancelled:
+        cancelled = []
+
+        def run():
+            with self._lock:
+                self.queued -= 1
+                self.waits.record(self._clock() - submitted)
+            if cancelled:
+                return None
+            return f(*args, **kwargs)
+
+        def deliver(result):
+            if not d.called:
+                d.callback(result)
+
+        d = Deferred(lambda d: cancelled.append(True))
+        deferToThreadPool(self._reactor, self._threadPool, run).addBoth(
+            deliver)
+        return d
+
+    def stop(self):
+        """
+        Stop the pool's threads, once they have finished their current calls.
+        """
+        if self._started:
+            self._started = False
+            self._threadPool.stop()
@@ -0,0 +1,374 @@
+"""
+Serve a handler from several pre-forked worker processes, one per core.
+
+A single reactor only ever uses one core.  The launcher here creates the
+listening socket once and forks worker processes that each adopt it into
+their own reactor and accept connections from it, so the kernel spreads
+connections across the workers.  Alternatively each worker can bind its own
+socket with C{SO_REUSEPORT} (Linux 3.9 and later), which makes the kernel
+balance connections between the sockets instead of waking every worker for
+each one.
+
+A supervisor process restarts workers that die, and replaces all of them one
+at a time on C{SIGHUP}: each new worker is started, and accepting
+connections, before the worker it replaces is told to stop, and stopping
+workers finish the requests they are serving before they exit.  C{SIGTERM}
+or C{SIGINT} stops all workers the same way, and then the supervisor.
+
+    $ python -m toyhttp.prefork [--port 8080] [--workers N] [--reuse-port] \\
+          demo1.Handler
+
+The handler is named by its fully qualified Python name.  If it is a class,
+each worker calls it with no arguments to get the handler.  It is only
+imported in the workers, after they have been forked, so that no reactor is
+created before forking.
+"""
+
+import errno
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from twisted.python import log
+
+
+# Python 2 doesn't know about SO_REUSEPORT; this is its value on Linux.
+SO_REUSEPORT = getattr(socket, "SO_REUSEPORT", 15)
+
+
+def listen(port, interface="", backlog=128, reusePort=False):
+    """
+    Create a non-blocking listening TCP socket.
+
+    @param reusePort: Whether to set C{SO_REUSEPORT}, so several sockets can
+        listen on the same port.
+
+    @return: The L{socket.socket}.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reusePort:
+        sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+    sock.bind((interface, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def serve(sock, factory, gracePeriod=30, reactor=None, ready=None):
+    """
+    Serve connections accepted from a listening socket with C{factory} until
+    the process receives C{SIGTERM}, then stop accepting connections, close
+    idle ones, and stop the reactor once the others are done (or after
+    C{gracePeriod} seconds).
+
+    This runs the reactor, so it only returns once the worker has stopped.
+
+    @param sock: A listening socket, as returned by L{listen}.  It is closed
+        once it has been handed to the reactor.
+
+    @param factory: An L{toyhttp.server.HTTPFactory}.
+
+    @param ready: A function to call once connections are being accepted,
+        such as L{Supervisor.notifyReady}, or C{None}.
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    from twisted.internet.task import LoopingCall
+    from twisted.protocols.policies import WrappingFactory
+
+    wrapper = WrappingFactory(factory)
+    port = reactor.adoptStreamPort(sock.fileno(), socket.AF_INET, wrapper)
+    # The reactor has its own copy of the descriptor.
+    sock.close()
+
+    def connections():
+        return [p.wrappedProtocol for p in list(wrapper.protocols)]
+
+    def checkDrained(deadline):
+        if not wrapper.protocols or time.time() >= deadline:
+            drain.stop()
+            reactor.stop()
+
+    drain = LoopingCall(checkDrained, time.time() + gracePeriod)
+
+    def shutdown():
+        if drain.running:
+            return
+        port.stopListening()
+        for protocol in connections():
+            protocol.closeWhenIdle()
+        drain.start(0.1)
+
+    signal.signal(signal.SIGTERM,
+                  lambda signum, frame: reactor.callFromThread(shutdown))
+    # Ctrl-C reaches every process in the group; the supervisor handles it.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if ready is not None:
+        reactor.callWhenRunning(ready)
+    reactor.run(installSignalHandlers=False)
+
+
+class Supervisor(object):
+    """
+    Start worker processes and keep the right number of them running.
+
+    @ivar workers: The number of worker processes.
+
+    @ivar minUptime: Workers that exit less than this many seconds after
+        being started are restarted only after a delay of as many seconds, so
+        a worker that can't start doesn't make the supervisor fork
+        continuously.
+
+    @ivar readyTimeout: The longest a reload waits, in seconds, for a new
+        worker to call L{notifyReady} before stopping the worker it
+        replaces anyway.  Workers that never call it are replaced at this
+        pace.
+    """
+
+    minUptime = 1.0
+    readyTimeout = 5.0
+
+    def __init__(self, runWorker, workers):
+        """
+        @param runWorker: A callable run in each forked worker process.  The
+            worker exits when it returns, with status 1 if it raised an
+            exception and 0 otherwise.
+
+        @param workers: The number of worker processes to run.
+        """
+        self._runWorker = runWorker
+        self.workers = workers
+        # Maps the pid of every running worker to the time it was started:
+        self._started = {}
+        # Pids of workers that have been asked to stop:
+        self._retiring = set()
+        # Maps the pid of every running worker to the read end of the pipe
+        # it signals readiness on:
+        self._readyPipes = {}
+        # In a worker, the write end of its readiness pipe:
+        self._readyPipe = None
+        self._stopping = False
+        self._reloadRequested = False
+
+    def run(self):
+        """
+        Start the workers and supervise them until they have all been stopped.
+        """
+        signal.signal(signal.SIGHUP, self._requestReload)
+        signal.signal(signal.SIGTERM, self._requestStop)
+        signal.signal(signal.SIGINT, self._requestStop)
+        for i in range(self.workers):
+            self.spawn()
+        while self._started:
+            if self._reloadRequested:
+                self._reloadRequested = False
+                self.reload()
+            try:
+                pid, status = os.wait()
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    # A signal arrived; see whether it asked for anything.
+                    continue
+                raise
+            self.reap(pid, status)
+
+    def spawn(self):
+        """
+        Fork a new worker process.
+
+        @return: The worker's pid.
+        """
+        readPipe, writePipe = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            os.close(readPipe)
+            for fd in self._readyPipes.values():
+                os.close(fd)
+            self._readyPipes.clear()
+            self._readyPipe = writePipe
+            try:
+                for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+                    signal.signal(signum, signal.SIG_DFL)
+                self._runWorker()
+            except:
+                traceback.print_exc()
+                status = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+        os.close(writePipe)
+        self._started[pid] = time.time()
+        self._readyPipes[pid] = readPipe
+        return pid
+
+    def notifyReady(self):
+        """
+        Called in a worker once it is accepting connections, to let a reload
+        go on to stop the worker it replaces.
+        """
+        fd, self._readyPipe = self._readyPipe, None
+        if fd is None:
+            return
+        try:
+            os.write(fd, "r")
+        except OSError:
+            pass
+        os.close(fd)
+
+    def waitReady(self, pid):
+        """
+        Wait until a worker has called L{notifyReady}, has exited, or
+        C{readyTimeout} seconds have passed.
+        """
+        fd = self._readyPipes.get(pid)
+        if fd is None:
+            return
+        deadline = time.time() + self.readyTimeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            try:
+                readable = select.select([fd], [], [], remaining)[0]
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    if self._stopping:
+                        return
+                    continue
+                raise
+            # Either the notification, or the end of the pipe if the worker
+            # exited:
+            if readable:
+                return
+
+    def kill(self, pid, signum):
+        """
+        Send a signal to a worker, unless it has already exited.
+        """
+        try:
+            os.kill(pid, signum)
+        except OSError, e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def reap(self, pid, status):
+        """
+        A worker process has exited; start another one in its place, unless
+        it was asked to stop.
+        """
+        started = self._started.pop(pid, None)
+        if started is None:
+            return
+        fd = self._readyPipes.pop(pid, None)
+        if fd is not None:
+            os.close(fd)
+        if pid in self._retiring:
+            self._retiring.discard(pid)
+            return
+        if self._stopping:
+            return
+        if os.WIFSIGNALED(status):
+            how = "was killed by signal %d" % (os.WTERMSIG(status),)
+        else:
+            how = "exited with status %d" % (os.WEXITSTATUS(status),)
+        log.msg("Worker %d %s; restarting it" % (pid, how))
+        if time.time() - started < self.minUptime:
+            time.sleep(self.minUptime)
+            if self._stopping:
+                # Asked to stop while waiting.
+                return
+        self.spawn()
+
+    def reload(self):
+        """
+        Replace every worker with a new one, one at a time.  Each old worker
+        is only asked to stop once its replacement is ready (see
+        L{waitReady}), so capacity never drops below the number of workers.
+        """
+        for pid in list(self._started):
+            if self._stopping:
+                return
+            if pid in self._retiring:
+                continue
+            self.waitReady(self.spawn())
+            if self._stopping:
+                return
+            self._retiring.add(pid)
+            self.kill(pid, signal.SIGTERM)
+
+    def stop(self):
+        """
+        Ask every worker to stop; L{run} returns once they have all exited.
+        If the workers have already been asked to stop, kill them instead.
+        """
+        signum = signal.SIGKILL if self._stopping else signal.SIGTERM
+        self._stopping = True
+        for pid in list(self._started):
+            self._retiring.add(pid)
+            self.kill(pid, signum)
+
+    def _requestReload(self, signum, frame):
+        # Forking from within a signal handler isn't safe; leave it to run().
+        self._reloadRequested = True
+
+    def _requestStop(self, signum, frame):
+        self.stop()
+
+
+def _loadHandler(name):
+    """
+    Import the handler named C{name}, instantiating it if it is a class.
+    """
+    from twisted.python.reflect import namedAny
+    handler = namedAny(name)
+    if isinstance(handler, type):
+        handler = handler()
+    return handler
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Serve a handler from pre-forked worker processes.")
+    parser.add_argument("handler", help="Fully qualified name of the handler")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--interface", default="")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of workers (default: number of cores)")
+    parser.add_argument("--reuse-port", action="store_true",
+                        help="Give each worker its own SO_REUSEPORT socket")
+    args = parser.parse_args(argv)
+    workers = args.workers
+    if workers is None:
+        import multiprocessing
+        workers = multiprocessing.cpu_count()
+
+    sock = None
+    if not args.reuse_port:
+        sock = listen(args.port, args.interface)
+
+    def runWorker():
+        from toyhttp.server import HTTPFactory
+        if sock is None:
+            workerSock = listen(args.port, args.interface, reusePort=True)
+        else:
+            workerSock = sock
+        serve(workerSock, HTTPFactory(_loadHandler(args.handler)),
+              ready=supervisor.notifyReady)
+
+    supervisor = Supervisor(runWorker, workers)
+    log.startLogging(sys.stdout)
+    log.msg("Serving %s on port %d with %d workers" %
+            (args.handler, args.port, workers))
+    supervisor.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Rate limiting: a limit on the request rate of each client, answering the
+requests beyond it with a 429 response without calling the handler.
+
+Pass a L{RateLimiter} to L{toyhttp.server.HTTPFactory} as C{rateLimiter}.
+Clients are told apart by the address they connect from or, with
+C{header}, by the value of a request header, such as an API key, or
+C{X-Forwarded-For} when the server is behind a proxy that sets it.
+
+Each client has a token bucket, holding up to C{burst} tokens and refilled
+at C{rate} tokens a second; a request takes a token, and is limited if
+there is none left.  A bucket is stored as a single number, the time at
+which it will be full again, so a bucket that has been left to fill up is
+the same as no bucket at all.  The buckets are kept in a table ordered by
+when their client was last seen, from which full buckets are dropped and,
+when there are more than C{maxClients} of them, the least recently seen,
+so the table doesn't grow with the number of clients the server has ever
+had.
+
+The 429 responses are rendered once for each C{Retry-After} value they
+carry, the whole seconds until the client's next token.
+"""
+
+import collections
+import math
+
+from toyhttp.server import PrerenderedResponse
+
+
+class RateLimiter(object):
+    """
+    A limit on the request rate of each client of an
+    L{toyhttp.server.HTTPFactory}.
+
+    @ivar rate: The sustained number of requests a second a client may make.
+
+    @ivar burst: The number of requests a client may make at once, after
+        making none for C{burst / rate} seconds.
+
+    @ivar header: The name of the request header whose value identifies the
+        client, or C{None} to use the address it connects from.  Requests
+        without the header are limited by address.
+
+    @ivar maxClients: The most clients whose buckets are kept.  A client
+        whose bucket is dropped to make room gets a full one if it comes
+        back.
+
+    @ivar limitedRequests: The number of requests answered with a 429
+        response.
+    """
+
+    def __init__(self, rate, burst=None, header=None, maxClients=10000,
+                 reactor=None):
+        """
+        @param burst: The size of the buckets; by default, a second's worth
+            of requests, or 1 if C{rate} is lower than 1.
+
+        @param reactor: The L{twisted.internet.interfaces.IReactorTime}
+            telling the time.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        if burst is None:
+            burst = max(1, int(rate))
+        self.rate = rate
+        self.burst = burst
+        self.header = header
+        self.maxClients = maxClients
+        self.limitedRequests = 0
+        # Seconds a request takes from a bucket's time, and how far ahead of
+        # the current time a bucket's time may be with a token left:
+        self._interval = 1.0 / rate
+        self._tolerance = (burst - 1) * self._interval
+        # Client keys to the time their bucket will be full again, least
+        # recently seen first:
+        self._buckets = collections.OrderedDict()
+        # Retry-After seconds to the 429 response carrying them:
+        self._responses = {}
+
+    def __len__(self):
+        """
+        @return: The number of clients whose buckets are kept.
+        """
+        return len(self._buckets)
+
+    def check(self, key):
+        """
+        Take a token from a client's bucket for a request.
+
+        @param key: The client, e.g. its address.
+
+        @return: C{None} if the request may go ahead, or the 429 response to
+            answer it with.
+        """
+        now = self.reactor.seconds()
+        buckets = self._buckets
+        full = buckets.pop(key, now)
+        if full < now:
+            full = now
+        if full - now > self._tolerance:
+            buckets[key] = full
+            self.limitedRequests += 1
+            return self._response(full - now - self._tolerance)
+        buckets[key] = full + self._interval
+        self._expire(now)
+        return None
+
+    def _expire(self, now):
+        """
+        Drop the buckets of the least recently seen clients while they are
+        full or there are more than C{maxClients} of them.
+        """
+        buckets = self._buckets
+        while buckets:
+            oldest = next(iter(buckets))
+            if buckets[oldest] > now and len(buckets) <= self.maxClients:
+                return
+            del buckets[oldest]
+
+    def _response(self, wait):
+        """
+        @param wait: Seconds until the client's next token.
+
+        @return: The 429 response telling the client to retry after C{wait}
+            seconds, rounded up.
+        """
+        retryAfter = max(1, int(math.ceil(wait)))
+        response = self._responses.get(retryAfter)
+        if response is None:
+            response = self._responses[retryAfter] = PrerenderedResponse(
+                429, "Too many requests.",
+                {"Content-Type": "text/plain",
+                 "Retry-After": str(retryAfter)})
+        return response
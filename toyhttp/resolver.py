@@ -0,0 +1,125 @@
+"""
+A caching, coalescing hostname resolver for handlers.
+
+A handler that resolves hostnames with C{reactor.resolve} sends a lookup to
+the system resolver for every request, even when a burst of requests asks
+for the same name.  L{CachingResolver} remembers the addresses it got (and,
+for a shorter time, the names that don't exist), and concurrent lookups of
+the same name share a single lookup.
+"""
+
+import collections
+
+from twisted.internet.defer import Deferred, fail, maybeDeferred, succeed
+from twisted.internet.error import DNSLookupError
+from twisted.python.failure import Failure
+
+
+class CachingResolver(object):
+    """
+    Resolve hostnames to IPv4 addresses, like C{reactor.resolve}, caching
+    the results.
+
+    @ivar hits: The number of lookups answered from the cache, including
+        those for names that were found not to exist.
+
+    @ivar misses: The number of lookups passed to the underlying resolver.
+
+    @ivar coalesced: The number of lookups that waited for an identical
+        lookup already in progress.
+    """
+
+    def __init__(self, resolver=None, clock=None, ttl=300, negativeTTL=30,
+                 maxEntries=1000):
+        """
+        @param resolver: The resolver doing the actual lookups: an object
+            with a C{resolve(hostname)} method returning a Deferred, like the
+            reactor (which is the default).
+
+        @param clock: The L{twisted.internet.interfaces.IReactorTime}
+            provider telling the time; by default the reactor.
+
+        @param ttl: Seconds an address is cached.
+
+        @param negativeTTL: Seconds the failure to find a name is cached, or
+            C{None} to not cache failures.
+
+        @param maxEntries: The number of names cached, evicting the least
+            recently used first.
+        """
+        if resolver is None or clock is None:
+            from twisted.internet import reactor
+            resolver = resolver or reactor
+            clock = clock or reactor
+        self._resolver = resolver
+        self._clock = clock
+        self.ttl = ttl
+        self.negativeTTL = negativeTTL
+        self.maxEntries = maxEntries
+        # Maps lowercased hostnames to (address or Failure, expiry time),
+        # least recently used first:
+        self._entries = collections.OrderedDict()
+        # Maps hostnames being looked up to the Deferreds waiting for them:
+        self._inFlight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        """
+        @return: The number of names cached.
+        """
+        return len(self._entries)
+
+    def resolve(self, hostname):
+        """
+        Look up the address of a hostname.
+
+        @return: A Deferred firing with the address, or failing with
+            L{twisted.internet.error.DNSLookupError} if there is none.
+        """
+        name = hostname.lower()
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            result, expires = entry
+            if expires > self._clock.seconds():
+                # Re-insert as the most recently used entry.
+                self._entries[name] = entry
+                self.hits += 1
+                if isinstance(result, Failure):
+                    return fail(result)
+                return succeed(result)
+        d = Deferred()
+        waiting = self._inFlight.get(name)
+        if waiting is not None:
+            self.coalesced += 1
+            waiting.append(d)
+            return d
+        self.misses += 1
+        self._inFlight[name] = [d]
+        # A resolver raising rather than failing its Deferred must still end
+        # the lookup, or later ones would wait for it forever:
+        maybeDeferred(self._resolver.resolve, hostname).addBoth(
+            self._resolved, name)
+        return d
+
+    def _resolved(self, result, name):
+        """
+        A lookup has finished; cache the result and pass it on to every
+        lookup waiting for it.
+        """
+        if not isinstance(result, Failure):
+            self._store(name, result, self.ttl)
+        elif result.check(DNSLookupError) and self.negativeTTL is not None:
+            self._store(name, result, self.negativeTTL)
+        for d in self._inFlight.pop(name):
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+    def _store(self, name, result, ttl):
+        entries = self._entries
+        entries[name] = (result, self._clock.seconds() + ttl)
+        while len(entries) > self.maxEntries:
+            entries.popitem(last=False)
@@ -0,0 +1,287 @@
+"""
+A handler dispatching requests to other handlers by method and path.
+
+Routes are registered with L{Router.add}, using patterns made of path
+segments, which may be:
+
+    - Static, e.g. C{/users/list}.
+    - Parameters, e.g. C{/users/{id}}, matching any single segment; the
+      (unquoted) segment is passed to the handler as a keyword argument.
+    - A final C{*}, e.g. C{/static/*}, making a prefix route, which matches
+      the path up to it and anything below it.
+
+Routes are compiled into a tree with a dictionary of child segments at
+each node, so matching a path takes time proportional to its number of
+segments, however many routes there are; paths of entirely static routes
+are looked up in a single dictionary first.  Static segments take priority
+over parameters, and both over prefixes.
+
+Route handlers are called as C{handler(method, path, headers, body,
+**params)}, where C{path} is the full request path, including the query
+string.  The router doesn't parse the query string; handlers that need it
+call L{parseQuery}.
+
+Handlers marked with L{toyhttp.server.deadline} have the Deferreds they
+return cancelled once their deadline has passed, and the request gets a 504
+response.
+"""
+
+import urllib
+
+# parseQuery is imported by handlers from here:
+from toyhttp.codec import parseQuery
+from toyhttp.offload import PoolSaturated, REACTOR, runsInPool
+from toyhttp.server import (Response, PrerenderedResponse, withDeadline,
+                            _SERVICE_UNAVAILABLE)
+
+
+_NOT_FOUND = PrerenderedResponse(404, "Not found.",
+                                 {"Content-Type": "text/plain"})
+
+
+class _Route(object):
+    """
+    The handlers for a pattern.
+
+    @ivar methods: Maps methods to handlers.
+    """
+
+    __slots__ = ("pattern", "methods")
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.methods = {}
+
+
+class _Node(object):
+    """
+    A node of the route tree, for a path segment.
+
+    @ivar children: Maps static child segments to their nodes.
+
+    @ivar param: The C{(name, node)} of the parameter child, or C{None}.
+
+    @ivar route: The L{_Route} ending here, or C{None}.
+
+    @ivar prefix: The prefix L{_Route} ending here, or C{None}.
+    """
+
+    __slots__ = ("children", "param", "route", "prefix")
+
+    def __init__(self):
+        self.children = {}
+        self.param = None
+        self.route = None
+        self.prefix = None
+
+
+class Router(object):
+    """
+    Dispatch requests to the handlers of the routes matching their path.
+
+    Requests matching no route are passed to C{notFound}; requests matching
+    a route, but not with their method, get a 405 response.
+
+    @ivar handlerPool: A L{toyhttp.offload.HandlerPool} running the route
+        handlers marked as blocking, or C{None} to run every handler in the
+        reactor thread.
+
+    @ivar execution: The execution mode deciding, with the route handler's
+        own C{blocking} marker, whether it runs in C{handlerPool}.
+
+    The router itself is marked as non-blocking, so it always runs in the
+    reactor thread, whatever the execution mode of the server, and its
+    C{handlerPool} and C{execution} decide where each route handler runs.
+    """
+
+    # Dispatching doesn't block, and scheduling deadlines and pool calls
+    # must happen in the reactor thread:
+    blocking = False
+
+    def __init__(self, notFound=None, handlerPool=None, execution=REACTOR,
+                 reactor=None):
+        """
+        @param notFound: A handler for requests no route matches; by default
+            they get a 404 response.
+
+        @param reactor: The reactor timing handler deadlines.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.notFound = notFound
+        self.handlerPool = handlerPool
+        self.execution = execution
+        self._root = _Node()
+        # Maps the paths of routes without parameters to the routes:
+        self._static = {}
+        # The last path looked up, and its route and parameters, since a
+        # request's route is often looked up twice (see L{label}):
+        self._lastPath = None
+        self._lastFound = (None, {})
+
+    def add(self, method, pattern, handler):
+        """
+        Add a route.
+
+        @param method: The request method, or C{None} for any method.  Routes
+            for C{GET} also answer C{HEAD} requests, unless a C{HEAD} route
+            is added.
+
+        @param pattern: A path pattern, starting with C{/}.
+        """
+        if not pattern.startswith("/"):
+            raise ValueError("Route patterns must start with '/': %r" %
+                             (pattern,))
+        # The new route may match the last path looked up:
+        self._lastPath = None
+        segments = pattern.split("/")[1:]
+        isPrefix = segments[-1] == "*"
+        if isPrefix:
+            segments.pop()
+        node = self._root
+        static = not isPrefix
+        for segment in segments:
+            if segment.startswith("{") and segment.endswith("}"):
+                static = False
+                name = segment[1:-1]
+                if node.param is None:
+                    node.param = (name, _Node())
+                elif node.param[0] != name:
+                    raise ValueError(
+                        "Conflicting parameter names {%s} and {%s} in %r" %
+                        (node.param[0], name, pattern))
+                node = node.param[1]
+            else:
+                child = node.children.get(segment)
+                if child is None:
+                    child = node.children[segment] = _Node()
+                node = child
+        if isPrefix:
+            if node.prefix is None:
+                node.prefix = _Route(pattern)
+            node.prefix.methods[method] = handler
+        else:
+            if node.route is None:
+                node.route = _Route(pattern)
+            node.route.methods[method] = handler
+            if static:
+                self._static[pattern] = node.route
+
+    def route(self, method, pattern):
+        """
+        A decorator adding a route for the decorated handler.
+        """
+        def decorator(handler):
+            self.add(method, pattern, handler)
+            return handler
+        return decorator
+
+    def match(self, method, path):
+        """
+        Find the handler for a request.
+
+        @return: A C{(handler, params)} tuple; C{handler} is C{None} if no
+            route matches, and C{False} if routes match but not C{method}.
+        """
+        route, params = self._find(path)
+        if route is None:
+            return None, {}
+        return self._select(route.methods, method), dict(params)
+
+    def label(self, method, path):
+        """
+        @return: The pattern of the route matching a request path, or
+            C{None}.
+        """
+        route = self._find(path)[0]
+        if route is None:
+            return None
+        return route.pattern
+
+    def _find(self, path):
+        """
+        @return: The L{_Route} matching C{path}, or C{None}, and the values of
+            its parameters.
+        """
+        if path == self._lastPath:
+            return self._lastFound
+        params = {}
+        stem = path.partition("?")[0]
+        route = self._static.get(stem)
+        if route is None:
+            route = self._match(self._root, stem.split("/")[1:], 0, params)
+        self._lastPath = path
+        self._lastFound = route, params
+        return self._lastFound
+
+    def _match(self, node, segments, index, params):
+        """
+        Match C{segments[index:]} below C{node}, adding the values of
+        parameters to C{params}.
+
+        @return: The matching L{_Route}, or C{None}.
+        """
+        if index == len(segments):
+            if node.route is not None:
+                return node.route
+            return node.prefix
+        segment = segments[index]
+        child = node.children.get(segment)
+        if child is not None:
+            found = self._match(child, segments, index + 1, params)
+            if found is not None:
+                return found
+        if node.param is not None and segment:
+            name, child = node.param
+            found = self._match(child, segments, index + 1, params)
+            if found is not None:
+                params[name] = urllib.unquote(segment)
+                return found
+        return node.prefix
+
+    def _select(self, methods, method):
+        handler = methods.get(method)
+        if handler is None:
+            handler = methods.get(None)
+            if handler is None:
+                if method == "HEAD":
+                    handler = methods.get("GET")
+                if handler is None:
+                    return False
+        return handler
+
+    def __call__(self, method, path, headers, body):
+        route, params = self._find(path)
+        handler = None
+        if route is not None:
+            handler = self._select(route.methods, method)
+        if handler is None:
+            if self.notFound is not None:
+                return self.notFound(method, path, headers, body)
+            return _NOT_FOUND
+        if handler is False:
+            methods = self._allowed(path)
+            return Response(405, "", {"Allow": ", ".join(methods)})
+        pool = self.handlerPool
+        if pool is not None and runsInPool(handler, self.execution):
+            try:
+                result = pool.submit(handler, method, path, headers, body,
+                                     **params)
+            except PoolSaturated:
+                return _SERVICE_UNAVAILABLE
+        else:
+            result = handler(method, path, headers, body, **params)
+        seconds = getattr(handler, "deadline", None)
+        if seconds is not None:
+            result = withDeadline(result, seconds, self.reactor)
+        return result
+
+    def _allowed(self, path):
+        """
+        @return: The sorted methods of the route matching C{path}.
+        """
+        allowed = set(self._find(path)[0].methods)
+        if "GET" in allowed:
+            allowed.add("HEAD")
+        return sorted(allowed)
@@ -1,122 +1,1342 @@
 """
 The skeleton for a toy HTTP server implementation.
 
-This implementation does not support persistent connections, chunked encoding,
-multiple headers with same key, multi-line headers, etc..
+Persistent (keep-alive) connections, pipelined requests, request bodies
+(including chunked ones) and streamed response bodies are supported.  This
+implementation does not support multiple headers with same key, multi-line
+headers, etc..
 """
 
+import types
+
 import twisted
-from twisted.protocols import basic
-from twisted.internet.protocol import ServerFactory
-from twisted.internet.defer import Deferred
-import re
-class HTTP(basic.LineReceiver):
+from twisted.internet.protocol import Protocol, ServerFactory
+from twisted.internet.defer import (Deferred, CancelledError, TimeoutError,
+                                    ensureDeferred, inlineCallbacks)
+from twisted.internet.interfaces import IConsumer, IPullProducer
+from twisted.python.failure import Failure
+from twisted.web.iweb import IBodyProducer, UNKNOWN_LENGTH
+from zope.interface import implementer
+
+from toyhttp.codec import (RequestParser, BadRequest, REQUEST, DATA,
+                           Headers, NO_BODY_CODES, LAST_CHUNK, isPersistent,
+                           renderResponseHead, encodeChunk, parseHeaders,
+                           parseQuery, parseCookies)
+from toyhttp.timer import TimerWheel
+from toyhttp.offload import (HandlerPool, PoolSaturated, REACTOR,
+                             runsInPool)
+
+
+def _toDeferred(result):
+    """
+    Adapt a coroutine returned by a handler to a L{Deferred}.
+
+    @param result: What the handler returned: a response or a L{Deferred},
+        returned as they are; a generator, run as if the handler were
+        decorated with L{inlineCallbacks}; an awaitable, such as a native
+        coroutine, run with L{ensureDeferred}; or a future with
+        C{add_done_callback}, such as an C{asyncio.Future}, adapted with
+        L{Deferred.fromFuture}.
+    """
+    if isinstance(result, (Response, StreamingResponse, Deferred)):
+        return result
+    if isinstance(result, types.GeneratorType):
+        return inlineCallbacks(lambda: result)()
+    if hasattr(result, "__await__"):
+        return ensureDeferred(result)
+    if hasattr(result, "add_done_callback"):
+        return Deferred.fromFuture(result)
+    return result
+
+
+def takesRequest(handler):
+    """
+    Mark a handler as taking a single L{Request} argument, rather than the
+    method, path, headers and body of the request.  The request's headers
+    are then only parsed if something reads them.
+    """
+    handler.takesRequest = True
+    return handler
+
+
+def deadline(seconds):
+    """
+    Give a handler a deadline: if the Deferred it returns hasn't fired after
+    C{seconds}, it is cancelled and the request gets a 504 response.  The
+    deadline is enforced by L{toyhttp.router.Router} for its routes' handlers
+    (see L{withDeadline}).
+    """
+    def decorator(handler):
+        handler.deadline = seconds
+        return handler
+    return decorator
+
+
+def withDeadline(result, seconds, reactor):
+    """
+    Enforce a deadline on a handler's result.
+
+    @param result: A response, returned as it is, or a L{Deferred} firing
+        with one (or a coroutine, see L{_toDeferred}), which is cancelled if
+        it hasn't fired after C{seconds}.
+
+    @return: C{result}, now firing with a 504 response if it times out.
+    """
+    result = _toDeferred(result)
+    if not isinstance(result, Deferred):
+        return result
+    result.addTimeout(seconds, reactor)
+    result.addErrback(_gatewayTimeout)
+    return result
+
+
+def _gatewayTimeout(reason):
+    reason.trap(TimeoutError)
+    return _GATEWAY_TIMEOUT
+
+
+class BodyTooLarge(Exception):
+    """
+    A chunked request body exceeded L{HTTP.maxBodySize} after a streaming
+    body receiver had started on it.
+    """
+
+
+class HTTP(Protocol):
     """
     A toy implementation of the server-side HTTP protocol.
 
     This is the protocol you will be implementing that parses HTTP requests
     and writes out HTTP responses.
+
+    Connections are persistent by default for HTTP/1.1 clients and on request
+    (C{Connection: keep-alive}) for HTTP/1.0 clients.  Pipelined requests are
+    answered one at a time, in the order they were received: parsing of
+    further requests is suspended until the response to the current one has
+    been written.
+
+    @ivar maxRequestsPerConnection: The number of requests served on a single
+        connection before it is closed, or C{None} for no limit.
+
+    @ivar keepAliveTimeout: Seconds an idle persistent connection is kept
+        open while waiting for the next request.
+
+    @ivar headerTimeout: Seconds the client has to send the head of a
+        request, from when the connection is made or, on a persistent
+        connection, from the first byte of the request.
+
+    @ivar minHeaderRate: The slowest average rate, in bytes per second, at
+        which the client may send a request head, checked every
+        C{headerRateWindow} seconds while the head is being received, or
+        C{None} (the default) to not check it.  This drops clients dripping
+        a head byte by byte to hold the connection open, long before
+        C{headerTimeout}.
+
+    @ivar bodyTimeout: Seconds the client may go without sending any of a
+        request body while it is being received.
+
+    @ivar writeTimeout: Seconds a response may go without making progress
+        being written, i.e. without the client reading any of it, before the
+        connection is aborted.
+
+    These timeouts may be C{None} to disable them.  They are tracked on a
+    L{toyhttp.timer.TimerWheel} shared by the connections of a factory, and
+    fire up to a second late.  A client sending a request head slower than
+    C{minHeaderRate} gets a 408 response; timeouts abort the connection.
+
+    @ivar maxRequestLineSize: The longest request line accepted, in bytes;
+        longer ones get a 414 response.
+
+    @ivar maxHeadSize: The largest request head accepted, in bytes, and
+        C{maxHeaderCount} the most header lines; larger heads get a 431
+        response.  Like C{maxRequestLineSize}, these are checked as the head
+        arrives, so an oversized head is never buffered in full.
+
+    @ivar maxBodySize: The largest request body accepted, in bytes, or
+        C{None} for no limit.  Requests announcing a larger C{Content-Length}
+        get a 413 response before any of the body is read.
+
+    @ivar tracer: A L{toyhttp.trace.RequestTracer} recording requests and
+        responses, or C{None} to disable tracing.
+
+    @ivar largeBodySize: Response bodies larger than this many bytes are
+        written a slice at a time, as the transport drains, rather than handed
+        to the transport in one piece (which would copy them).
+
+    @ivar execution: The execution mode, L{toyhttp.offload.REACTOR} or
+        L{toyhttp.offload.THREADS}, deciding (with the handler's own
+        C{blocking} marker) whether the handler runs in C{handlerPool}.
+
+    @ivar handlerPool: A L{toyhttp.offload.HandlerPool} running blocking
+        handlers, or C{None} to run every handler in the reactor thread.
+
+    @ivar responseCache: A L{toyhttp.cache.ResponseCache} answering repeated
+        requests without calling the handler, or C{None}.
+
+    @ivar compressor: A L{toyhttp.compress.Compressor} compressing the
+        responses to handled requests, or C{None}.  Large bodies are
+        compressed in C{handlerPool}.
+
+    @ivar metrics: A L{toyhttp.metrics.Metrics} recording connections,
+        requests and responses, or C{None}.
+
+    @ivar admission: A L{toyhttp.admission.AdmissionControl} limiting the
+        number of handler calls in flight, or C{None}.
+
+    @ivar rateLimiter: A L{toyhttp.ratelimit.RateLimiter} limiting the
+        request rate of each client, or C{None}.
+
+    The handler is called with the method, path, headers and body of each
+    request or, if it is marked with L{takesRequest}, with a L{Request}.
+    The handler returns a L{Response} or L{StreamingResponse}, or a
+    L{Deferred} firing with one.  It may also be a coroutine function: a
+    generator yielding L{Deferred}s, as if decorated with L{inlineCallbacks};
+    an C{async def} function on Python 3; or a function returning an
+    C{asyncio} future, for instance of a driver running on Twisted's
+    C{asyncio} reactor.  The coroutine is adapted to a L{Deferred} (see
+    L{_toDeferred}).
+
+    Responses to C{HEAD} requests are written without their body, but with
+    the C{Content-Length} it would have, so handlers may answer them like
+    C{GET} requests.
+
+    A handler may also answer with an L{UpgradeResponse}, such as one
+    returned by L{toyhttp.websocket.accept}, to hand the connection over to
+    another protocol.
+
+    Request bodies are normally buffered and passed to the handler in full.
+    A handler that wants to process a body as it arrives instead can have a
+    C{bodyReceiver(method, path, headers)} method, which is called when the
+    head of a request with a body has been received.  It returns C{None} to
+    have the body buffered as usual, or an object with these methods:
+
+        - C{bodyDataReceived(data)}, called with each piece of the body.
+        - C{bodyFinished()}, called once the body is complete; it returns the
+          response (or a Deferred firing with it), like the handler would.
+        - Optionally C{bodyAborted(reason)}, called with a L{Failure} if the
+          body will never be completed, e.g. because the connection was lost.
     """
 
-    def __init__(self, handler, reactor=twisted.internet.reactor, *args, **kwargs):
+    maxRequestsPerConnection = 100
+    keepAliveTimeout = 15
+    headerTimeout = 60
+    minHeaderRate = None
+    headerRateWindow = 10
+    bodyTimeout = 60
+    writeTimeout = 60
+    maxBodySize = 10 * 1024 * 1024
+    maxRequestLineSize = RequestParser.maxRequestLineSize
+    maxHeadSize = RequestParser.maxHeadSize
+    maxHeaderCount = RequestParser.maxHeaderCount
+    tracer = None
+    largeBodySize = 1024 * 1024
+    execution = REACTOR
+    handlerPool = None
+    responseCache = None
+    compressor = None
+    metrics = None
+    admission = None
+    rateLimiter = None
+    factory = None
+
+    def __init__(self, handler, reactor=None, *args, **kwargs):
         # save off handler function to call in requestReceived.
         self._handler = handler
+        if reactor is None:
+            from twisted.internet import reactor
         self.reactor = reactor
-        self.lines = []
+        self._parser = RequestParser()
+        self._takesRequest = getattr(handler, "takesRequest", False)
+        # Headers are parsed when the Request's are first read, unless
+        # something else (e.g. a response cache) needs them first:
+        self._parser.lazyHeaders = self._takesRequest
+        self.requestCount = 0
+        # Per-request state, reset by _resetRequestState():
+        self._method = None
+        self._version = None
+        self._persistent = False
+        self._readingBody = False
+        self._request = None
+        self._body = None
+        self._bodySize = 0
+        self._bodyReceiver = None
+        # The Accept-Encoding of a request whose response may be compressed:
+        self._acceptEncoding = None
+        # For metrics, whether the phases of the request are timed (None
+        # until it has started; see Metrics.sampled), the functions
+        # recording them (see Metrics.recorders) and when the current phase
+        # started:
+        self._timed = None
+        self._phases = None
+        self._phaseStarted = None
+        # Per-connection state:
+        self._timers = None
+        self._timeoutCall = None
+        self._idle = False
+        # The Deferred of the response being produced, if any, cancelled if
+        # the connection is lost first:
+        self._pendingResponse = None
+        self._disconnected = False
+        # When the client started sending the current request head, and the
+        # bytes of it received since:
+        self._headStarted = None
+        self._headBytes = 0
+        # True while a request is being answered; further requests stay
+        # buffered in the parser until the response has been written.
+        self._busy = False
+        # The protocol the connection has been handed over to by an
+        # UpgradeResponse, if any:
+        self._upgraded = None
+        # True while _processRequests is running, to avoid re-entering it.
+        self._processing = False
+        self._transportPaused = False
 
     def makeConnection(self, transport):
-        basic.LineReceiver.makeConnection(self, transport)
-        self.abortAfter60 = self.reactor.callLater(60, self.transport.abortConnection)
-
-    def lineReceived(self, line):
-        if line == "":
-            #print "Lines received: " + str(self.lines)
-            l0Toks = self.lines[0].split()
-            headers = dict()
-            for hline in self.lines[1:]:
-                tokens = [x.strip() for x in hline.split(":")]
-                headers[tokens[0]] = tokens[1]
-
-            if len(l0Toks) == 3 and re.match("HTTP/\d\.\d", l0Toks[2]) != None:
-                self.requestReceived(l0Toks[0], l0Toks[1], headers, "")
+        if self.factory is not None:
+            self._timers = self.factory.timerWheel(self.reactor)
+        else:
+            self._timers = TimerWheel(self.reactor)
+        if self.metrics is not None:
+            self.metrics.connectionsActive += 1
+            self.metrics.connectionsTotal += 1
+        if self.admission is not None:
+            self.admission.connectionMade()
+        parser = self._parser
+        parser.maxRequestLineSize = self.maxRequestLineSize
+        parser.maxHeadSize = self.maxHeadSize
+        parser.maxHeaderCount = self.maxHeaderCount
+        Protocol.makeConnection(self, transport)
+        self._awaitHead()
+
+    def connectionLost(self, reason):
+        self._disconnected = True
+        self._cancelTimeout()
+        if self._pendingResponse is not None:
+            # Nobody will read the response; stop working on it.
+            pending, self._pendingResponse = self._pendingResponse, None
+            pending.cancel()
+        if self.metrics is not None:
+            self.metrics.connectionsActive -= 1
+        if self.admission is not None:
+            self.admission.connectionLost()
+        if self._bodyReceiver is not None and self._readingBody:
+            self._abortBody(reason)
+        if self._upgraded is not None:
+            self._upgraded.connectionLost(reason)
+
+    def _setTimeout(self, seconds, action):
+        """
+        Replace any pending timeout with one calling C{action} after
+        C{seconds}, unless C{seconds} is C{None}.
+        """
+        if seconds is None:
+            self._cancelTimeout()
+        elif self._timeoutCall is None:
+            self._timeoutCall = self._timers.schedule(seconds, action)
+        else:
+            self._timeoutCall.reset(seconds, action)
+
+    def _resetTimeout(self, seconds):
+        """
+        Push back the pending timeout, if any, to C{seconds} from now.
+        """
+        if self._timeoutCall is not None and seconds is not None:
+            self._timeoutCall.reset(seconds)
+
+    def _cancelTimeout(self):
+        if self._timeoutCall is not None:
+            self._timeoutCall.cancel()
+            self._timeoutCall = None
+
+    def _idleTimedOut(self):
+        """
+        A persistent connection has been idle for C{keepAliveTimeout}
+        seconds; close it.
+        """
+        self._setTimeout(self.writeTimeout, self._writeTimedOut)
+        self.transport.loseConnection()
+
+    def _awaitHead(self):
+        """
+        Start timing the receipt of a request head, against
+        C{headerTimeout} and C{minHeaderRate}.
+        """
+        self._headStarted = self.reactor.seconds()
+        self._headBytes = self._parser.pending()
+        self._setTimeout(self._headCheckDelay(0), self._checkHeadProgress)
+
+    def _headCheckDelay(self, elapsed):
+        """
+        @return: Seconds until the receipt of a request head, going on for
+            C{elapsed} seconds, should next be checked, or C{None} if never.
+        """
+        delay = None
+        if self.headerTimeout is not None:
+            delay = self.headerTimeout - elapsed
+        if self.minHeaderRate is not None and self.headerRateWindow and (
+                delay is None or delay > self.headerRateWindow):
+            delay = self.headerRateWindow
+        return delay
+
+    def _checkHeadProgress(self):
+        elapsed = self.reactor.seconds() - self._headStarted
+        if self.headerTimeout is not None and elapsed >= self.headerTimeout:
+            self._timedOut("header")
+        elif (self.minHeaderRate is not None and
+                self._headBytes < self.minHeaderRate * elapsed):
+            self._headTooSlow()
+        else:
+            self._setTimeout(self._headCheckDelay(elapsed),
+                             self._checkHeadProgress)
+
+    def _headTooSlow(self):
+        """
+        The client is sending a request head slower than C{minHeaderRate}:
+        answer with a 408 response if it had started sending one, or else
+        drop the connection.
+        """
+        if not self._parser.pending():
+            self._timedOut("header")
+            return
+        if self.metrics is not None:
+            self.metrics.timedOut("header")
+        self._persistent = False
+        self._busy = True
+        self._writeResponse(Response(408, "", {}))
+
+    def _bodyTimedOut(self):
+        self._timedOut("body")
+
+    def _writeTimedOut(self):
+        self._timedOut("write")
+
+    def _timedOut(self, kind):
+        """
+        The client took too long to send a request or read a response; drop
+        the connection.
+        """
+        if self.metrics is not None:
+            self.metrics.timedOut(kind)
+        self.transport.abortConnection()
+
+    def _writeProgressed(self, sent=0):
+        """
+        Part of a response body has been written.
+
+        @param sent: The number of bytes written, if they haven't been
+            counted as part of the response already.
+        """
+        self._resetTimeout(self.writeTimeout)
+        if sent and self.metrics is not None:
+            self.metrics.bytesSent += sent
+
+    def _resetRequestState(self):
+        self._method = None
+        self._version = None
+        self._persistent = False
+        self._readingBody = False
+        self._request = None
+        self._body = None
+        self._bodySize = 0
+        self._bodyReceiver = None
+        self._acceptEncoding = None
+        self._timed = None
+        self._phases = None
+        self._phaseStarted = None
+
+    def dataReceived(self, data):
+        if self._upgraded is not None:
+            self._upgraded.dataReceived(data)
+            return
+        if self._idle:
+            # The next request on a persistent connection has started; the
+            # client now has headerTimeout seconds to finish sending its head.
+            self._idle = False
+            self._awaitHead()
+        self._headBytes += len(data)
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.bytesReceived += len(data)
+            if self._timed is None:
+                self._timed = metrics.sampled()
+                if self._timed:
+                    self._phaseStarted = metrics.clock()
+        self._parser.feed(data)
+        if self._busy and not self._readingBody:
+            if not self._transportPaused:
+                # A pipelined request arrived while we're still answering
+                # the previous one; stop reading until we've caught up.
+                self._transportPaused = True
+                self.transport.pauseProducing()
+            return
+        self._processRequests()
+
+    def _processRequests(self):
+        """
+        Pass buffered requests to L{requestReceived}, one at a time, for as
+        long as each is answered synchronously.
+        """
+        if self._processing:
+            # We're being called from a response written synchronously from
+            # within the loop below, which will carry on by itself.
+            return
+        self._processing = True
+        try:
+            parser = self._parser
+            while not self.transport.disconnecting:
+                if self._busy and not self._readingBody:
+                    return
+                try:
+                    event = parser.nextEvent()
+                except BadRequest, e:
+                    self._persistent = False
+                    self._readingBody = False
+                    if not self._busy:
+                        self._busy = True
+                        if e.code == BadRequest.code:
+                            self.badRequestReceived()
+                        else:
+                            self._cancelTimeout()
+                            self._writeResponse(Response(e.code, "", {}))
+                    else:
+                        # A streamed request body turned out to be invalid
+                        # after the handler had started on it.
+                        self.transport.loseConnection()
+                    return
+                if event is None:
+                    return
+                kind, value = event
+                if kind is DATA:
+                    self._bodyDataReceived(value)
+                elif kind is REQUEST:
+                    self._headReceived(*value)
+                else:
+                    self._messageComplete()
+        finally:
+            self._processing = False
+
+    def _headReceived(self, method, path, version, headers):
+        """
+        A request head has been parsed; get ready to receive its body.
+        """
+        parser = self._parser
+        self.requestCount += 1
+        self._method = method
+        self._version = version
+        self._persistent = self._isPersistent(version, parser.connection)
+        length = parser.bodyLength
+        if (self.maxBodySize is not None and length is not None and
+                length > self.maxBodySize):
+            self._requestEntityTooLarge()
+            return
+        self._readingBody = length != 0
+        if not self._readingBody:
+            self._request = (method, path, headers)
+            return
+        self._setTimeout(self.bodyTimeout, self._bodyTimedOut)
+        if parser.expectContinue and version >= "HTTP/1.1":
+            self.transport.write("HTTP/1.1 100 Continue\r\n\r\n")
+
+        bodyReceiver = getattr(self._handler, "bodyReceiver", None)
+        if bodyReceiver is not None:
+            if parser.lazyHeaders:
+                headers = parseHeaders(headers)
+            try:
+                self._bodyReceiver = bodyReceiver(method, path, headers)
+            except Exception, e:
+                self._busy = True
+                self._internalServerError(e)
+                return
+        if self._bodyReceiver is not None:
+            # The handler takes over from here; its response is written once
+            # the body is complete.
+            self._busy = True
+            if self.tracer is not None:
+                self.tracer.requestReceived(method, path, headers)
+        else:
+            self._request = (method, path, headers)
+            self._body = []
+
+    def _bodyDataReceived(self, data):
+        """
+        Part of the current request's body has been parsed.
+        """
+        self._resetTimeout(self.bodyTimeout)
+        self._bodySize += len(data)
+        if self.maxBodySize is not None and self._bodySize > self.maxBodySize:
+            # Only possible for chunked bodies, whose size isn't known up
+            # front.
+            if self._bodyReceiver is not None:
+                self._abortBody(Failure(
+                    BodyTooLarge("Request body exceeds %d bytes" %
+                                 (self.maxBodySize,))))
+                self._persistent = False
+                self.transport.loseConnection()
             else:
-                self.badRequestReceived()
-            self.lines = []
+                self._requestEntityTooLarge()
+            return
+        if self._bodyReceiver is not None:
+            try:
+                self._bodyReceiver.bodyDataReceived(data)
+            except Exception, e:
+                self._bodyReceiver = None
+                self._internalServerError(e)
         else:
-            self.lines.append(line)
+            self._body.append(data)
+
+    def _messageComplete(self):
+        """
+        The current request, including its body, has been parsed.
+        """
+        self._readingBody = False
+        if self._bodyReceiver is not None:
+            self._cancelTimeout()
+            self._respond(self._bodyReceiver.bodyFinished)
+        else:
+            method, path, headers = self._request
+            body = "".join(self._body) if self._body else ""
+            self._request = self._body = None
+            self._busy = True
+            if self._parser.lazyHeaders:
+                self._requestReceived(
+                    Request(method, path, None, body, rawHeaders=headers))
+            else:
+                self.requestReceived(method, path, headers, body)
+
+    def _requestEntityTooLarge(self):
+        """
+        Reject the current request with a 413 response without reading its
+        body, and close the connection.
+        """
+        self._persistent = False
+        self._readingBody = False
+        self._busy = True
+        self._writeResponse(Response(413, "", {}))
+
+    def _abortBody(self, reason):
+        """
+        Tell a streaming body receiver that its body will never be completed.
+        """
+        bodyReceiver, self._bodyReceiver = self._bodyReceiver, None
+        bodyAborted = getattr(bodyReceiver, "bodyAborted", None)
+        if bodyAborted is not None:
+            bodyAborted(reason)
+
+    def _isPersistent(self, version, connection):
+        """
+        Decide whether the connection may be reused after answering a request
+        with the given HTTP version and (lowercased) C{Connection} header.
+        """
+        if (self.maxRequestsPerConnection is not None and
+                self.requestCount >= self.maxRequestsPerConnection):
+            return False
+        return isPersistent(version, connection)
+
+    def closeWhenIdle(self):
+        """
+        Stop serving requests on this connection: close it right away if it
+        is waiting for a request, or else once the response to the current
+        request has been written (announcing C{Connection: close}).
+        """
+        if self._upgraded is not None:
+            closeWhenIdle = getattr(self._upgraded, "closeWhenIdle", None)
+            if closeWhenIdle is not None:
+                closeWhenIdle()
+            else:
+                self.transport.loseConnection()
+            return
+        self.maxRequestsPerConnection = self.requestCount
+        if self._version is None and not self._parser.pending():
+            self.transport.loseConnection()
+        else:
+            self._persistent = False
 
     def _writeResponse(self, response):
-        with open('response', 'w') as f:
-            f.write(str(response))
-        self.transport.write(str(response))
-#        self.transport.write("HTTP/1.1 %d Reason\r\n"
-#                             "Content-Length: %d\r\n"
-#                             "content-type: text/html\r\n"
-#                             "\r\n"
-#                             "%s" % 
-#                             (response.code, len(response.body),
-#                              response.body))
-        self.transport.loseConnection()
+        if isinstance(response, UpgradeResponse):
+            self._switchProtocols(response)
+            return
+        if self._acceptEncoding is not None:
+            acceptEncoding, self._acceptEncoding = self._acceptEncoding, None
+            response = self.compressor.compress(response, acceptEncoding,
+                                                self.handlerPool,
+                                                self._method == "HEAD")
+            if isinstance(response, Deferred):
+                # Compressing in the handler pool:
+                self._awaitResponse(response)
+                return
+        # If the response is written before the request body has been read,
+        # the rest of the body can't be told apart from the next request.
+        persistent = self._persistent and not self._readingBody
+        streaming = isinstance(response, StreamingResponse)
+        # Only the head of the response to a HEAD request is written:
+        headOnly = self._method == "HEAD"
+        chunked = False
+        if streaming and response.length is None and not headOnly:
+            if self._version is not None and self._version >= "HTTP/1.1":
+                chunked = True
+            else:
+                # The end of the body can only be signalled by closing the
+                # connection.
+                persistent = False
+        connection = None
+        if self._version is not None:
+            if self._version >= "HTTP/1.1":
+                if not persistent:
+                    connection = "close"
+            elif persistent:
+                connection = "keep-alive"
+        if streaming:
+            head = response.renderHead(connection, chunked)
+        else:
+            head = response.renderHead(connection)
+        if self.tracer is not None:
+            self.tracer.responseWritten(response)
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.responses[response.code] += 1
+            if streaming or headOnly:
+                metrics.bytesSent += len(head)
+            else:
+                metrics.bytesSent += len(head) + len(response.body)
+            if self._phases is not None:
+                now = metrics.clock()
+                self._phases[1](now - self._phaseStarted)
+                self._phaseStarted = now
+        if headOnly:
+            if streaming:
+                _closeBody(response.body)
+            self.transport.write(head)
+            self._responseDone(persistent)
+            return
+        if streaming:
+            self._setTimeout(self.writeTimeout, self._writeTimedOut)
+            self.transport.write(head)
+            _BodyStreamer(self, response, chunked, persistent).start()
+            return
+        body = response.body
+        if len(body) > self.largeBodySize:
+            self._setTimeout(self.writeTimeout, self._writeTimedOut)
+            self.transport.write(head)
+            self.transport.registerProducer(
+                _BodySender(self, body, persistent), False)
+            return
+        if body:
+            self.transport.writeSequence([head, body])
+        else:
+            self.transport.write(head)
+        self._responseDone(persistent)
+
+    def _switchProtocols(self, response):
+        """
+        Write a 101 response, and hand the connection over to its protocol.
+        """
+        if self._readingBody or (self._version is not None and
+                                 self._version < "HTTP/1.1"):
+            # The rest of the body couldn't be told apart from the new
+            # protocol's data, and HTTP/1.0 has no upgrades.
+            self._persistent = False
+            self._writeResponse(Response(400, "", {}))
+            return
+        self._cancelTimeout()
+        self._acceptEncoding = None
+        head = response.renderHead()
+        if self.tracer is not None:
+            self.tracer.responseWritten(response)
+        if self.metrics is not None:
+            self.metrics.responseWritten(response.code, len(head))
+        self.transport.write(head)
+        protocol = self._upgraded = response.protocol
+        if self._transportPaused:
+            self._transportPaused = False
+            self.transport.resumeProducing()
+        protocol.makeConnection(self.transport)
+        data = self._parser.unparsed()
+        if data:
+            protocol.dataReceived(data)
 
-    def requestReceived(self, method, path, headers, foo):
-        def internalServerError(e):
-            twisted.python.log.err("Internal Server Error received: %s" % str(e))
-            twisted.python.log.err(e)
-            self._writeResponse(Response(500, "Internal Server Error", {}))
+    def _responseDone(self, persistent):
+        """
+        The response to the current request has been written; close the
+        connection or get ready for the next request.
+        """
+        metrics = self.metrics
+        now = None
+        if (metrics is not None and self._phases is not None and
+                self._phaseStarted is not None):
+            now = metrics.clock()
+            self._phases[2](now - self._phaseStarted)
+        if not persistent:
+            # Closing waits for the response to be flushed; don't wait
+            # forever for a client that doesn't read it.
+            self._setTimeout(self.writeTimeout, self._writeTimedOut)
+            self.transport.loseConnection()
+            return
 
+        self._resetRequestState()
+        if self._parser.pending():
+            # A pipelined request is already (partially) buffered.
+            if metrics is not None:
+                self._timed = metrics.sampled()
+                if self._timed:
+                    self._phaseStarted = (now if now is not None
+                                          else metrics.clock())
+            self._awaitHead()
+        else:
+            self._idle = True
+            self._setTimeout(self.keepAliveTimeout, self._idleTimedOut)
+        self._busy = False
+        if self._transportPaused:
+            self._transportPaused = False
+            self.transport.resumeProducing()
+        self._processRequests()
+
+    def _internalServerError(self, e):
+        twisted.python.log.err("Internal Server Error received: %s" % str(e))
+        twisted.python.log.err(e)
+        self._writeResponse(Response(500, "Internal Server Error", {}))
+
+    def _respond(self, f, *args):
+        """
+        Call C{f} with C{args} to get a response, or a Deferred firing with
+        one, and write it.
+        """
+        try:
+            handlerResult = _toDeferred(f(*args))
+            if isinstance(handlerResult, Deferred):
+                self._awaitResponse(handlerResult)
+            else:
+                self._writeResponse(handlerResult)
+        except Exception,e:
+            self._internalServerError(e)
+
+    def _awaitResponse(self, result):
+        """
+        Write the response C{result} fires with, or a 500 response if it
+        fails.  If the connection is lost first, C{result} is cancelled and
+        nothing is written.
+        """
         def deferredCallback(response):
+            self._pendingResponse = None
+            if self._disconnected:
+                return
             try:
                 response.code
                 self._writeResponse(response)
             except Exception,e:
-                internalServerError(e)
+                self._internalServerError(e)
+
+        def deferredErrback(reason):
+            self._pendingResponse = None
+            if self._disconnected:
+                if not reason.check(CancelledError):
+                    twisted.python.log.err(reason)
+                return
+            self._internalServerError(reason)
+
+        self._pendingResponse = result
+        result.addCallbacks(deferredCallback, deferredErrback)
+
+    def requestReceived(self, method, path, headers, body):
+        self._requestReceived(Request(method, path, headers, body))
+
+    def _requestReceived(self, request):
+        # We have a full request now, cancel the request timeout.
+        self._cancelTimeout()
+        method = request.method
+        path = request.path
+        if self.tracer is not None:
+            self.tracer.requestReceived(method, path, request.headers)
+        metrics = self.metrics
+        if metrics is not None:
+            if self._phaseStarted is not None:
+                self._phases = metrics.recorders(method, path)
+                now = metrics.clock()
+                self._phases[0](now - self._phaseStarted)
+                self._phaseStarted = now
+            metricsPath = metrics.path
+            if (metricsPath is not None and path.startswith(metricsPath) and
+                    path.partition("?")[0] == metricsPath):
+                self._respond(metrics.response, self.handlerPool)
+                return
+        limiter = self.rateLimiter
+        if limiter is not None:
+            limited = limiter.check(self._clientKey(request, limiter.header))
+            if limited is not None:
+                self._writeResponse(limited)
+                return
+        if self.compressor is not None:
+            requestHeaders = request.headers
+            if not isinstance(requestHeaders, Headers):
+                requestHeaders = Headers(requestHeaders)
+            self._acceptEncoding = requestHeaders.get("Accept-Encoding", "")
+        cache = self.responseCache
+        if cache is not None:
+            self._respond(cache.fetch, self._callHandler, method, path,
+                          request.headers, request.body)
+        else:
+            self._respond(self._callHandler, request)
+
+    def _clientKey(self, request, header):
+        """
+        Identify the client making a request, for rate limiting.
 
-        # We have a full request now, cancel the 60 second abort.
-        try: self.abortAfter60.cancel()
-        except: pass
+        @param header: The name of the request header identifying the
+            client, or C{None}.
 
+        @return: The value of C{header} in C{request}, if given and present,
+            or else the host of the address the client connects from.
+        """
+        if header is not None:
+            requestHeaders = request.headers
+            if not isinstance(requestHeaders, Headers):
+                requestHeaders = Headers(requestHeaders)
+            key = requestHeaders.get(header)
+            if key is not None:
+                return key
+        peer = self.transport.getPeer()
+        return getattr(peer, "host", peer)
+
+    def _callHandler(self, *args):
+        """
+        Call the handler, in the handler pool if it should run there, unless
+        too many handler calls are in flight.
+
+        @param args: The L{Request}, or its method, path, headers and body.
+        """
+        admission = self.admission
+        if admission is None:
+            return self._dispatch(*args)
+        if not admission.acquire():
+            return admission.response
         try:
-            with open('afile', 'w') as f:
-                # twisted.python.log.err("headers: %s" % headers)
-                f.write("headers: %s\r\n" % headers)
+            result = self._dispatch(*args)
+        except:
+            admission.release()
+            raise
+        if isinstance(result, Deferred):
+            def released(passthrough):
+                admission.release()
+                return passthrough
+            result.addBoth(released)
+        else:
+            admission.release()
+        return result
 
-            handlerResult = self._handler(method, path, headers, foo)
-            if isinstance(handlerResult, Deferred):
-                handlerResult.addCallback(deferredCallback)
-                handlerResult.addErrback(internalServerError)
-            else:
-                self._writeResponse(handlerResult)
-        except RuntimeError,e:
-            internalServerError(e)
+    def _dispatch(self, *args):
+        """
+        Call the handler with the L{Request} or, depending on what it takes,
+        with the request's method, path, headers and body.
+        """
+        handler = self._handler
+        if self._takesRequest:
+            if len(args) != 1:
+                args = (Request(*args),)
+        elif len(args) == 1:
+            request = args[0]
+            args = (request.method, request.path, request.headers,
+                    request.body)
+        pool = self.handlerPool
+        if pool is not None and runsInPool(handler, self.execution):
+            return self._submit(handler, *args)
+        return _toDeferred(handler(*args))
+
+    def _submit(self, handler, *args):
+        """
+        Run C{handler} in the handler pool, or answer with a 503 response if
+        the pool is saturated.
+        """
+        try:
+            return self.handlerPool.submit(handler, *args)
+        except PoolSaturated:
+            return _SERVICE_UNAVAILABLE
 
     def badRequestReceived(self):
         self._writeResponse(Response(400, "", {}))
 
 
+class Request(object):
+    """
+    An HTTP request, as passed to handlers marked with L{takesRequest}.
+
+    The headers, query arguments and cookies are parsed when they are first
+    read, so requests whose handlers don't need them don't pay for them.
+
+    @ivar method: The request method.
+
+    @ivar path: The full request path, including the query string.
+
+    @ivar body: The request body.
+    """
+
+    __slots__ = ("method", "path", "body", "_headers", "_rawHeaders",
+                 "_query", "_cookies")
+
+    def __init__(self, method, path, headers, body, rawHeaders=None):
+        """
+        @param headers: The L{Headers} (or a dictionary), or C{None} if they
+            are to be parsed from C{rawHeaders}.
+
+        @param rawHeaders: The unparsed header lines, as passed on by a
+            L{RequestParser} with C{lazyHeaders} set.
+        """
+        self.method = method
+        self.path = path
+        self.body = body
+        self._headers = headers
+        self._rawHeaders = rawHeaders
+        self._query = None
+        self._cookies = None
+
+    @property
+    def headers(self):
+        """
+        The L{Headers} of the request.
+        """
+        headers = self._headers
+        if headers is None:
+            headers = self._headers = parseHeaders(self._rawHeaders or "")
+            self._rawHeaders = None
+        return headers
+
+    @property
+    def query(self):
+        """
+        The query arguments of the request, as returned by
+        L{toyhttp.codec.parseQuery}.
+        """
+        query = self._query
+        if query is None:
+            query = self._query = parseQuery(self.path)
+        return query
+
+    @property
+    def cookies(self):
+        """
+        A dictionary mapping the names of the cookies sent with the request
+        to their values.
+        """
+        cookies = self._cookies
+        if cookies is None:
+            headers = self.headers
+            if isinstance(headers, Headers):
+                header = "; ".join(headers.getAll("Cookie"))
+            else:
+                header = Headers(headers).get("Cookie")
+            cookies = self._cookies = parseCookies(header)
+        return cookies
+
+    def __repr__(self):
+        return "<Request %s %s>" % (self.method, self.path)
+
+
 class Response(object):
     """
     The response to an HTTP request.
 
     This will store the information needed to return a HTTP response.
     """
+
+    __slots__ = ("code", "body", "headers")
+
     #def __init__(self, *args, **kwargs):
     def __init__(self, statusCode, body, headers):
         self.code = statusCode
         self.body = body
         self.headers = headers
 
+    def renderHead(self, connection=None):
+        """
+        Render the status line and headers, including C{Content-Length} and
+        the blank line ending the head, but not the body.
+
+        @param connection: A value for a C{Connection} header to add, or
+            C{None}.
+        """
+        length = None
+        if self.code not in NO_BODY_CODES:
+            length = len(self.body)
+        return renderResponseHead(self.code, self.headers, length,
+                                  connection=connection)
+
     def __repr__(self):
-        sortedHeaders = self.headers.items()
-        sortedHeaders.sort()
-        headersStr = "\r\n".join("{0}: {1}".format(key, value) for key, value in sortedHeaders)
-        if len(headersStr) > 0:
-            headersStr = "%s\r\n" % headersStr
-
-        return ("HTTP/1.1 %d Reason\r\n"
-                "Content-Length: %d\r\n"
-                "%s"
-                "\r\n"
-                "%s" % (self.code, len(self.body), headersStr, self.body))
+        return self.renderHead() + self.body
+
+
+class PrerenderedResponse(Response):
+    """
+    A L{Response} whose head is rendered once, when it is created, rather
+    than every time it is written, for responses that are sent over and
+    over.  Its code, headers and body must not be changed afterwards.
+    """
+
+    __slots__ = ("_heads",)
+
+    def __init__(self, statusCode, body, headers):
+        Response.__init__(self, statusCode, body, headers)
+        head = Response.renderHead(self)
+        # The head without its final blank line, for adding headers to:
+        prefix = head[:-2]
+        self._heads = {
+            None: head,
+            "close": prefix + "Connection: close\r\n\r\n",
+            "keep-alive": prefix + "Connection: keep-alive\r\n\r\n"}
+
+    def renderHead(self, connection=None):
+        head = self._heads.get(connection)
+        if head is None:
+            head = Response.renderHead(self, connection)
+        return head
+
+    def size(self):
+        """
+        @return: The number of bytes the response is written as, without a
+            C{Connection} header.
+        """
+        return len(self._heads[None]) + len(self.body)
+
+
+class UpgradeResponse(Response):
+    """
+    A 101 (Switching Protocols) response, after which the connection is
+    handed over to another protocol.
+
+    @ivar protocol: The protocol taking over the connection once the
+        response has been written.  It is connected to the transport, and
+        given any bytes the client sent after the request.
+    """
+
+    __slots__ = ("protocol",)
+
+    def __init__(self, headers, protocol):
+        """
+        @param headers: The response headers, including C{Upgrade} and
+            C{Connection: Upgrade}.
+        """
+        Response.__init__(self, 101, "", headers)
+        self.protocol = protocol
+
+
+class StreamingResponse(object):
+    """
+    A response whose body is produced while it is being written, so it never
+    has to be held in memory as a whole.
+
+    The body may be:
+
+        - An iterable of byte strings.
+        - A file-like object, which is read a slice at a time.
+        - A L{twisted.web.iweb.IBodyProducer} provider (for example a
+          L{twisted.web.client.FileBodyProducer}), typically itself a push or
+          pull producer, which is given a consumer to write the body to.
+
+    In every case more of the body is only produced when the transport's
+    buffer has drained.  If the length of the body is known it is sent as a
+    C{Content-Length} header; otherwise the body uses chunked
+    transfer-encoding for HTTP/1.1 clients, and the end of the connection
+    marks the end of the body for HTTP/1.0 clients.
+    """
+
+    __slots__ = ("code", "body", "headers", "length")
+
+    def __init__(self, statusCode, body, headers, length=None):
+        """
+        @param length: The length of the body in bytes, or C{None} if it is
+            not known in advance.  For L{IBodyProducer} bodies the producer's
+            own C{length} is used if this is C{None}.
+        """
+        self.code = statusCode
+        self.body = body
+        self.headers = headers
+        if (length is None and IBodyProducer.providedBy(body) and
+                body.length is not UNKNOWN_LENGTH):
+            length = body.length
+        self.length = length
+
+    def renderHead(self, connection=None, chunked=False):
+        """
+        Render the status line and headers, including the blank line ending
+        the head.
+
+        @param connection: A value for a C{Connection} header to add, or
+            C{None}.
+
+        @param chunked: Whether the body will be sent using chunked
+            transfer-encoding.
+        """
+        return renderResponseHead(self.code, self.headers, self.length,
+                                  chunked, connection)
+
+
+def _serviceUnavailable(retryAfter):
+    """
+    @param retryAfter: Seconds for the C{Retry-After} header.
+
+    @return: A 503 response telling the client to retry after C{retryAfter}
+        seconds.
+    """
+    return PrerenderedResponse(
+        503, "Service unavailable.",
+        {"Content-Type": "text/plain", "Retry-After": str(retryAfter)})
+
+
+_SERVICE_UNAVAILABLE = _serviceUnavailable(1)
+
+_GATEWAY_TIMEOUT = PrerenderedResponse(504, "", {})
+
+
+def _closeBody(body):
+    """
+    Close the body of a L{StreamingResponse}, if it is a file-like object
+    rather than an L{IBodyProducer}.
+    """
+    close = getattr(body, "close", None)
+    if close is not None and not IBodyProducer.providedBy(body):
+        close()
+
+
+@implementer(IPullProducer)
+class _BodySender(object):
+    """
+    Write a large response body to a transport slice by slice, as the
+    transport asks for more, so the body is never copied as a whole.
+    """
+
+    sliceSize = 128 * 1024
+
+    def __init__(self, protocol, body, persistent):
+        self._protocol = protocol
+        self._body = body
+        self._persistent = persistent
+        self._offset = 0
+
+    def resumeProducing(self):
+        offset = self._offset
+        self._offset = offset + self.sliceSize
+        transport = self._protocol.transport
+        transport.write(self._body[offset:self._offset])
+        self._protocol._writeProgressed()
+        if self._offset >= len(self._body):
+            self._body = None
+            transport.unregisterProducer()
+            self._protocol._responseDone(self._persistent)
+
+    def stopProducing(self):
+        self._body = None
+
+
+
+@implementer(IConsumer, IPullProducer)
+class _BodyStreamer(object):
+    """
+    Write the body of a L{StreamingResponse} to a transport, optionally
+    using chunked transfer-encoding.
+
+    For iterable and file bodies this is registered with the transport as a
+    pull producer, producing one piece of the body each time the transport
+    asks for more.  For L{IBodyProducer} bodies it is the consumer the body
+    producer writes to, passing the producer on to the transport so it gets
+    paused and resumed according to the transport's buffer.
+    """
+
+    sliceSize = 64 * 1024
+
+    def __init__(self, protocol, response, chunked, persistent):
+        self._protocol = protocol
+        self._transport = protocol.transport
+        self._body = response.body
+        self._length = response.length
+        self._chunked = chunked
+        self._persistent = persistent
+        self._written = 0
+        self._iterator = None
+        self._finished = False
+
+    def start(self):
+        body = self._body
+        if IBodyProducer.providedBy(body):
+            d = body.startProducing(self)
+            d.addCallbacks(lambda ignored: self._finish(), self._fail)
+        else:
+            if not hasattr(body, "read"):
+                self._iterator = iter(body)
+            self._transport.registerProducer(self, False)
+
+    # IConsumer, for IBodyProducer bodies:
+
+    def registerProducer(self, producer, streaming):
+        self._transport.registerProducer(producer, streaming)
+
+    def unregisterProducer(self):
+        self._transport.unregisterProducer()
+
+    def write(self, data):
+        if not data or self._finished:
+            # An empty chunk would end a chunked body.
+            return
+        self._written += len(data)
+        self._protocol._writeProgressed(len(data))
+        if self._chunked:
+            self._transport.writeSequence(encodeChunk(data))
+        else:
+            self._transport.write(data)
+
+    # IPullProducer, for iterable and file bodies:
+
+    def resumeProducing(self):
+        try:
+            if self._iterator is None:
+                data = self._body.read(self.sliceSize)
+            else:
+                data = ""
+                for data in self._iterator:
+                    # Skip empty pieces; they would end a chunked body.
+                    if data:
+                        break
+        except Exception:
+            self._transport.unregisterProducer()
+            self._fail(Failure())
+            return
+        if data:
+            self.write(data)
+        else:
+            self._transport.unregisterProducer()
+            self._finish()
+
+    def stopProducing(self):
+        # The connection was lost.
+        self._finished = True
+        self._close()
+
+    def _close(self):
+        _closeBody(self._body)
+        self._body = self._iterator = None
+
+    def _finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        self._close()
+        persistent = self._persistent
+        if self._length is not None and self._written != self._length:
+            twisted.python.log.msg(
+                "Streamed response body was %d bytes, not %d as announced" %
+                (self._written, self._length))
+            persistent = False
+        if self._chunked:
+            self._transport.write(LAST_CHUNK)
+        self._protocol._responseDone(persistent)
+
+    def _fail(self, reason):
+        """
+        The body couldn't be produced.  The head has already been sent, so
+        all we can do is log the error and drop the connection.
+        """
+        if self._finished:
+            return
+        self._finished = True
+        self._close()
+        twisted.python.log.err(reason, "Error producing response body")
+        self._transport.abortConnection()
 
 class HTTPFactory(ServerFactory):
     """
@@ -125,9 +1345,129 @@ class HTTPFactory(ServerFactory):
     This will create instances of the HTTP class.
     """
 
-    def __init__(self, handler, *args, **kwargs):
+    def __init__(self, handler, maxRequestsPerConnection=100,
+                 keepAliveTimeout=15, maxBodySize=HTTP.maxBodySize,
+                 tracer=None, execution=REACTOR, handlerPool=None,
+                 headerTimeout=HTTP.headerTimeout,
+                 bodyTimeout=HTTP.bodyTimeout,
+                 writeTimeout=HTTP.writeTimeout, responseCache=None,
+                 compressor=None, metrics=None, admission=None,
+                 rateLimiter=None, minHeaderRate=HTTP.minHeaderRate,
+                 maxRequestLineSize=HTTP.maxRequestLineSize,
+                 maxHeadSize=HTTP.maxHeadSize,
+                 maxHeaderCount=HTTP.maxHeaderCount, *args, **kwargs):
+        """
+        @param handler: The function called to handle each request.
+
+        @param maxRequestsPerConnection: The number of requests served on a
+            single persistent connection before it is closed, or C{None} for
+            no limit.
+
+        @param keepAliveTimeout: Seconds an idle persistent connection is
+            kept open waiting for the next request.
+
+        @param maxBodySize: The largest request body accepted, in bytes, or
+            C{None} for no limit.
+
+        @param tracer: An optional L{toyhttp.trace.RequestTracer} that records
+            every request and response.
+
+        @param execution: L{toyhttp.offload.REACTOR} to run handlers in the
+            reactor thread unless they are marked as blocking, or
+            L{toyhttp.offload.THREADS} to run them in the handler pool unless
+            they are marked as non-blocking.
+
+        @param handlerPool: The L{toyhttp.offload.HandlerPool} running
+            blocking handlers; by default one with 10 threads, whose threads
+            are only started if a handler is run in it.
+
+        @param headerTimeout: Seconds a client has to send a request head.
+
+        @param bodyTimeout: Seconds a client may pause while sending a
+            request body.
+
+        @param writeTimeout: Seconds a response may go without the client
+            reading any of it.
+
+        @param responseCache: An optional L{toyhttp.cache.ResponseCache}
+            answering repeated requests from stored responses.
+
+        @param compressor: An optional L{toyhttp.compress.Compressor}
+            compressing responses the client accepts compressed.
+
+        @param metrics: An optional L{toyhttp.metrics.Metrics} recording
+            the server's connections, requests and responses.
+
+        @param admission: An optional L{toyhttp.admission.AdmissionControl}
+            limiting the server's connections and handler calls in flight.
+
+        @param rateLimiter: An optional L{toyhttp.ratelimit.RateLimiter}
+            limiting the request rate of each client.
+
+        @param minHeaderRate: The slowest average rate, in bytes per second,
+            at which a client may send a request head, or C{None} to not
+            check it.
+
+        @param maxRequestLineSize: The longest request line accepted.
+
+        @param maxHeadSize: The largest request head accepted, in bytes.
+
+        @param maxHeaderCount: The most header lines accepted in a request.
+        """
         self._handler = handler
+        self.maxRequestsPerConnection = maxRequestsPerConnection
+        self.keepAliveTimeout = keepAliveTimeout
+        self.maxBodySize = maxBodySize
+        self.tracer = tracer
+        self.execution = execution
+        if handlerPool is None:
+            handlerPool = HandlerPool()
+        self.handlerPool = handlerPool
+        self.headerTimeout = headerTimeout
+        self.bodyTimeout = bodyTimeout
+        self.writeTimeout = writeTimeout
+        self.responseCache = responseCache
+        self.compressor = compressor
+        self.metrics = metrics
+        self.admission = admission
+        self.rateLimiter = rateLimiter
+        self.minHeaderRate = minHeaderRate
+        self.maxRequestLineSize = maxRequestLineSize
+        self.maxHeadSize = maxHeadSize
+        self.maxHeaderCount = maxHeaderCount
+        self._timerWheels = {}
 
-    def buildProtocol(self, arg):
-        return HTTP(self._handler)
+    def timerWheel(self, reactor):
+        """
+        Get the L{TimerWheel} shared by the connections using C{reactor}.
+        """
+        wheel = self._timerWheels.get(reactor)
+        if wheel is None:
+            wheel = self._timerWheels[reactor] = TimerWheel(reactor)
+        return wheel
 
+    def buildProtocol(self, arg):
+        admission = self.admission
+        if admission is not None and not admission.admitConnection():
+            return admission.rejectedProtocol()
+        protocol = HTTP(self._handler)
+        protocol.factory = self
+        protocol.maxRequestsPerConnection = self.maxRequestsPerConnection
+        protocol.keepAliveTimeout = self.keepAliveTimeout
+        protocol.headerTimeout = self.headerTimeout
+        protocol.bodyTimeout = self.bodyTimeout
+        protocol.writeTimeout = self.writeTimeout
+        protocol.maxBodySize = self.maxBodySize
+        protocol.tracer = self.tracer
+        protocol.execution = self.execution
+        protocol.handlerPool = self.handlerPool
+        protocol.responseCache = self.responseCache
+        protocol.compressor = self.compressor
+        protocol.metrics = self.metrics
+        protocol.admission = self.admission
+        protocol.rateLimiter = self.rateLimiter
+        protocol.minHeaderRate = self.minHeaderRate
+        protocol.maxRequestLineSize = self.maxRequestLineSize
+        protocol.maxHeadSize = self.maxHeadSize
+        protocol.maxHeaderCount = self.maxHeaderCount
+        return protocol
@@ -0,0 +1,284 @@
+"""
+Serve static files from a directory tree.
+
+Files are memory-mapped and written to the client a slice at a time as the
+transport drains, so a file is never read into memory as a whole.  Open files
+(and their mappings) are kept in a small LRU cache, so popular files aren't
+reopened and remapped for every request.
+
+Python 2 has no C{os.sendfile}, and Twisted transports don't expose a way to
+hand it a file descriptor, so bytes still pass through (slice-sized) strings
+on their way from the page cache to the socket.
+"""
+
+import collections
+import mimetypes
+import mmap
+import os
+import urllib
+
+from twisted.web.http import datetimeToString, stringToDatetime
+
+from toyhttp.codec import Headers
+from toyhttp.server import Response, StreamingResponse
+
+
+def _getHeader(headers, name):
+    """
+    Look up a request header case-insensitively.
+
+    @param name: The lowercase header name.
+
+    @return: The header value, or C{None}.
+    """
+    if isinstance(headers, Headers):
+        return headers.get(name)
+    for key, value in headers.iteritems():
+        if key.lower() == name:
+            return value
+    return None
+
+
+class _OpenFile(object):
+    """
+    An open, memory-mapped file in the cache of a L{StaticFiles} handler.
+
+    The file is only closed once it has been evicted from the cache I{and}
+    no response is still being written from it.
+    """
+
+    def __init__(self, path, stat):
+        self.stat = stat
+        self.etag = '"%x-%x-%x"' % (stat.st_ino, stat.st_size,
+                                    int(stat.st_mtime * 1000000))
+        self.lastModified = datetimeToString(stat.st_mtime)
+        self._users = 0
+        self._evicted = False
+        self._file = open(path, "rb")
+        if stat.st_size:
+            self.map = mmap.mmap(self._file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        else:
+            # Empty files can't be mapped.
+            self.map = ""
+
+    def isCurrent(self, stat):
+        """
+        Whether C{stat} describes the same version of the file as the one
+        that was opened.
+        """
+        return (stat.st_ino == self.stat.st_ino and
+                stat.st_size == self.stat.st_size and
+                stat.st_mtime == self.stat.st_mtime)
+
+    def acquire(self):
+        self._users += 1
+
+    def release(self):
+        self._users -= 1
+        if self._evicted and not self._users:
+            self._close()
+
+    def evict(self):
+        self._evicted = True
+        if not self._users:
+            self._close()
+
+    def _close(self):
+        if self.map:
+            self.map.close()
+        self._file.close()
+
+
+class _MappedRange(object):
+    """
+    A file-like view of part of an L{_OpenFile}, used as the body of a
+    L{StreamingResponse}.
+    """
+
+    def __init__(self, openFile, offset, length):
+        openFile.acquire()
+        self._openFile = openFile
+        self._offset = offset
+        self._end = offset + length
+
+    def read(self, size):
+        offset = self._offset
+        self._offset = min(offset + size, self._end)
+        return self._openFile.map[offset:self._offset]
+
+    def close(self):
+        if self._openFile is not None:
+            self._openFile.release()
+            self._openFile = None
+
+
+class StaticFiles(object):
+    """
+    A handler serving the files in a directory tree.
+
+    Supports conditional requests (C{ETag}/C{If-None-Match} and
+    C{Last-Modified}/C{If-Modified-Since}, answered with 304 responses) and
+    single byte-range requests (answered with 206 responses).  C{HEAD}
+    requests get the same headers as C{GET} requests, without the body.
+    """
+
+    def __init__(self, root, prefix="", maxOpenFiles=128,
+                 indexFile="index.html"):
+        """
+        @param root: The directory to serve.
+
+        @param prefix: A path prefix to remove from request paths, e.g.
+            C{"/static"}; requests for paths not starting with it get a 404.
+
+        @param maxOpenFiles: The number of open files kept in the cache.
+
+        @param indexFile: The name of the file served for requests for a
+            directory, or C{None}.
+        """
+        self.root = os.path.abspath(root)
+        self.prefix = prefix.rstrip("/")
+        self.maxOpenFiles = maxOpenFiles
+        self.indexFile = indexFile
+        self._cache = collections.OrderedDict()
+
+    def __call__(self, method, path, headers, body):
+        if method != "GET" and method != "HEAD":
+            return Response(405, "", {"Allow": "GET, HEAD"})
+        filePath = self._resolve(path)
+        if filePath is None:
+            return Response(404, "Not found.", {"Content-Type": "text/plain"})
+        try:
+            stat = os.stat(filePath)
+        except OSError:
+            return Response(404, "Not found.", {"Content-Type": "text/plain"})
+        openFile = self._open(filePath, stat)
+
+        responseHeaders = {"ETag": openFile.etag,
+                           "Last-Modified": openFile.lastModified}
+        if self._notModified(openFile, headers):
+            return Response(304, "", responseHeaders)
+
+        contentType, encoding = mimetypes.guess_type(filePath)
+        responseHeaders["Content-Type"] = (
+            contentType or "application/octet-stream")
+        responseHeaders["Accept-Ranges"] = "bytes"
+        size = stat.st_size
+        code, offset, length = 200, 0, size
+        rangeHeader = _getHeader(headers, "range")
+        if rangeHeader is not None:
+            byteRange = self._parseRange(rangeHeader, size)
+            if byteRange is False:
+                return Response(416, "", {"Content-Range": "bytes */%d" %
+                                                           (size,)})
+            elif byteRange is not None:
+                offset, last = byteRange
+                code, length = 206, last - offset + 1
+                responseHeaders["Content-Range"] = "bytes %d-%d/%d" % (
+                    offset, last, size)
+        if method == "HEAD":
+            # Only the head is written, with the length of the file (or
+            # range) as its Content-Length, so the file isn't read:
+            return StreamingResponse(code, (), responseHeaders, length)
+        return StreamingResponse(code, _MappedRange(openFile, offset, length),
+                                 responseHeaders, length)
+
+    def _resolve(self, path):
+        """
+        Map a request path to a file below the root directory.
+
+        @return: The file's path, or C{None} if the request path is outside
+            the prefix or the root directory.
+        """
+        path = path.split("?", 1)[0]
+        if self.prefix:
+            if path != self.prefix and not path.startswith(self.prefix + "/"):
+                return None
+            path = path[len(self.prefix):]
+        path = urllib.unquote(path)
+        if "\0" in path:
+            return None
+        filePath = os.path.normpath(os.path.join(self.root, path.lstrip("/")))
+        if filePath != self.root and not filePath.startswith(
+                self.root + os.sep):
+            return None
+        if os.path.isdir(filePath):
+            if self.indexFile is None:
+                return None
+            filePath = os.path.join(filePath, self.indexFile)
+        return filePath
+
+    def _open(self, filePath, stat):
+        """
+        Get an L{_OpenFile} for the current version of a file, from the cache
+        if possible.
+        """
+        cache = self._cache
+        openFile = cache.pop(filePath, None)
+        if openFile is not None and not openFile.isCurrent(stat):
+            openFile.evict()
+            openFile = None
+        if openFile is None:
+            openFile = _OpenFile(filePath, stat)
+            while len(cache) >= self.maxOpenFiles:
+                cache.popitem(last=False)[1].evict()
+        # (Re-)insert as the most recently used entry.
+        cache[filePath] = openFile
+        return openFile
+
+    def _notModified(self, openFile, headers):
+        """
+        Whether the client's cached copy, as described by its conditional
+        request headers, is still current.
+        """
+        ifNoneMatch = _getHeader(headers, "if-none-match")
+        if ifNoneMatch is not None:
+            if ifNoneMatch.strip() == "*":
+                return True
+            for tag in ifNoneMatch.split(","):
+                tag = tag.strip()
+                if tag.startswith("W/"):
+                    tag = tag[2:]
+                if tag == openFile.etag:
+                    return True
+            return False
+        ifModifiedSince = _getHeader(headers, "if-modified-since")
+        if ifModifiedSince is not None:
+            try:
+                since = stringToDatetime(ifModifiedSince)
+            except (ValueError, IndexError, KeyError):
+                return False
+            return int(openFile.stat.st_mtime) <= since
+        return False
+
+    def _parseRange(self, rangeHeader, size):
+        """
+        Parse a C{Range} header.
+
+        @return: An inclusive C{(first, last)} byte range, C{None} if the
+            header should be ignored (it's malformed, or asks for several
+            ranges), or C{False} if the range can't be satisfied.
+        """
+        unit, _, spec = rangeHeader.partition("=")
+        if unit.strip().lower() != "bytes" or "," in spec:
+            return None
+        first, dash, last = spec.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if first:
+                first = int(first)
+                last = int(last) if last else size - 1
+            else:
+                # A suffix range: the last N bytes.
+                suffix = int(last)
+                if not suffix:
+                    return False
+                first, last = max(size - suffix, 0), size - 1
+        except ValueError:
+            return None
+        if first >= size:
+            return False
+        if last < first:
+            return None
+        return first, min(last, size - 1)
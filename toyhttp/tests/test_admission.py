@@ -0,0 +1,129 @@
+"""
+Tests for toyhttp.admission.
+"""
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import defer, task
+from twisted.python.failure import Failure
+from twisted.internet.error import ConnectionDone
+
+from toyhttp.admission import AdmissionControl
+from toyhttp.server import HTTP, HTTPFactory, Response
+from toyhttp.tests.test_server import AbortableTransport
+
+
+class FakePort(object):
+    """
+    A listening port recording whether it is reading.
+    """
+
+    reading = True
+
+    def stopReading(self):
+        self.reading = False
+
+    def startReading(self):
+        self.reading = True
+
+
+class Tests01_Admission(TestCase):
+    """
+    Tests for L{AdmissionControl} and its use by L{HTTPFactory}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.pending = []
+
+        def handler(method, path, headers, body):
+            self.pending.append(defer.Deferred())
+            return self.pending[-1]
+
+        self.handler = handler
+
+    def connect(self, factory):
+        protocol = factory.buildProtocol(None)
+        if isinstance(protocol, HTTP):
+            protocol.reactor = self.clock
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        return protocol, transport
+
+    def test_01_maxConnections(self):
+        """
+        Connections over C{maxConnections} are answered with a 503 response
+        and closed once their request has arrived.
+        """
+        admission = AdmissionControl(maxConnections=1, retryAfter=5,
+                                     reactor=self.clock)
+        factory = HTTPFactory(self.handler, admission=admission)
+        first, firstTransport = self.connect(factory)
+        second, transport = self.connect(factory)
+        self.assertNotIsInstance(second, HTTP)
+        head = transport.value().split("\r\n\r\n", 1)[0].split("\r\n")
+        self.assertEqual(head[0], "HTTP/1.1 503 Service Unavailable")
+        self.assertIn("Retry-After: 5", head)
+        self.assertIn("Connection: close", head)
+        self.assertFalse(transport.disconnecting)
+        second.dataReceived("GET / HTTP/1.1\r\n\r")
+        second.dataReceived("\n")
+        self.assertTrue(transport.disconnecting)
+        second.connectionLost(Failure(ConnectionDone()))
+        self.assertIdentical(second._lingerCall, None)
+        self.assertEqual(admission.rejectedConnections, 1)
+
+        first.connectionLost(Failure(ConnectionDone()))
+        third, transport = self.connect(factory)
+        self.assertIsInstance(third, HTTP)
+
+    def test_02_linger(self):
+        """
+        Rejected connections that send no request are aborted after
+        C{lingerTimeout} seconds.
+        """
+        admission = AdmissionControl(maxConnections=0, reactor=self.clock)
+        protocol, transport = self.connect(
+            HTTPFactory(self.handler, admission=admission))
+        self.clock.advance(admission.lingerTimeout)
+        self.assertTrue(transport.aborting)
+
+    def test_03_pauseAccepting(self):
+        """
+        With C{pauseAccepting}, the listening port stops reading while there
+        are C{maxConnections} connections.
+        """
+        admission = AdmissionControl(maxConnections=2, pauseAccepting=True,
+                                     reactor=self.clock)
+        port = FakePort()
+        admission.listening(port)
+        factory = HTTPFactory(self.handler, admission=admission)
+        first = self.connect(factory)[0]
+        self.assertTrue(port.reading)
+        self.connect(factory)
+        self.assertFalse(port.reading)
+        first.connectionLost(Failure(ConnectionDone()))
+        self.assertTrue(port.reading)
+        self.assertEqual(admission.connections, 1)
+
+    def test_04_maxInFlight(self):
+        """
+        Requests arriving while C{maxInFlight} handler calls are in flight
+        get a 503 response without calling the handler.
+        """
+        admission = AdmissionControl(maxInFlight=1, reactor=self.clock)
+        factory = HTTPFactory(self.handler, admission=admission)
+        first, firstTransport = self.connect(factory)
+        second, transport = self.connect(factory)
+        first.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        second.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        self.assertEqual(len(self.pending), 1)
+        self.assertTrue(transport.value().startswith("HTTP/1.1 503 "))
+        self.assertFalse(transport.disconnecting)
+        self.assertEqual(admission.rejectedRequests, 1)
+
+        self.pending[0].callback(Response(200, "done", {}))
+        self.assertEqual(admission.inFlight, 0)
+        transport.clear()
+        second.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        self.assertEqual(len(self.pending), 2)
+        self.assertEqual(transport.value(), "")
@@ -0,0 +1,264 @@
+"""
+Tests for toyhttp.cache.
+"""
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import defer, task
+
+from toyhttp.cache import ResponseCache
+from toyhttp.codec import Headers
+from toyhttp.server import (HTTPFactory, Response, PrerenderedResponse,
+                            StreamingResponse)
+from toyhttp.tests.test_server import AbortableTransport
+
+
+class CountingHandler(object):
+    """
+    A handler recording the requests it is called for, and answering with
+    the response returned by C{respond}.
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+
+    def __call__(self, method, path, headers, body):
+        self.requests.append((method, path))
+        return self.respond(method, path, headers)
+
+
+def ok(method, path, headers, extra={}):
+    headers = {"Content-Type": "text/plain"}
+    headers.update(extra)
+    return Response(200, path, headers)
+
+
+class Tests01_ResponseCache(TestCase):
+    """
+    Tests for L{ResponseCache}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+
+    def makeCache(self, **kwargs):
+        return ResponseCache(clock=self.clock.seconds, **kwargs)
+
+    def test_01_hit(self):
+        """
+        A repeated request is answered with the stored, prerendered response
+        without calling the handler.
+        """
+        cache = self.makeCache()
+        handler = CountingHandler(ok)
+        first = cache.fetch(handler, "GET", "/a", {}, "")
+        second = cache.fetch(handler, "GET", "/a", {}, "")
+        self.assertIsInstance(second, PrerenderedResponse)
+        self.assertIdentical(first, second)
+        self.assertEqual(second.body, "/a")
+        self.assertEqual(handler.requests, [("GET", "/a")])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.fetch(handler, "GET", "/b", {}, "")
+        cache.fetch(handler, "POST", "/a", {}, "")
+        self.assertEqual(len(handler.requests), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_02_ttl(self):
+        """
+        Responses are stored for their C{max-age}, or else the default TTL.
+        """
+        cache = self.makeCache(ttl=10)
+        handler = CountingHandler(
+            lambda method, path, headers: ok(
+                method, path, headers,
+                {"Cache-Control": "public, max-age=30"}
+                if path == "/long" else {}))
+        for path in ["/short", "/long"]:
+            cache.fetch(handler, "GET", path, {}, "")
+        self.clock.advance(10)
+        for path in ["/short", "/long"]:
+            cache.fetch(handler, "GET", path, {}, "")
+        self.assertEqual(handler.requests,
+                         [("GET", "/short"), ("GET", "/long"),
+                          ("GET", "/short")])
+        self.clock.advance(20)
+        cache.fetch(handler, "GET", "/long", {}, "")
+        self.assertEqual(handler.requests[-1], ("GET", "/long"))
+
+    def test_03_notStored(self):
+        """
+        Responses the origin marks as not shareable, streamed responses and
+        errors aren't stored.
+        """
+        responses = {
+            "/no-store": ok(None, "", None, {"Cache-Control": "no-store"}),
+            "/private": ok(None, "", None, {"cache-control": "private"}),
+            "/cookie": ok(None, "", None, {"Set-Cookie": "a=b"}),
+            "/vary": ok(None, "", None, {"Vary": "Accept-Language"}),
+            "/error": Response(500, "", {}),
+            "/stream": StreamingResponse(200, ["a"], {}, 1)}
+        cache = self.makeCache()
+        handler = CountingHandler(
+            lambda method, path, headers: responses[path])
+        for i in range(2):
+            for path in responses:
+                cache.fetch(handler, "GET", path, {}, "")
+        self.assertEqual(len(handler.requests), 2 * len(responses))
+        self.assertEqual(len(cache), 0)
+
+    def test_04_requestDirectives(self):
+        """
+        Requests marked C{no-cache} get a fresh response, which replaces the
+        stored one; requests marked C{no-store} or with credentials bypass
+        the cache.
+        """
+        cache = self.makeCache()
+        handler = CountingHandler(ok)
+        first = cache.fetch(handler, "GET", "/", {}, "")
+        second = cache.fetch(handler, "GET", "/",
+                             {"Cache-Control": "no-cache"}, "")
+        self.assertNotIdentical(first, second)
+        self.assertIdentical(cache.fetch(handler, "GET", "/", {}, ""), second)
+        for headers in [{"cache-control": "no-store"},
+                        {"Authorization": "Basic eDp5"},
+                        {"Range": "bytes=0-1"}]:
+            self.assertNotIsInstance(
+                cache.fetch(handler, "GET", "/", headers, ""),
+                PrerenderedResponse)
+        self.assertEqual(len(handler.requests), 5)
+        self.assertEqual(cache.bypassed, 3)
+
+    def test_05_vary(self):
+        """
+        Requests differing in the headers named by C{vary} get separately
+        stored responses, which may vary on those headers.
+        """
+        cache = self.makeCache(vary=["Accept-Encoding"])
+        handler = CountingHandler(
+            lambda method, path, headers: ok(
+                method, headers.get("Accept-Encoding", "none"), headers,
+                {"Vary": "Accept-Encoding"}))
+        for i in range(2):
+            plain = cache.fetch(handler, "GET", "/", {}, "")
+            gzipped = cache.fetch(handler, "GET", "/",
+                                  Headers({"accept-encoding": "gzip"}), "")
+        self.assertEqual((plain.body, gzipped.body), ("none", "gzip"))
+        self.assertEqual(len(handler.requests), 2)
+
+    def test_06_evictLeastRecentlyUsed(self):
+        """
+        Once more than C{maxBytes} are stored, the least recently used
+        responses are evicted; responses larger than C{maxEntrySize} aren't
+        stored at all.
+        """
+        size = PrerenderedResponse(200, "/1", {"Content-Type": "text/plain"}
+                                   ).size()
+        cache = self.makeCache(maxBytes=size * 2, maxEntrySize=size)
+        handler = CountingHandler(ok)
+        for path in ["/1", "/2", "/1", "/3", "/1", "/2"]:
+            cache.fetch(handler, "GET", path, {}, "")
+        self.assertEqual([path for method, path in handler.requests],
+                         ["/1", "/2", "/3", "/2"])
+        self.assertEqual(cache.size, size * 2)
+        cache.fetch(handler, "GET", "/long/path", {}, "")
+        self.assertEqual(len(cache), 2)
+
+    def test_07_coalesce(self):
+        """
+        Requests arriving while the handler is answering an identical one
+        wait for its response.
+        """
+        pending = []
+        def respond(method, path, headers):
+            pending.append(defer.Deferred())
+            return pending[-1]
+        cache = self.makeCache()
+        handler = CountingHandler(respond)
+        results = [cache.fetch(handler, "GET", "/", {}, "") for i in range(3)]
+        self.assertEqual(len(handler.requests), 1)
+        self.assertEqual(cache.coalesced, 2)
+        pending[0].callback(Response(200, "shared", {}))
+        responses = [self.successResultOf(d) for d in results]
+        self.assertEqual([r.body for r in responses], ["shared"] * 3)
+        self.assertIdentical(responses[0], responses[2])
+
+    def test_08_coalesceUnshareable(self):
+        """
+        If the awaited response can't be stored, each waiting request calls
+        the handler for itself; failures are passed to every waiting request.
+        """
+        pending = []
+        def respond(method, path, headers):
+            pending.append(defer.Deferred())
+            return pending[-1]
+        cache = self.makeCache()
+        handler = CountingHandler(respond)
+        results = [cache.fetch(handler, "GET", "/", {}, "") for i in range(2)]
+        pending[0].callback(Response(200, "mine",
+                                     {"Cache-Control": "private"}))
+        self.assertEqual(self.successResultOf(results[0]).body, "mine")
+        self.assertNoResult(results[1])
+        pending[1].callback(Response(200, "yours", {}))
+        self.assertEqual(self.successResultOf(results[1]).body, "yours")
+
+        results = [cache.fetch(handler, "GET", "/x", {}, "")
+                   for i in range(2)]
+        pending[2].errback(ZeroDivisionError())
+        for d in results:
+            self.failureResultOf(d, ZeroDivisionError)
+        self.assertEqual(len(handler.requests), 3)
+
+    def test_09_server(self):
+        """
+        L{HTTPFactory} answers requests through its C{responseCache}, writing
+        stored responses with the right C{Connection} header.
+        """
+        handler = CountingHandler(ok)
+        factory = HTTPFactory(handler, responseCache=self.makeCache())
+        protocol = factory.buildProtocol(None)
+        protocol.reactor = self.clock
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived("GET /a HTTP/1.1\r\n\r\n"
+                              "GET /a HTTP/1.1\r\nConnection: close\r\n\r\n")
+        expected = ("HTTP/1.1 200 OK\r\n"
+                    "Content-Length: 2\r\n"
+                    "Content-Type: text/plain\r\n"
+                    "%s"
+                    "\r\n"
+                    "/a")
+        self.assertEqual(transport.value(),
+                         expected % ("",) +
+                         expected % ("Connection: close\r\n",))
+        self.assertEqual(len(handler.requests), 1)
+        self.assertTrue(transport.disconnecting)
+
+    def test_10_headAfterGet(self):
+        """
+        A C{HEAD} request is answered by the stored response to a C{GET}
+        request, written without its body; a C{GET} request is never
+        answered by the stored response to a C{HEAD} request.
+        """
+        cache = self.makeCache()
+        handler = CountingHandler(ok)
+        get = cache.fetch(handler, "GET", "/a", {}, "")
+        self.assertIdentical(cache.fetch(handler, "HEAD", "/a", {}, ""), get)
+        cache.fetch(handler, "HEAD", "/b", {}, "")
+        cache.fetch(handler, "GET", "/b", {}, "")
+        self.assertEqual(handler.requests,
+                         [("GET", "/a"), ("HEAD", "/b"), ("GET", "/b")])
+
+        factory = HTTPFactory(handler, responseCache=cache)
+        protocol = factory.buildProtocol(None)
+        protocol.reactor = self.clock
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived("HEAD /a HTTP/1.1\r\n\r\n"
+                              "GET /a HTTP/1.1\r\n\r\n")
+        head = ("HTTP/1.1 200 OK\r\n"
+                "Content-Length: 2\r\n"
+                "Content-Type: text/plain\r\n"
+                "\r\n")
+        self.assertEqual(transport.value(), head + head + "/a")
+        self.assertEqual(len(handler.requests), 3)
+        self.assertFalse(transport.disconnecting)
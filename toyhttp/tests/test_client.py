@@ -1,3 +1,243 @@
 """
 Tests for toyhttp.client.
 """
+
+from twisted.trial.unittest import TestCase
+from twisted.test.proto_helpers import StringTransport
+from twisted.internet import defer, error, reactor, task
+from twisted.python.failure import Failure
+
+from toyhttp.client import (HTTPClientProtocol, ConnectionPool,
+                            ResponseFailed, getPage)
+from toyhttp.server import HTTPFactory, Response
+
+
+class CountingFactory(HTTPFactory):
+    """
+    A L{HTTPFactory} counting the connections it serves.
+    """
+
+    connections = 0
+
+    def buildProtocol(self, addr):
+        self.connections += 1
+        return HTTPFactory.buildProtocol(self, addr)
+
+
+class Tests01_ClientProtocol(TestCase):
+    """
+    Tests for L{HTTPClientProtocol}.
+    """
+
+    def connect(self):
+        protocol = HTTPClientProtocol()
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+        return protocol, transport
+
+    def test_01_request(self):
+        """
+        L{HTTPClientProtocol.request} writes the request, adding C{Host} and
+        C{Content-Length} headers, and fires with the parsed response.
+        """
+        protocol, transport = self.connect()
+        d = protocol.request("POST", "/x?y=z", {"X-Key": "value"}, "abc",
+                             "example.com")
+        self.assertEqual(transport.value(),
+                         "POST /x?y=z HTTP/1.1\r\n"
+                         "X-Key: value\r\n"
+                         "Host: example.com\r\n"
+                         "Content-Length: 3\r\n"
+                         "\r\n"
+                         "abc")
+        protocol.dataReceived("HTTP/1.1 201 Created\r\n"
+                              "Content-Length: 2\r\n"
+                              "\r\n"
+                              "ok")
+        response = self.successResultOf(d)
+        self.assertEqual((response.code, response.body, response.headers),
+                         (201, "ok", {"Content-Length": "2"}))
+        self.assertTrue(protocol.persistent)
+
+    def test_02_chunkedAndInterim(self):
+        """
+        Chunked response bodies are decoded, and interim responses are
+        skipped.
+        """
+        protocol, transport = self.connect()
+        d = protocol.request("GET", "/", {}, None, "example.com")
+        protocol.dataReceived("HTTP/1.1 100 Continue\r\n\r\n"
+                              "HTTP/1.1 200 OK\r\n"
+                              "Transfer-Encoding: chunked\r\n"
+                              "\r\n"
+                              "3\r\nabc\r\n")
+        self.assertNoResult(d)
+        protocol.dataReceived("0\r\n\r\n")
+        self.assertEqual(self.successResultOf(d).body, "abc")
+
+    def test_03_bodyUntilClose(self):
+        """
+        A response without a length ends with the connection, which can't be
+        reused.
+        """
+        protocol, transport = self.connect()
+        d = protocol.request("GET", "/", {}, None, "example.com")
+        protocol.dataReceived("HTTP/1.0 200 OK\r\n\r\nsome")
+        protocol.dataReceived(" data")
+        self.assertNoResult(d)
+        protocol.connectionLost(Failure(error.ConnectionDone()))
+        self.assertEqual(self.successResultOf(d).body, "some data")
+        self.assertFalse(protocol.persistent)
+
+    def test_04_headResponse(self):
+        """
+        The response to a HEAD request has no body, whatever its headers
+        say.
+        """
+        protocol, transport = self.connect()
+        d = protocol.request("HEAD", "/", {}, None, "example.com")
+        protocol.dataReceived("HTTP/1.1 200 OK\r\n"
+                              "Content-Length: 10\r\n"
+                              "\r\n")
+        self.assertEqual(self.successResultOf(d).body, "")
+        self.assertTrue(protocol.persistent)
+
+    def test_05_connectionClose(self):
+        """
+        A response with C{Connection: close} makes the connection
+        non-persistent.
+        """
+        protocol, transport = self.connect()
+        d = protocol.request("GET", "/", {}, None, "example.com")
+        protocol.dataReceived("HTTP/1.1 200 OK\r\n"
+                              "Content-Length: 0\r\n"
+                              "Connection: close\r\n"
+                              "\r\n")
+        self.successResultOf(d)
+        self.assertFalse(protocol.persistent)
+
+    def test_06_lostMidResponse(self):
+        """
+        If the connection is lost before the response is complete, the
+        request fails with L{ResponseFailed}.
+        """
+        protocol, transport = self.connect()
+        d = protocol.request("GET", "/", {}, None, "example.com")
+        protocol.dataReceived("HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nab")
+        protocol.connectionLost(Failure(error.ConnectionLost()))
+        failure = self.failureResultOf(d, ResponseFailed)
+        self.assertTrue(failure.value.received)
+        self.assertTrue(failure.value.reason.check(error.ConnectionLost))
+
+    def test_07_badResponse(self):
+        """
+        An invalid response fails the request and closes the connection.
+        """
+        protocol, transport = self.connect()
+        d = protocol.request("GET", "/", {}, None, "example.com")
+        protocol.dataReceived("garbage\r\n\r\n")
+        self.failureResultOf(d, ResponseFailed)
+        self.assertTrue(transport.disconnecting)
+
+
+class Tests02_ConnectionPool(TestCase):
+    """
+    Tests for L{ConnectionPool} and L{getPage}, against a real server.
+    """
+
+    def setUp(self):
+        self.requests = []
+        self.factory = CountingFactory(self.handler)
+        self.port = reactor.listenTCP(0, self.factory, interface="127.0.0.1")
+        self.addCleanup(self.port.stopListening)
+        self.url = "http://127.0.0.1:%d" % (self.port.getHost().port,)
+
+    def handler(self, method, path, headers, body):
+        self.requests.append((method, path))
+        return Response(200, "%s %s %s" % (method, path, body),
+                        {"Content-Type": "text/plain"})
+
+    def makePool(self, **kwargs):
+        pool = ConnectionPool(**kwargs)
+        self.addCleanup(self.waitForServer)
+        self.addCleanup(pool.closeCachedConnections)
+        return pool
+
+    def waitForServer(self):
+        """
+        Wait for the server to notice its connections have been closed.
+        """
+        wheel = self.factory.timerWheel(reactor)
+        def check():
+            if len(wheel):
+                return task.deferLater(reactor, 0.01, check)
+        return check()
+
+    @defer.inlineCallbacks
+    def test_01_getPage(self):
+        """
+        L{getPage} sends a request and fires with the response.
+        """
+        pool = self.makePool()
+        response = yield getPage(self.url + "/a?b=c", "POST", {}, "body",
+                                 pool=pool)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, "POST /a?b=c body")
+        self.assertEqual(response.headers["Content-Type"], "text/plain")
+
+    @defer.inlineCallbacks
+    def test_02_reuseConnection(self):
+        """
+        Sequential requests to a host reuse the same connection.
+        """
+        pool = self.makePool()
+        for i in range(3):
+            response = yield pool.request("GET", self.url + "/%d" % (i,))
+            self.assertEqual(response.body, "GET /%d " % (i,))
+        self.assertEqual(self.factory.connections, 1)
+
+    @defer.inlineCallbacks
+    def test_03_maxPerHost(self):
+        """
+        Concurrent requests beyond C{maxPerHost} wait for a free connection.
+        """
+        pool = self.makePool(maxPerHost=2)
+        responses = yield defer.gatherResults(
+            [pool.request("GET", self.url + "/%d" % (i,)) for i in range(5)])
+        self.assertEqual([r.body for r in responses],
+                         ["GET /%d " % (i,) for i in range(5)])
+        self.assertEqual(self.factory.connections, 2)
+
+    @defer.inlineCallbacks
+    def test_04_notPersistent(self):
+        """
+        A non-persistent pool uses a new connection for every request.
+        """
+        pool = self.makePool(persistent=False)
+        for i in range(2):
+            yield pool.request("GET", self.url + "/")
+        self.assertEqual(self.factory.connections, 2)
+
+    @defer.inlineCallbacks
+    def test_05_retryClosedConnection(self):
+        """
+        An idempotent request sent on a pooled connection that the server
+        closed is sent again on a new connection.
+        """
+        pool = self.makePool()
+        yield pool.request("GET", self.url + "/1")
+        # Make the pooled connection look alive after the server closes it,
+        # as it would if the request crossed the server's close on the wire.
+        [protocol] = pool._idle.values()[0]
+        protocol.transport.loseConnection()
+        protocol.connected = 1
+        response = yield pool.request("GET", self.url + "/2")
+        self.assertEqual(response.body, "GET /2 ")
+        self.assertEqual(self.factory.connections, 2)
+
+    def test_06_unsupportedScheme(self):
+        """
+        Only http URLs are supported.
+        """
+        d = getPage("https://example.com/", pool=self.makePool())
+        self.failureResultOf(d, ValueError)
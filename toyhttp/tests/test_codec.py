@@ -0,0 +1,461 @@
+"""
+Tests for toyhttp.codec.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from toyhttp.codec import (RequestParser, ResponseParser, BadRequest,
+                           BadResponse, RequestURITooLong,
+                           HeaderFieldsTooLarge, REQUEST, RESPONSE, DATA, END,
+                           Headers, renderResponseHead, renderRequestHead,
+                           encodeChunk, parseHeaders, parseQuery,
+                           parseCookies)
+
+
+def parseEvents(parser, data=""):
+    """
+    Feed C{data} to C{parser} and return all the events it parses.
+    """
+    parser.feed(data)
+    events = []
+    while True:
+        event = parser.nextEvent()
+        if event is None:
+            return events
+        events.append(event)
+
+
+class Tests01_RequestParser(TestCase):
+    """
+    Tests for L{RequestParser}.
+    """
+
+    def events(self, parser, data=""):
+        return parseEvents(parser, data)
+
+    def parse(self, data):
+        """
+        Feed C{data} to a new L{RequestParser} and return all the request
+        heads it parses.
+        """
+        return [value for kind, value in self.events(RequestParser(), data)
+                if kind is REQUEST]
+
+    def test_01_requestLine(self):
+        """
+        L{RequestParser.nextEvent} returns the method, path, version and
+        headers of a complete request, followed by the end of the request.
+        """
+        self.assertEqual(self.events(RequestParser(),
+                                     "GET /foo HTTP/1.0\r\n\r\n"),
+                         [(REQUEST, ("GET", "/foo", "HTTP/1.0", {})),
+                          (END, None)])
+
+    def test_02_headers(self):
+        """
+        Header names and values are stripped of surrounding whitespace, and
+        values may contain colons.
+        """
+        self.assertEqual(
+            self.parse("GET / HTTP/1.1\r\n"
+                       "Host: example.com:8080\r\n"
+                       "Referer :  http://example.com/a:b  \r\n"
+                       "Empty:\r\n"
+                       "\r\n"),
+            [("GET", "/", "HTTP/1.1",
+              {"Host": "example.com:8080",
+               "Referer": "http://example.com/a:b",
+               "Empty": ""})])
+
+    def test_03_incremental(self):
+        """
+        Requests can arrive in arbitrarily small pieces; nothing is returned
+        until the head is complete.
+        """
+        data = "POST /x HTTP/1.1\r\nKey: value\r\n\r\n"
+        parser = RequestParser()
+        for byte in data[:-1]:
+            self.assertEqual(self.events(parser, byte), [])
+        self.assertEqual(self.events(parser, data[-1]),
+                         [(REQUEST, ("POST", "/x", "HTTP/1.1",
+                                     {"Key": "value"})),
+                          (END, None)])
+        self.assertEqual(parser.pending(), 0)
+
+    def test_04_pipelined(self):
+        """
+        Several requests in the buffer are returned one at a time, and stray
+        CRLFs between them are ignored; a partial request stays buffered.
+        """
+        parser = RequestParser()
+        parser.feed("GET /1 HTTP/1.1\r\n\r\n\r\nGET /2 HTTP/1.1\r\n\r\nGET")
+        self.assertEqual(parser.nextEvent()[1][1], "/1")
+        self.assertEqual(parser.nextEvent(), (END, None))
+        self.assertEqual(parser.nextEvent()[1][1], "/2")
+        self.assertEqual(parser.nextEvent(), (END, None))
+        self.assertIdentical(parser.nextEvent(), None)
+        self.assertEqual(parser.pending(), 3)
+
+    def test_05_badRequests(self):
+        """
+        L{RequestParser.nextEvent} raises L{BadRequest} for malformed
+        request lines, header lines and framing headers.
+        """
+        for data in ["GET /\r\n\r\n",
+                     "GET / HTTP/1.1 WOO\r\n\r\n",
+                     "GET / FTP/1.1\r\n\r\n",
+                     "GET / HTTP/1.1\r\nno colon\r\n\r\n",
+                     "GET / HTTP/1.1\r\n: no name\r\n\r\n",
+                     "GET / HTTP/1.1\r\nContent-Length: -1\r\n\r\n",
+                     "GET / HTTP/1.1\r\nTransfer-Encoding: gzip\r\n\r\n",
+                     "GET / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+                     "zz\r\n"]:
+            self.assertRaises(BadRequest, self.parse, data)
+
+    def test_06_contentLength(self):
+        """
+        A body framed by C{Content-Length} is returned as it arrives, and the
+        following request is parsed separately.
+        """
+        parser = RequestParser()
+        self.assertEqual(
+            self.events(parser, "POST / HTTP/1.1\r\n"
+                                "content-length: 5\r\n\r\nab"),
+            [(REQUEST, ("POST", "/", "HTTP/1.1", {"content-length": "5"})),
+             (DATA, "ab")])
+        self.assertEqual(parser.bodyLength, 5)
+        self.assertEqual(self.events(parser, "cdeGET / HTTP/1.1\r\n\r\n"),
+                         [(DATA, "cde"), (END, None),
+                          (REQUEST, ("GET", "/", "HTTP/1.1", {})),
+                          (END, None)])
+        self.assertEqual(parser.bodyLength, 0)
+
+    def test_07_chunked(self):
+        """
+        A chunked body is returned without its framing, with chunk extensions
+        and trailers ignored.
+        """
+        parser = RequestParser()
+        events = self.events(parser, "POST / HTTP/1.1\r\n"
+                                     "Transfer-Encoding: chunked\r\n\r\n"
+                                     "3;ext=1\r\nabc\r\n"
+                                     "A\r\n0123")
+        self.assertIdentical(parser.bodyLength, None)
+        self.assertEqual(events[1:], [(DATA, "abc"), (DATA, "0123")])
+        self.assertEqual(self.events(parser, "456789\r\n0\r\n"
+                                             "Trailer: x\r\n\r\n"),
+                         [(DATA, "456789"), (END, None)])
+
+    def test_08_connectionHeaders(self):
+        """
+        L{RequestParser} records the C{Connection} and C{Expect} headers of
+        the last request head it parsed.
+        """
+        parser = RequestParser()
+        self.events(parser, "PUT / HTTP/1.1\r\n"
+                            "CONNECTION: Keep-Alive\r\n"
+                            "Expect: 100-Continue\r\n"
+                            "Content-Length: 1\r\n\r\n")
+        self.assertEqual(parser.connection, "keep-alive")
+        self.assertTrue(parser.expectContinue)
+
+
+
+class Tests02_ResponseParser(TestCase):
+    """
+    Tests for L{ResponseParser}.
+    """
+
+    def test_09_statusLine(self):
+        """
+        L{ResponseParser.nextEvent} returns the version, code, reason and
+        headers of a response, followed by its body.
+        """
+        parser = ResponseParser()
+        parser.expectResponse("GET")
+        self.assertEqual(parseEvents(parser, "HTTP/1.1 404 Not Found\r\n"
+                                             "Content-Length: 3\r\n\r\n"
+                                             "abc"),
+                         [(RESPONSE, ("HTTP/1.1", 404, "Not Found",
+                                      {"Content-Length": "3"})),
+                          (DATA, "abc"), (END, None)])
+
+    def test_10_noBody(self):
+        """
+        Responses to HEAD requests, and 204 and 304 responses, have no body;
+        interim responses don't answer a request of their own.
+        """
+        parser = ResponseParser()
+        for method in ("HEAD", "GET", "GET"):
+            parser.expectResponse(method)
+        events = parseEvents(parser, "HTTP/1.1 100 Continue\r\n\r\n"
+                                     "HTTP/1.1 200 OK\r\n"
+                                     "Content-Length: 3\r\n\r\n"
+                                     "HTTP/1.1 204 No Content\r\n\r\n"
+                                     "HTTP/1.1 304 Not Modified\r\n\r\n")
+        codes = [(kind, value and value[1]) for kind, value in events]
+        self.assertEqual(codes,
+                         [(RESPONSE, 100), (END, None),
+                          (RESPONSE, 200), (END, None),
+                          (RESPONSE, 204), (END, None),
+                          (RESPONSE, 304), (END, None)])
+
+    def test_11_untilClose(self):
+        """
+        A response without C{Content-Length} or chunked
+        C{Transfer-Encoding} has a body extending to the end of the
+        connection.
+        """
+        parser = ResponseParser()
+        parser.expectResponse("GET")
+        events = parseEvents(parser, "HTTP/1.0 200 OK\r\n\r\nabc")
+        self.assertTrue(parser.untilClose)
+        self.assertEqual(events[1:], [(DATA, "abc")])
+        parser.feed("def")
+        self.assertTrue(parser.connectionLost())
+        self.assertEqual(parseEvents(parser), [(DATA, "def"), (END, None)])
+
+    def test_12_badResponse(self):
+        """
+        Malformed responses, and responses no request was sent for, raise
+        L{BadResponse}.
+        """
+        parser = ResponseParser()
+        self.assertRaises(BadResponse, parseEvents, parser,
+                          "HTTP/1.1 200 OK\r\n\r\n")
+        parser = ResponseParser()
+        parser.expectResponse("GET")
+        self.assertRaises(BadResponse, parseEvents, parser,
+                          "HTTP/1.1 OK\r\n\r\n")
+
+
+class Tests03_Headers(TestCase):
+    """
+    Tests for L{Headers}, and the headers the parsers produce.
+    """
+
+    def test_13_caseInsensitive(self):
+        """
+        Headers can be looked up, replaced and deleted by name in any case,
+        and keep the case they were set with.
+        """
+        headers = Headers({"Content-Type": "text/plain"})
+        self.assertEqual(headers["content-type"], "text/plain")
+        self.assertEqual(headers.get("CONTENT-TYPE"), "text/plain")
+        self.assertTrue("Content-type" in headers)
+        headers["content-TYPE"] = "text/html"
+        self.assertEqual(headers, {"content-TYPE": "text/html"})
+        del headers["Content-Type"]
+        self.assertEqual(headers, {})
+        self.assertEqual(headers.get("content-type"), None)
+
+    def test_14_multipleValues(self):
+        """
+        A header with several values maps to the values joined with commas,
+        and L{Headers.getAll} and L{Headers.fields} give the separate values.
+        """
+        headers = Headers([("Set-Cookie", "a=1"), ("Host", "x"),
+                           ("set-cookie", "b=2")])
+        self.assertEqual(headers["Set-Cookie"], "a=1, b=2")
+        self.assertEqual(headers.getAll("SET-COOKIE"), ["a=1", "b=2"])
+        self.assertEqual(headers.getAll("Missing"), [])
+        self.assertEqual(sorted(headers.fields()),
+                         [("Host", "x"), ("Set-Cookie", "a=1"),
+                          ("Set-Cookie", "b=2")])
+        headers["Set-Cookie"] = "c=3"
+        self.assertEqual(headers.getAll("set-cookie"), ["c=3"])
+
+    def test_15_parsedHeaders(self):
+        """
+        The parsers produce L{Headers}, merging repeated headers whatever the
+        case of their names.
+        """
+        parser = RequestParser()
+        [(kind, request), end] = parseEvents(
+            parser, "GET / HTTP/1.1\r\n"
+                    "Accept: text/html\r\n"
+                    "X-Tag: a\r\n"
+                    "x-tag: b\r\n"
+                    "\r\n")
+        headers = request[3]
+        self.assertIsInstance(headers, Headers)
+        self.assertEqual(headers["accept"], "text/html")
+        self.assertEqual(headers["X-TAG"], "a, b")
+        self.assertEqual(headers.getAll("x-tag"), ["a", "b"])
+        self.assertEqual(len(headers), 2)
+
+    def test_16_conflictingLengths(self):
+        """
+        Repeated C{Content-Length} headers must agree.
+        """
+        self.assertRaises(BadRequest, parseEvents, RequestParser(),
+                          "POST / HTTP/1.1\r\n"
+                          "Content-Length: 3\r\n"
+                          "content-length: 4\r\n"
+                          "\r\n")
+
+    def test_17_render(self):
+        """
+        Message heads render each value of each header on its own line, and
+        chunks are framed with their length.
+        """
+        headers = Headers([("Set-Cookie", "a=1"), ("Set-Cookie", "b=2")])
+        self.assertEqual(renderResponseHead(200, headers, 3,
+                                            connection="close"),
+                         "HTTP/1.1 200 OK\r\n"
+                         "Content-Length: 3\r\n"
+                         "Set-Cookie: a=1\r\n"
+                         "Set-Cookie: b=2\r\n"
+                         "Connection: close\r\n"
+                         "\r\n")
+        self.assertEqual(renderRequestHead("PUT", "/x", "example.com",
+                                           {"content-length": "9"}, 2),
+                         "PUT /x HTTP/1.1\r\n"
+                         "Host: example.com\r\n"
+                         "Content-Length: 2\r\n"
+                         "\r\n")
+        self.assertEqual("".join(encodeChunk("a" * 26)),
+                         "1a\r\n" + "a" * 26 + "\r\n")
+
+
+class Tests04_Limits(TestCase):
+    """
+    Tests for the size limits of L{RequestParser}.
+    """
+
+    def parser(self):
+        parser = RequestParser()
+        parser.maxRequestLineSize = 20
+        parser.maxHeadSize = 100
+        parser.maxHeaderCount = 3
+        return parser
+
+    def test_18_requestLine(self):
+        """
+        A request line longer than C{maxRequestLineSize} raises
+        L{RequestURITooLong} as soon as that many bytes have been buffered.
+        """
+        parser = self.parser()
+        self.assertEqual(parseEvents(parser, "GET /" + "x" * 15), [])
+        self.assertRaises(RequestURITooLong, parseEvents, parser, "x")
+        self.assertRaises(RequestURITooLong, parseEvents, self.parser(),
+                          "GET /" + "x" * 20 + " HTTP/1.1\r\n\r\n")
+        self.assertEqual(len(parseEvents(self.parser(),
+                                         "GET /x HTTP/1.1\r\n\r\n")), 2)
+
+    def test_19_head(self):
+        """
+        A head larger than C{maxHeadSize}, or with more than
+        C{maxHeaderCount} headers, raises L{HeaderFieldsTooLarge}, without
+        waiting for the end of the head.
+        """
+        request = "GET / HTTP/1.1\r\n"
+        self.assertRaises(HeaderFieldsTooLarge, parseEvents, self.parser(),
+                          request + "X: " + "x" * 100)
+        self.assertRaises(HeaderFieldsTooLarge, parseEvents, self.parser(),
+                          request + "X: y\r\n" * 4 + "\r\n")
+        self.assertEqual(len(parseEvents(self.parser(),
+                                         request + "X: y\r\n" * 3 +
+                                         "\r\n")), 2)
+
+
+class Tests05_LazyHeaders(TestCase):
+    """
+    Tests for L{RequestParser.lazyHeaders} and the parsing of headers, query
+    strings and cookies on demand.
+    """
+
+    def parser(self):
+        parser = RequestParser()
+        parser.lazyHeaders = True
+        return parser
+
+    def test_20_lazyHeaders(self):
+        """
+        With C{lazyHeaders}, request heads carry their header lines
+        unparsed, which L{parseHeaders} parses like the parser would have;
+        the headers framing the body are still parsed and checked.
+        """
+        lines = ("Host: example.com\r\n"
+                 "Referer :  http://example.com/a:b  \r\n"
+                 "Accept: a\r\n"
+                 "accept: b\r\n"
+                 "CONNECTION: Keep-Alive\r\n"
+                 "content-length: 3\r\n")
+        request = "PUT / HTTP/1.1\r\n" + lines + "\r\nabc"
+        parser = self.parser()
+        events = parseEvents(parser, request)
+        self.assertEqual(events, [(REQUEST, ("PUT", "/", "HTTP/1.1", lines)),
+                                  (DATA, "abc"), (END, None)])
+        self.assertEqual(parser.connection, "keep-alive")
+        eager = parseEvents(RequestParser(), request)[0][1][3]
+        self.assertEqual(parseHeaders(lines), eager)
+        self.assertEqual(sorted(parseHeaders(lines).getAll("ACCEPT")),
+                         ["a", "b"])
+        for data in ["GET / HTTP/1.1\r\nno colon\r\n\r\n",
+                     "GET / HTTP/1.1\r\n: no name\r\n\r\n",
+                     "GET / HTTP/1.1\r\nContent-Length: 1\r\n"
+                     "Content-Length: 2\r\n\r\n",
+                     "GET / HTTP/1.1\r\nTransfer-Encoding: gzip\r\n\r\n"]:
+            self.assertRaises(BadRequest, parseEvents, self.parser(), data)
+
+    def test_21_queryAndCookies(self):
+        """
+        L{parseQuery} parses the query string of a path, and L{parseCookies}
+        the value of a C{Cookie} header.
+        """
+        self.assertEqual(parseQuery("/a?x=1&y=2&x=3"),
+                         {"x": ["1", "3"], "y": ["2"]})
+        self.assertEqual(parseQuery("/a"), {})
+        self.assertEqual(parseCookies('a=1; b="x y";c=; a=2; junk'),
+                         {"a": "1", "b": "x y", "c": ""})
+        self.assertEqual(parseCookies(None), {})
+
+
+class Tests06_ChunkedLimits(TestCase):
+    """
+    Tests for the limits on the lines of chunked request bodies.
+    """
+
+    head = "POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+
+    def parser(self):
+        parser = RequestParser()
+        parser.maxChunkLineSize = 10
+        parser.maxHeadSize = 100
+        parser.maxHeaderCount = 3
+        return parser
+
+    def test_22_chunkSizeLine(self):
+        """
+        A chunk-size line longer than C{maxChunkLineSize} raises
+        L{BadRequest} as soon as that many bytes have been buffered.
+        """
+        parser = self.parser()
+        # The next byte may still be the CR of the CRLF:
+        self.assertEqual(len(parseEvents(parser, self.head + "1" * 11)), 1)
+        self.assertRaises(BadRequest, parseEvents, parser, "1")
+        self.assertRaises(BadRequest, parseEvents, self.parser(),
+                          self.head + "1;x=" + "y" * 10 + "\r\n")
+        # Missing CRLFs after chunk data are found without waiting for one:
+        self.assertRaises(BadRequest, parseEvents, self.parser(),
+                          self.head + "1\r\nxyz")
+        events = parseEvents(self.parser(),
+                             self.head + "1;x=yyyyy\r\nx\r\n0\r\n\r\n")
+        self.assertEqual(events[1:], [(DATA, "x"), (END, None)])
+
+    def test_23_trailers(self):
+        """
+        Trailers larger than C{maxHeadSize} in total, or more than
+        C{maxHeaderCount} of them, raise L{HeaderFieldsTooLarge}, without
+        waiting for their end.
+        """
+        body = self.head + "0\r\n"
+        self.assertRaises(HeaderFieldsTooLarge, parseEvents, self.parser(),
+                          body + "X: " + "x" * 100)
+        self.assertRaises(HeaderFieldsTooLarge, parseEvents, self.parser(),
+                          body + ("X: " + "x" * 40 + "\r\n") * 3)
+        self.assertRaises(HeaderFieldsTooLarge, parseEvents, self.parser(),
+                          body + "X: y\r\n" * 4)
+        events = parseEvents(self.parser(), body + "X: y\r\n" * 3 + "\r\n")
+        self.assertEqual(events[1:], [(END, None)])
@@ -0,0 +1,273 @@
+"""
+Tests for toyhttp.compress.
+"""
+
+import gzip
+import random
+import StringIO
+import zlib
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import task
+from twisted.internet.error import ConnectionDone
+from twisted.python.failure import Failure
+
+from toyhttp import offload
+from toyhttp.compress import Compressor, negotiate, GZIP, DEFLATE
+from toyhttp.server import HTTP, Response, StreamingResponse
+from toyhttp.tests.test_offload import FakeReactor, FakeThreadPool
+from toyhttp.tests.test_server import AbortableTransport
+
+
+TEXT = "All work and no play makes Jack a dull boy. " * 100
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=StringIO.StringIO(data)).read()
+
+
+class ClosingFile(StringIO.StringIO):
+    """
+    A file recording whether it was closed.
+    """
+
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def text(body=TEXT, **extra):
+    headers = {"Content-Type": "text/plain; charset=utf-8"}
+    headers.update(extra)
+    return Response(200, body, headers)
+
+
+class Tests01_Compressor(TestCase):
+    """
+    Tests for L{Compressor}.
+    """
+
+    def test_01_negotiate(self):
+        """
+        L{negotiate} prefers gzip to deflate, and honours zero qualities and
+        wildcards.
+        """
+        self.assertEqual(negotiate("gzip, deflate"), GZIP)
+        self.assertEqual(negotiate("deflate"), DEFLATE)
+        self.assertEqual(negotiate("gzip;q=0, deflate;q=0.5"), DEFLATE)
+        self.assertEqual(negotiate("gzip;q=0.2, deflate;q=0.5"), DEFLATE)
+        self.assertEqual(negotiate("*"), GZIP)
+        self.assertEqual(negotiate("br, identity"), None)
+        self.assertEqual(negotiate(""), None)
+        self.assertEqual(negotiate(None), None)
+
+    def test_02_compress(self):
+        """
+        Bodies are compressed with the negotiated coding, and the response
+        headers say so; validators are weakened.
+        """
+        compressor = Compressor()
+        response = compressor.compress(text(ETag='"x"'), "gzip")
+        self.assertEqual(gunzip(response.body), TEXT)
+        headers = response.headers
+        self.assertEqual((headers["Content-Encoding"], headers["Vary"],
+                          headers["ETag"]), ("gzip", "Accept-Encoding",
+                                             'W/"x"'))
+        response = compressor.compress(text(), "deflate")
+        self.assertEqual(zlib.decompress(response.body), TEXT)
+        self.assertEqual(compressor.compressed, 2)
+
+    def test_03_notCompressed(self):
+        """
+        Small bodies, bodies of other types, bodies already encoded or
+        ranges aren't compressed; neither are responses for clients that
+        don't accept it, though eligible ones say they vary on it.
+        """
+        compressor = Compressor(minSize=100)
+        for response in [text("short"),
+                         Response(200, TEXT, {"Content-Type": "image/png"}),
+                         Response(200, TEXT, {}),
+                         text(**{"Content-Encoding": "br"}),
+                         text(**{"Content-Range": "bytes 0-9/10"}),
+                         text(**{"Cache-Control": "no-transform"}),
+                         Response(304, "", {})]:
+            self.assertIdentical(compressor.compress(response, "gzip"),
+                                 response)
+        response = compressor.compress(text(), "identity")
+        self.assertEqual(response.body, TEXT)
+        self.assertEqual(response.headers, {
+            "Content-Type": "text/plain; charset=utf-8",
+            "Vary": "Accept-Encoding"})
+        rng = random.Random(0)
+        incompressible = "".join(chr(rng.randrange(256))
+                                 for i in range(1000))
+        response = compressor.compress(text(incompressible), "gzip")
+        self.assertEqual(response.body, incompressible)
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_04_cache(self):
+        """
+        Compressed bodies are cached, so the same body is only compressed
+        once per coding.
+        """
+        compressor = Compressor()
+        first = compressor.compress(text(), "gzip")
+        second = compressor.compress(text(), "gzip")
+        self.assertIdentical(first.body, second.body)
+        self.assertEqual(compressor.cacheHits, 1)
+        compressor.compress(text(), "deflate")
+        self.assertEqual(compressor.cacheHits, 1)
+
+    def test_05_stream(self):
+        """
+        Streamed bodies are compressed a piece at a time, and closed once
+        written.
+        """
+        compressor = Compressor()
+        body = ClosingFile(TEXT)
+        response = compressor.compress(
+            StreamingResponse(200, body, {"Content-Type": "text/html"},
+                              len(TEXT)), "gzip")
+        self.assertIsInstance(response, StreamingResponse)
+        self.assertIdentical(response.length, None)
+        pieces = list(response.body)
+        self.assertEqual(gunzip("".join(pieces)), TEXT)
+        response.body.close()
+        self.assertTrue(body.closed)
+
+    def test_06_offload(self):
+        """
+        Large bodies are compressed in the handler pool; if it is saturated
+        they are sent uncompressed.
+        """
+        threadPool = FakeThreadPool()
+        pool = offload.HandlerPool(maxQueued=1, reactor=FakeReactor(),
+                                   threadPool=threadPool)
+        compressor = Compressor(offloadSize=100)
+        d = compressor.compress(text(), "gzip", pool)
+        response = compressor.compress(text(TEXT * 2), "gzip", pool)
+        self.assertEqual(response.body, TEXT * 2)
+        self.assertNotIn("Content-Encoding", response.headers)
+        threadPool.runNext()
+        self.assertEqual(gunzip(self.successResultOf(d).body), TEXT)
+
+
+class Tests02_Server(TestCase):
+    """
+    Tests for compressing responses in L{HTTP}.
+    """
+
+    def test_07_server(self):
+        """
+        L{HTTP} compresses responses according to each request's
+        C{Accept-Encoding}.
+        """
+        protocol = HTTP(lambda method, path, headers, body: text(),
+                        reactor=task.Clock())
+        protocol.compressor = Compressor()
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived("GET / HTTP/1.1\r\n"
+                              "Accept-Encoding: gzip\r\n"
+                              "\r\n")
+        head, body = transport.value().split("\r\n\r\n", 1)
+        head = head.split("\r\n")
+        self.assertIn("Content-Encoding: gzip", head)
+        self.assertIn("Content-Length: %d" % (len(body),), head)
+        self.assertEqual(gunzip(body), TEXT)
+        transport.clear()
+        protocol.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        head, body = transport.value().split("\r\n\r\n", 1)
+        self.assertNotIn("Content-Encoding", head)
+        self.assertEqual(body, TEXT)
+
+    def offloading(self, compressor, handled):
+        """
+        Connect a L{HTTP} whose handler records the paths of its requests in
+        C{handled}, compressing with C{compressor} in a handler pool.
+
+        @return: The protocol, its transport and the pool's thread pool.
+        """
+        def handler(method, path, headers, body):
+            handled.append(path)
+            return text()
+
+        threadPool = FakeThreadPool()
+        protocol = HTTP(handler, reactor=task.Clock())
+        protocol.compressor = compressor
+        protocol.handlerPool = offload.HandlerPool(reactor=FakeReactor(),
+                                                   threadPool=threadPool)
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        return protocol, transport, threadPool
+
+    def test_08_disconnectWhileCompressing(self):
+        """
+        If the connection is lost while a response is compressed in the
+        handler pool, the compression is cancelled, and neither that
+        response nor those to pipelined requests are written.
+        """
+        handled = []
+        protocol, transport, threadPool = self.offloading(
+            Compressor(offloadSize=100), handled)
+        protocol.dataReceived("GET /a HTTP/1.1\r\nAccept-Encoding: gzip\r\n"
+                              "\r\n"
+                              "GET /b HTTP/1.1\r\n\r\n")
+        self.assertEqual(len(threadPool.calls), 1)
+        protocol.connectionLost(Failure(ConnectionDone()))
+        while threadPool.calls:
+            threadPool.runNext()
+        self.assertEqual(transport.value(), "")
+        self.assertEqual(handled, ["/a"])
+
+    def test_09_compressionFails(self):
+        """
+        If compressing a response in the handler pool fails, a 500 response
+        is sent instead.
+        """
+        class BrokenCompressor(Compressor):
+            def _compressed(self, *args):
+                raise RuntimeError("broken")
+
+        handled = []
+        protocol, transport, threadPool = self.offloading(
+            BrokenCompressor(offloadSize=100), handled)
+        protocol.dataReceived("GET /a HTTP/1.1\r\nAccept-Encoding: gzip\r\n"
+                              "\r\n")
+        threadPool.runNext()
+        self.assertTrue(transport.value().startswith(
+            "HTTP/1.1 500 Internal Server Error\r\n"))
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+
+    def test_10_head(self):
+        """
+        Responses to C{HEAD} requests, and empty bodies, aren't compressed,
+        though they say they vary on C{Accept-Encoding}.
+        """
+        compressor = Compressor()
+        empty = compressor.compress(
+            StreamingResponse(200, (), {"Content-Type": "text/html"},
+                              len(TEXT)), "gzip")
+        self.assertEqual((empty.body, empty.length), ((), len(TEXT)))
+        self.assertEqual(empty.headers, {"Content-Type": "text/html",
+                                         "Vary": "Accept-Encoding"})
+
+        protocol = HTTP(lambda method, path, headers, body: text(),
+                        reactor=task.Clock())
+        protocol.compressor = compressor
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived("HEAD / HTTP/1.1\r\nAccept-Encoding: gzip\r\n"
+                              "\r\n"
+                              "GET / HTTP/1.1\r\nAccept-Encoding: gzip\r\n"
+                              "\r\n")
+        head, response = transport.value().split("\r\n\r\n", 1)
+        head = head.split("\r\n")
+        self.assertIn("Content-Length: %d" % (len(TEXT),), head)
+        self.assertIn("Vary: Accept-Encoding", head)
+        self.assertNotIn("Content-Encoding: gzip", head)
+        head, body = response.split("\r\n\r\n", 1)
+        self.assertIn("Content-Encoding: gzip", head.split("\r\n"))
+        self.assertEqual(gunzip(body), TEXT)
+        self.assertEqual(compressor.compressed, 1)
@@ -0,0 +1,196 @@
+"""
+Tests for toyhttp.metrics.
+"""
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import defer, task
+from twisted.python.failure import Failure
+from twisted.internet.error import ConnectionDone
+
+from toyhttp import offload
+from toyhttp.metrics import PHASES, Histogram, Metrics
+from toyhttp.router import Router
+from toyhttp.server import HTTPFactory, Response
+from toyhttp.tests.test_offload import FakeReactor, FakeThreadPool
+from toyhttp.tests.test_server import AbortableTransport
+
+
+class Tests01_Metrics(TestCase):
+    """
+    Tests for L{Metrics} and L{Histogram}.
+    """
+
+    def test_01_histogram(self):
+        """
+        Values are counted in the first bucket whose bound they don't
+        exceed, and rendered cumulatively.
+        """
+        histogram = Histogram((0.1, 1.0))
+        for value in [0.05, 0.1, 0.5, 3.0]:
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        lines = []
+        histogram.render("x", 'phase="a"', lines)
+        self.assertEqual(lines, ['x_bucket{phase="a",le="0.1"} 2',
+                                 'x_bucket{phase="a",le="1.0"} 3',
+                                 'x_bucket{phase="a",le="+Inf"} 4',
+                                 'x_sum{phase="a"} 3.65',
+                                 'x_count{phase="a"} 4'])
+
+    def test_02_routes(self):
+        """
+        Routes are labelled with C{routeLabel}, up to C{maxRoutes} of them.
+        """
+        metrics = Metrics(routeLabel=lambda method, path: path,
+                          maxRoutes=2)
+        for path in ["/a", "/b", "/c", "/a"]:
+            metrics.recorders("GET", path)[0](0.001)
+        metrics.flush()
+        self.assertEqual(
+            dict((route, histograms[0].count)
+                 for route, histograms in metrics._routes.iteritems()),
+            {"/a": 2, "/b": 1, "other": 1})
+        metrics = Metrics()
+        metrics.recorders("GET", "/a")
+        self.assertEqual(metrics._routes.keys(), ["*"])
+
+    def test_03_render(self):
+        """
+        L{Metrics.render} renders counters in the Prometheus text format,
+        escaping label values, and describes the handler pool's queue.
+        """
+        metrics = Metrics(routeLabel=lambda method, path: path)
+        metrics.responseWritten(200, 10)
+        metrics.responseWritten(404, 5)
+        metrics.timedOut("header")
+        metrics.recorders("GET", 'a"b')[0](0.001)
+        pool = offload.HandlerPool(reactor=FakeReactor(),
+                                   threadPool=FakeThreadPool())
+        lines = metrics.render(pool).splitlines()
+        for line in ["# TYPE toyhttp_responses_total counter",
+                     'toyhttp_responses_total{code="200"} 1',
+                     'toyhttp_responses_total{code="404"} 1',
+                     "toyhttp_sent_bytes_total 15",
+                     'toyhttp_timeouts_total{kind="header"} 1',
+                     'toyhttp_request_phase_seconds_count'
+                     '{route="a\\"b",phase="parse"} 1',
+                     "toyhttp_handler_pool_queued 0"]:
+            self.assertIn(line, lines)
+
+
+class Tests02_Server(TestCase):
+    """
+    Tests for recording metrics in L{toyhttp.server.HTTP}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.router = Router()
+        self.pending = []
+
+        @self.router.route("GET", "/slow/{n}")
+        def slow(method, path, headers, body, n):
+            self.pending.append(defer.Deferred())
+            return self.pending[-1]
+
+        self.metrics = Metrics(routeLabel=self.router.label, sampleEvery=1,
+                               clock=self.clock.seconds)
+        self.factory = HTTPFactory(self.router, metrics=self.metrics)
+
+    def connect(self):
+        protocol = self.factory.buildProtocol(None)
+        protocol.reactor = self.clock
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        return protocol, transport
+
+    def test_04_request(self):
+        """
+        Connections, bytes and responses are counted, and the duration of
+        each phase of a request is recorded for its route.
+        """
+        protocol, transport = self.connect()
+        self.assertEqual(self.metrics.connectionsActive, 1)
+        request = "GET /slow/1 HTTP/1.1\r\n"
+        protocol.dataReceived(request)
+        self.clock.advance(0.002)
+        protocol.dataReceived("\r\n")
+        self.clock.advance(0.2)
+        self.pending[0].callback(Response(200, "done", {}))
+        self.assertEqual(self.metrics.responses, {200: 1})
+        self.assertEqual(self.metrics.bytesReceived, len(request) + 2)
+        self.assertEqual(self.metrics.bytesSent, len(transport.value()))
+        self.metrics.flush()
+        latencies = self.metrics._latencies
+        self.assertEqual(latencies["/slow/{n}", "parse"].sum, 0.002)
+        self.assertEqual(latencies["/slow/{n}", "handler"].sum, 0.2)
+        self.assertEqual(latencies["/slow/{n}", "write"].count, 1)
+
+        protocol.dataReceived("GET /nowhere HTTP/1.1\r\n\r\n")
+        self.assertEqual(self.metrics.responses, {200: 1, 404: 1})
+        self.metrics.flush()
+        self.assertEqual(latencies["none", "handler"].count, 1)
+        protocol.connectionLost(Failure(ConnectionDone()))
+        self.assertEqual((self.metrics.connectionsActive,
+                          self.metrics.connectionsTotal), (0, 1))
+
+    def test_05_timeouts(self):
+        """
+        Connections aborted by timeouts are counted by kind.
+        """
+        protocol, transport = self.connect()
+        self.clock.advance(protocol.headerTimeout + 1)
+        self.assertTrue(transport.aborting)
+        self.assertEqual(self.metrics.timeouts, {"header": 1})
+
+    def test_06_endpoint(self):
+        """
+        Requests for C{Metrics.path} are answered with the metrics.
+        """
+        protocol, transport = self.connect()
+        protocol.dataReceived("GET /metrics HTTP/1.1\r\n\r\n")
+        head, body = transport.value().split("\r\n\r\n", 1)
+        self.assertIn("Content-Type: text/plain; version=0.0.4; "
+                      "charset=utf-8", head.split("\r\n"))
+        self.assertIn("toyhttp_connections_active 1", body.splitlines())
+        self.assertEqual(self.pending, [])
+
+    def test_07_pending(self):
+        """
+        Durations recorded with L{Metrics.recorders} are counted in the
+        histograms every C{maxPending} requests, or when rendering.
+        """
+        metrics = Metrics(routeLabel=lambda method, path: None)
+        metrics.maxPending = 3
+        for i in range(2):
+            parse, handler, write = metrics.recorders("GET", "/a")
+            parse(0.001)
+        histogram = metrics._latencies["none", "parse"]
+        self.assertEqual(histogram.count, 0)
+        # The third request flushes the first two as it starts:
+        metrics.recorders("GET", "/a")[0](0.001)
+        self.assertEqual((histogram.count, histogram.pending), (2, [0.001]))
+        self.assertIn('toyhttp_request_phase_seconds_count'
+                      '{route="none",phase="parse"} 3',
+                      metrics.render().splitlines())
+
+    def test_08_sampling(self):
+        """
+        The phases of one request in every C{sampleEvery} are timed,
+        starting with the first, while every request is counted; with
+        C{sampleEvery} set to C{None}, none are timed.
+        """
+        for sampleEvery, timed in [(3, 3), (None, 0)]:
+            metrics = Metrics(sampleEvery=sampleEvery,
+                              clock=self.clock.seconds)
+            self.factory.metrics = metrics
+            protocol, transport = self.connect()
+            protocol.dataReceived("GET /nowhere HTTP/1.1\r\n\r\n" * 4)
+            for i in range(3):
+                protocol.dataReceived("GET /nowhere HTTP/1.1\r\n\r\n")
+            self.assertEqual(metrics.responses, {404: 7})
+            metrics.flush()
+            self.assertEqual(
+                sum(histogram.count
+                    for histogram in metrics._latencies.itervalues()),
+                timed * len(PHASES))
@@ -0,0 +1,217 @@
+"""
+Tests for toyhttp.offload.
+"""
+
+import threading
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import defer, task
+from twisted.python.failure import Failure
+
+from toyhttp import offload
+from toyhttp.server import HTTP, Response
+from toyhttp.tests.test_server import AbortableTransport
+
+
+class FakeThreadPool(object):
+    """
+    A thread pool that runs calls when told to, in the calling thread.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.calls = []
+
+    def start(self):
+        self.started = True
+
+    def stop(self):
+        self.started = False
+
+    def callInThreadWithCallback(self, onResult, f, *args, **kwargs):
+        self.calls.append((onResult, f, args, kwargs))
+
+    def runNext(self):
+        onResult, f, args, kwargs = self.calls.pop(0)
+        try:
+            result = f(*args, **kwargs)
+        except:
+            onResult(False, Failure())
+        else:
+            onResult(True, result)
+
+
+class FakeReactor(task.Clock):
+    """
+    A L{task.Clock} that also supports the reactor methods used by
+    L{offload.HandlerPool}.
+    """
+
+    def __init__(self):
+        task.Clock.__init__(self)
+        self.triggers = []
+
+    def callFromThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+    def addSystemEventTrigger(self, phase, event, f, *args, **kwargs):
+        self.triggers.append((phase, event, f))
+
+
+class Tests01_HandlerPool(TestCase):
+    """
+    Tests for L{offload.HandlerPool} and the handler markers.
+    """
+
+    def test_01_runsInPool(self):
+        """
+        Unmarked handlers run in the pool only in L{offload.THREADS} mode;
+        marked handlers run where their marker says.
+        """
+        def plain():
+            pass
+        blocking = offload.blocking(lambda: None)
+        nonblocking = offload.nonblocking(lambda: None)
+        self.assertFalse(offload.runsInPool(plain, offload.REACTOR))
+        self.assertTrue(offload.runsInPool(plain, offload.THREADS))
+        self.assertTrue(offload.runsInPool(blocking, offload.REACTOR))
+        self.assertFalse(offload.runsInPool(nonblocking, offload.THREADS))
+
+    def test_02_submit(self):
+        """
+        L{offload.HandlerPool.submit} starts the thread pool on first use,
+        runs the call in it and records how long the call waited.
+        """
+        now = [10.0]
+        threadPool = FakeThreadPool()
+        reactor = FakeReactor()
+        pool = offload.HandlerPool(reactor=reactor, threadPool=threadPool,
+                                   clock=lambda: now[0])
+        self.assertFalse(threadPool.started)
+        d = pool.submit(lambda x: x * 2, 21)
+        self.assertTrue(threadPool.started)
+        self.assertEqual(pool.queued, 1)
+        now[0] = 10.5
+        threadPool.runNext()
+        self.assertEqual(self.successResultOf(d), 42)
+        self.assertEqual(pool.queued, 0)
+        self.assertEqual((pool.waits.count, pool.waits.maximum), (1, 0.5))
+        self.assertEqual(pool.waits.mean(), 0.5)
+        self.assertEqual([t[:2] for t in reactor.triggers],
+                         [("during", "shutdown")])
+
+    def test_03_saturated(self):
+        """
+        Once C{maxQueued} calls are waiting, further calls are rejected with
+        L{offload.PoolSaturated}.
+        """
+        threadPool = FakeThreadPool()
+        pool = offload.HandlerPool(maxQueued=1, reactor=FakeReactor(),
+                                   threadPool=threadPool)
+        pool.submit(lambda: None)
+        self.assertRaises(offload.PoolSaturated, pool.submit, lambda: None)
+        self.assertEqual(pool.waits.rejected, 1)
+        threadPool.runNext()
+        pool.submit(lambda: None)
+        self.assertEqual(pool.queued, 1)
+
+    def test_04_realThreads(self):
+        """
+        By default L{offload.HandlerPool} runs calls in threads other than
+        the reactor thread.
+        """
+        pool = offload.HandlerPool(maxThreads=2)
+        self.addCleanup(pool.stop)
+        d = pool.submit(threading.current_thread)
+        d.addCallback(self.assertNotIdentical, threading.current_thread())
+        return d
+
+    def test_05_cancelQueued(self):
+        """
+        Cancelling the Deferred of a call still waiting for a thread means
+        the call is never made.
+        """
+        threadPool = FakeThreadPool()
+        pool = offload.HandlerPool(reactor=FakeReactor(),
+                                   threadPool=threadPool)
+        calls = []
+        d = pool.submit(calls.append, 1)
+        d.cancel()
+        self.failureResultOf(d, defer.CancelledError)
+        threadPool.runNext()
+        self.assertEqual((calls, pool.queued), ([], 0))
+
+
+class Tests02_Server(TestCase):
+    """
+    Tests for running handlers in a L{offload.HandlerPool} from L{HTTP}.
+    """
+
+    def connect(self, handler, execution=offload.REACTOR, maxQueued=100):
+        self.threadPool = FakeThreadPool()
+        reactor = FakeReactor()
+        protocol = HTTP(handler, reactor=reactor)
+        protocol.execution = execution
+        protocol.handlerPool = offload.HandlerPool(
+            maxQueued=maxQueued, reactor=reactor, threadPool=self.threadPool)
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        return protocol, transport
+
+    def test_01_blockingHandler(self):
+        """
+        A handler marked as blocking runs in the pool, and its result is
+        written once the call has run.
+        """
+        @offload.blocking
+        def handler(method, path, headers, body):
+            return Response(200, "done", {})
+
+        protocol, transport = self.connect(handler)
+        protocol.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        self.assertEqual(transport.value(), "")
+        self.threadPool.runNext()
+        self.assertTrue(transport.value().endswith("\r\n\r\ndone"))
+
+    def test_02_reactorMode(self):
+        """
+        In L{offload.REACTOR} mode unmarked handlers run in the reactor
+        thread.
+        """
+        protocol, transport = self.connect(
+            lambda *args: Response(200, "done", {}))
+        protocol.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        self.assertEqual(self.threadPool.calls, [])
+        self.assertTrue(transport.value().endswith("\r\n\r\ndone"))
+
+    def test_03_saturated(self):
+        """
+        A request whose handler can't be queued gets a 503 response.
+        """
+        protocol, transport = self.connect(
+            lambda *args: Response(200, "done", {}), offload.THREADS,
+            maxQueued=0)
+        protocol.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        head, body = transport.value().split("\r\n\r\n")
+        head = head.split("\r\n")
+        self.assertEqual(head[0], "HTTP/1.1 503 Service Unavailable")
+        self.assertEqual(sorted(head[1:]),
+                         ["Content-Length: 20", "Content-Type: text/plain",
+                          "Retry-After: 1"])
+        self.assertEqual(body, "Service unavailable.")
+        self.assertFalse(transport.disconnecting)
+
+    def test_04_handlerError(self):
+        """
+        An exception raised by a handler in the pool results in a 500
+        response.
+        """
+        def handler(method, path, headers, body):
+            raise ZeroDivisionError()
+
+        protocol, transport = self.connect(handler, offload.THREADS)
+        protocol.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        self.threadPool.runNext()
+        self.assertTrue(transport.value().startswith(
+            "HTTP/1.1 500 Internal Server Error\r\n"))
+        self.assertEqual(len(self.flushLoggedErrors(ZeroDivisionError)), 1)
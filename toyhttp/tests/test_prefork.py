@@ -0,0 +1,197 @@
+"""
+Tests for toyhttp.prefork.
+"""
+
+import os
+import signal
+import time
+
+from twisted.trial.unittest import TestCase
+from twisted.python import log
+
+from toyhttp import prefork
+
+
+class FakeSupervisor(prefork.Supervisor):
+    """
+    A L{prefork.Supervisor} that records the workers it would start and the
+    signals it would send, rather than forking and killing processes.
+
+    @ivar events: What it did, in order: C{("spawn", pid)}, C{("wait",
+        pid)} and C{("kill", pid)}.
+    """
+
+    minUptime = 0
+
+    def __init__(self, workers):
+        prefork.Supervisor.__init__(self, None, workers)
+        self.nextPid = 100
+        self.signals = []
+        self.events = []
+
+    def spawn(self):
+        pid = self.nextPid
+        self.nextPid += 1
+        self._started[pid] = 0
+        self.events.append(("spawn", pid))
+        return pid
+
+    def waitReady(self, pid):
+        self.events.append(("wait", pid))
+
+    def kill(self, pid, signum):
+        self.signals.append((pid, signum))
+        self.events.append(("kill", pid))
+
+    def running(self):
+        return sorted(self._started)
+
+
+class Tests01_Supervisor(TestCase):
+    """
+    Tests for L{prefork.Supervisor}.
+    """
+
+    def test_01_restartCrashedWorker(self):
+        """
+        A worker that exits without having been asked to is replaced.
+        """
+        supervisor = FakeSupervisor(2)
+        supervisor.spawn()
+        supervisor.spawn()
+        supervisor.reap(100, 256)
+        self.assertEqual(supervisor.running(), [101, 102])
+
+    def test_02_rollingReload(self):
+        """
+        L{prefork.Supervisor.reload} starts a new worker for each running
+        one and asks the old ones to stop; they aren't replaced again when
+        they exit.
+        """
+        supervisor = FakeSupervisor(2)
+        supervisor.spawn()
+        supervisor.spawn()
+        supervisor.reload()
+        self.assertEqual(supervisor.running(), [100, 101, 102, 103])
+        self.assertEqual(supervisor.signals,
+                         [(100, signal.SIGTERM), (101, signal.SIGTERM)])
+        supervisor.reap(100, 0)
+        supervisor.reap(101, 0)
+        self.assertEqual(supervisor.running(), [102, 103])
+
+    def test_03_stop(self):
+        """
+        L{prefork.Supervisor.stop} asks every worker to stop, and no worker is
+        replaced once stopping; stopping again kills the workers.
+        """
+        supervisor = FakeSupervisor(2)
+        supervisor.spawn()
+        supervisor.spawn()
+        supervisor.stop()
+        self.assertEqual(supervisor.signals,
+                         [(100, signal.SIGTERM), (101, signal.SIGTERM)])
+        supervisor.reap(100, 0)
+        supervisor.stop()
+        self.assertEqual(supervisor.signals[2:], [(101, signal.SIGKILL)])
+        supervisor.reap(101, 0)
+        self.assertEqual(supervisor.running(), [])
+
+    def test_04_stopBeforeRestart(self):
+        """
+        A worker that crashed isn't replaced if the supervisor is asked to
+        stop while waiting for C{minUptime} to pass, and workers exiting
+        once stopping aren't logged as being restarted.
+        """
+        messages = []
+        log.addObserver(messages.append)
+        self.addCleanup(log.removeObserver, messages.append)
+        supervisor = FakeSupervisor(2)
+        supervisor.minUptime = 60
+        supervisor.spawn()
+        supervisor.spawn()
+        supervisor._started[100] = time.time()
+        self.patch(prefork.time, "sleep",
+                   lambda seconds: supervisor.stop())
+        supervisor.reap(100, 256)
+        self.assertEqual(supervisor.running(), [101])
+        supervisor.reap(101, 0)
+        self.assertEqual(supervisor.running(), [])
+        self.assertEqual([" ".join(message["message"])
+                          for message in messages],
+                         ["Worker 100 exited with status 1; restarting it"])
+
+
+class Tests02_Listen(TestCase):
+    """
+    Tests for L{prefork.listen}.
+    """
+
+    def test_01_reusePort(self):
+        """
+        Several sockets created with C{reusePort} can listen on one port.
+        """
+        first = prefork.listen(0, "127.0.0.1", reusePort=True)
+        self.addCleanup(first.close)
+        port = first.getsockname()[1]
+        second = prefork.listen(port, "127.0.0.1", reusePort=True)
+        self.addCleanup(second.close)
+        self.assertEqual(second.getsockname(), ("127.0.0.1", port))
+        self.assertEqual(first.gettimeout(), 0.0)
+
+
+class Tests03_Reload(TestCase):
+    """
+    Tests for the order in which L{prefork.Supervisor.reload} replaces
+    workers.
+    """
+
+    def test_01_oneAtATime(self):
+        """
+        Each new worker is waited for before the worker it replaces is asked
+        to stop, and only then is the next one started.
+        """
+        supervisor = FakeSupervisor(2)
+        supervisor.spawn()
+        supervisor.spawn()
+        del supervisor.events[:]
+        supervisor.reload()
+        self.assertEqual(supervisor.events,
+                         [("spawn", 102), ("wait", 102), ("kill", 100),
+                          ("spawn", 103), ("wait", 103), ("kill", 101)])
+
+    def test_02_stopWhileReloading(self):
+        """
+        If the supervisor is stopped while waiting for a new worker, the
+        reload goes no further.
+        """
+        supervisor = FakeSupervisor(2)
+        supervisor.spawn()
+        supervisor.spawn()
+        supervisor.waitReady = lambda pid: supervisor.stop()
+        supervisor.reload()
+        self.assertEqual(supervisor.running(), [100, 101, 102])
+        self.assertEqual(sorted(supervisor.signals),
+                         [(100, signal.SIGTERM), (101, signal.SIGTERM),
+                          (102, signal.SIGTERM)])
+
+    def test_03_readyPipe(self):
+        """
+        L{prefork.Supervisor.waitReady} returns once the worker has called
+        L{prefork.Supervisor.notifyReady}, and after C{readyTimeout} if it
+        doesn't.
+        """
+        supervisor = prefork.Supervisor(None, 1)
+        supervisor.readyTimeout = 0.05
+        readPipe, writePipe = os.pipe()
+        self.addCleanup(os.close, readPipe)
+        supervisor._readyPipes[100] = readPipe
+        start = time.time()
+        supervisor.waitReady(100)
+        self.assertTrue(time.time() - start >= 0.05)
+        supervisor._readyPipe = writePipe
+        supervisor.readyTimeout = 10
+        supervisor.notifyReady()
+        start = time.time()
+        supervisor.waitReady(100)
+        self.assertTrue(time.time() - start < 5)
+        self.assertIdentical(supervisor._readyPipe, None)
@@ -0,0 +1,146 @@
+"""
+Tests for toyhttp.ratelimit.
+"""
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import task
+from twisted.internet.address import IPv4Address
+
+from toyhttp.ratelimit import RateLimiter
+from toyhttp.server import HTTPFactory, Response, takesRequest
+from toyhttp.tests.test_server import AbortableTransport
+
+
+class Tests01_RateLimiter(TestCase):
+    """
+    Tests for L{RateLimiter}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+
+    def test_01_burst(self):
+        """
+        A client may make C{burst} requests at once, and then one every
+        C{1 / rate} seconds; requests beyond that get a 429 response.
+        """
+        limiter = RateLimiter(2, burst=3, reactor=self.clock)
+        for i in range(3):
+            self.assertIdentical(limiter.check("a"), None)
+        response = limiter.check("a")
+        self.assertEqual(response.code, 429)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(limiter.limitedRequests, 1)
+        # Other clients have buckets of their own:
+        self.assertIdentical(limiter.check("b"), None)
+        self.clock.advance(0.5)
+        self.assertIdentical(limiter.check("a"), None)
+        self.assertEqual(limiter.check("a").code, 429)
+        self.clock.advance(1.5)
+        for i in range(3):
+            self.assertIdentical(limiter.check("a"), None)
+        self.assertEqual(limiter.check("a").code, 429)
+
+    def test_02_retryAfter(self):
+        """
+        C{Retry-After} is the number of seconds until the client's next
+        token, rounded up, and the 429 response for each is only rendered
+        once.
+        """
+        limiter = RateLimiter(0.1, reactor=self.clock)
+        self.assertEqual(limiter.burst, 1)
+        self.assertIdentical(limiter.check("a"), None)
+        first = limiter.check("a")
+        self.assertEqual(first.headers["Retry-After"], "10")
+        self.clock.advance(4.5)
+        self.assertEqual(limiter.check("a").headers["Retry-After"], "6")
+        self.clock.advance(4.5)
+        self.assertEqual(limiter.check("a").headers["Retry-After"], "1")
+        self.clock.advance(4.5)
+        self.assertIdentical(limiter.check("a"), None)
+        self.assertIdentical(limiter.check("a"), first)
+
+    def test_03_expire(self):
+        """
+        Buckets are dropped once they are full again, and the least recently
+        seen client's is dropped when there are more than C{maxClients}.
+        """
+        limiter = RateLimiter(1, burst=2, maxClients=2, reactor=self.clock)
+        limiter.check("a")
+        limiter.check("a")
+        limiter.check("b")
+        self.assertEqual(len(limiter), 2)
+        limiter.check("a")
+        limiter.check("c")
+        self.assertEqual(len(limiter), 2)
+        # "b" was dropped, and gets a full bucket:
+        self.assertIdentical(limiter.check("b"), None)
+        self.assertIdentical(limiter.check("b"), None)
+        self.clock.advance(2)
+        limiter.check("d")
+        self.assertEqual(len(limiter), 1)
+
+
+class Tests02_HTTP(TestCase):
+    """
+    Tests for the use of a L{RateLimiter} by L{HTTPFactory}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.calls = []
+
+        def handler(method, path, headers, body):
+            self.calls.append(path)
+            return Response(200, "OK", {})
+
+        self.handler = handler
+
+    def request(self, factory, data, host="10.0.0.1"):
+        protocol = factory.buildProtocol(None)
+        protocol.reactor = self.clock
+        transport = AbortableTransport(
+            peerAddress=IPv4Address("TCP", host, 12345))
+        protocol.makeConnection(transport)
+        protocol.dataReceived(data)
+        return transport.value()
+
+    def test_04_limited(self):
+        """
+        Requests over a client's limit are answered with a 429 response
+        without calling the handler, on a connection that stays open.
+        """
+        limiter = RateLimiter(1, burst=2, reactor=self.clock)
+        factory = HTTPFactory(self.handler, rateLimiter=limiter)
+        data = "GET /a HTTP/1.1\r\n\r\n" * 3 + "GET /b HTTP/1.0\r\n\r\n"
+        output = self.request(factory, data)
+        self.assertEqual(self.calls, ["/a", "/a"])
+        self.assertEqual(output.count("HTTP/1.1 200 OK\r\n"), 2)
+        self.assertEqual(output.count("HTTP/1.1 429 Too Many Requests\r\n"),
+                         2)
+        self.assertIn("Retry-After: 1\r\n", output)
+        self.assertEqual(limiter.limitedRequests, 2)
+        # Another address isn't limited:
+        self.request(factory, "GET /c HTTP/1.1\r\n\r\n", host="10.0.0.2")
+        self.assertEqual(self.calls, ["/a", "/a", "/c"])
+
+    def test_05_header(self):
+        """
+        With C{header}, clients are told apart by the value of that header,
+        or by their address if their requests don't have it, including when
+        the handler takes a L{Request}.
+        """
+        @takesRequest
+        def handler(request):
+            self.calls.append(request.path)
+            return Response(200, "OK", {})
+
+        limiter = RateLimiter(1, header="X-Api-Key", reactor=self.clock)
+        factory = HTTPFactory(handler, rateLimiter=limiter)
+        self.request(factory, "GET /a HTTP/1.1\r\nx-api-key: 1\r\n\r\n")
+        self.request(factory, "GET /b HTTP/1.1\r\nX-API-Key: 2\r\n\r\n")
+        self.request(factory, "GET /c HTTP/1.1\r\n\r\n")
+        output = self.request(factory, "GET /d HTTP/1.1\r\nX-Api-Key: 1\r\n"
+                              "\r\n", host="10.0.0.2")
+        self.assertEqual(self.calls, ["/a", "/b", "/c"])
+        self.assertIn("429 Too Many Requests", output)
@@ -0,0 +1,125 @@
+"""
+Tests for toyhttp.resolver.
+"""
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import defer, error, task
+
+from toyhttp.resolver import CachingResolver
+
+
+class FakeResolver(object):
+    """
+    A resolver whose lookups are finished by the test.
+    """
+
+    def __init__(self):
+        self.lookups = []
+        self.error = None
+
+    def resolve(self, hostname):
+        if self.error is not None:
+            raise self.error
+        d = defer.Deferred()
+        self.lookups.append((hostname, d))
+        return d
+
+
+class Tests01_CachingResolver(TestCase):
+    """
+    Tests for L{CachingResolver}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.fake = FakeResolver()
+
+    def makeResolver(self, **kwargs):
+        return CachingResolver(self.fake, self.clock, **kwargs)
+
+    def test_01_cache(self):
+        """
+        An address is cached for C{ttl} seconds, whatever the case of the
+        hostname.
+        """
+        resolver = self.makeResolver(ttl=60)
+        d = resolver.resolve("example.com")
+        self.fake.lookups[0][1].callback("1.2.3.4")
+        self.assertEqual(self.successResultOf(d), "1.2.3.4")
+        self.clock.advance(59)
+        d = resolver.resolve("EXAMPLE.com")
+        self.assertEqual(self.successResultOf(d), "1.2.3.4")
+        self.assertEqual(len(self.fake.lookups), 1)
+        self.assertEqual((resolver.hits, resolver.misses), (1, 1))
+        self.clock.advance(1)
+        resolver.resolve("example.com")
+        self.assertEqual(len(self.fake.lookups), 2)
+
+    def test_02_negative(self):
+        """
+        Names that don't exist are cached for C{negativeTTL} seconds; other
+        failures aren't cached.
+        """
+        resolver = self.makeResolver(negativeTTL=10)
+        d = resolver.resolve("nowhere.invalid")
+        self.fake.lookups[-1][1].errback(error.DNSLookupError("nope"))
+        self.failureResultOf(d, error.DNSLookupError)
+        d = resolver.resolve("nowhere.invalid")
+        self.failureResultOf(d, error.DNSLookupError)
+        self.assertEqual(len(self.fake.lookups), 1)
+        self.clock.advance(10)
+        resolver.resolve("nowhere.invalid")
+        self.assertEqual(len(self.fake.lookups), 2)
+
+        d = resolver.resolve("flaky.example")
+        self.fake.lookups[-1][1].errback(ZeroDivisionError())
+        self.failureResultOf(d, ZeroDivisionError)
+        resolver.resolve("flaky.example")
+        self.assertEqual(len(self.fake.lookups), 4)
+
+    def test_03_coalesce(self):
+        """
+        Concurrent lookups of the same name share one lookup, but each gets
+        its own Deferred.
+        """
+        resolver = self.makeResolver()
+        results = [resolver.resolve("example.com") for i in range(3)]
+        self.assertEqual(len(self.fake.lookups), 1)
+        self.assertEqual(resolver.coalesced, 2)
+        results[0].addCallback(lambda address: "changed")
+        self.fake.lookups[0][1].callback("1.2.3.4")
+        self.assertEqual([self.successResultOf(d) for d in results],
+                         ["changed", "1.2.3.4", "1.2.3.4"])
+
+    def test_04_evict(self):
+        """
+        At most C{maxEntries} names are cached, evicting the least recently
+        used first.
+        """
+        resolver = self.makeResolver(maxEntries=2)
+        for name in ["a", "b", "a", "c"]:
+            resolver.resolve(name)
+            if not self.fake.lookups[-1][1].called:
+                self.fake.lookups[-1][1].callback(name)
+        self.assertEqual(len(resolver), 2)
+        resolver.resolve("a")
+        resolver.resolve("b")
+        self.assertEqual([name for name, d in self.fake.lookups],
+                         ["a", "b", "c", "b"])
+
+    def test_05_raises(self):
+        """
+        A lookup whose resolver raises instead of returning a Deferred fails
+        every lookup waiting for it, and the next lookup of the name is
+        passed to the resolver again.
+        """
+        resolver = self.makeResolver()
+        self.fake.error = ZeroDivisionError()
+        d = resolver.resolve("example.com")
+        self.failureResultOf(d, ZeroDivisionError)
+        self.fake.error = None
+        d = resolver.resolve("example.com")
+        self.assertEqual(len(self.fake.lookups), 1)
+        self.fake.lookups[0][1].callback("1.2.3.4")
+        self.assertEqual(self.successResultOf(d), "1.2.3.4")
+        self.assertEqual((resolver.misses, resolver.coalesced), (2, 0))
@@ -0,0 +1,183 @@
+"""
+Tests for toyhttp.router.
+"""
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import defer, task
+
+from toyhttp import offload
+from toyhttp.router import Router, parseQuery
+from toyhttp.server import HTTP, Response, deadline
+from toyhttp.tests.test_offload import FakeReactor, FakeThreadPool
+from toyhttp.tests.test_server import AbortableTransport
+
+
+def named(name):
+    """
+    Make a route handler answering with its name and parameters.
+    """
+    def handler(method, path, headers, body, **params):
+        return Response(200, name, params)
+    return handler
+
+
+class Tests01_Router(TestCase):
+    """
+    Tests for L{Router}.
+    """
+
+    def setUp(self):
+        self.router = Router()
+        for pattern in ["/", "/users", "/users/me", "/users/{id}",
+                        "/users/{id}/posts/{post}", "/static/*",
+                        "/static/special"]:
+            self.router.add("GET", pattern, named(pattern))
+
+    def request(self, path, method="GET"):
+        response = self.router(method, path, {}, "")
+        return response.code, response.body, response.headers
+
+    def test_01_static(self):
+        """
+        Static routes match their exact path, ignoring the query string.
+        """
+        self.assertEqual(self.request("/"), (200, "/", {}))
+        self.assertEqual(self.request("/users?x=y"), (200, "/users", {}))
+        self.assertEqual(self.request("/static/special")[1],
+                         "/static/special")
+
+    def test_02_params(self):
+        """
+        Parameter segments are passed to the handler as keyword arguments,
+        unquoted; static segments take priority over them.
+        """
+        self.assertEqual(self.request("/users/me"), (200, "/users/me", {}))
+        self.assertEqual(self.request("/users/a%20b"),
+                         (200, "/users/{id}", {"id": "a b"}))
+        self.assertEqual(self.request("/users/1/posts/2?x"),
+                         (200, "/users/{id}/posts/{post}",
+                          {"id": "1", "post": "2"}))
+
+    def test_03_prefix(self):
+        """
+        Prefix routes match their prefix and anything below it.
+        """
+        for path in ["/static", "/static/a", "/static/a/b/c",
+                     "/static/special/x"]:
+            self.assertEqual(self.request(path)[1], "/static/*")
+
+    def test_04_notFound(self):
+        """
+        Paths matching no route get a 404 response, or are passed to the
+        C{notFound} handler.
+        """
+        for path in ["/nope", "/users/1/posts", "/users/1/comments/2",
+                     "/users/"]:
+            self.assertEqual(self.request(path)[0], 404)
+        self.router.notFound = lambda method, path, headers, body: Response(
+            418, path, {})
+        self.assertEqual(self.request("/nope"), (418, "/nope", {}))
+
+    def test_05_methods(self):
+        """
+        C{GET} routes answer C{HEAD} requests; other methods get a 405
+        response listing the allowed methods; a route for any method
+        matches every method.
+        """
+        self.assertEqual(self.request("/users/1", "HEAD")[1], "/users/{id}")
+        self.assertEqual(self.request("/users/1", "POST"),
+                         (405, "", {"Allow": "GET, HEAD"}))
+        self.router.add("POST", "/users/{id}", named("post"))
+        self.router.add(None, "/any", named("any"))
+        self.assertEqual(self.request("/users/1", "POST")[1], "post")
+        self.assertEqual(self.request("/any", "DELETE")[1], "any")
+
+    def test_06_badPatterns(self):
+        """
+        Patterns must start with C{/}, and parameters in the same position
+        must have the same name.
+        """
+        self.assertRaises(ValueError, self.router.add, "GET", "users", None)
+        self.assertRaises(ValueError, self.router.add, "GET",
+                          "/users/{name}/x", None)
+
+    def test_07_parseQuery(self):
+        """
+        L{parseQuery} parses the query string of a path.
+        """
+        self.assertEqual(parseQuery("/a?x=1&y=2&x=3"),
+                         {"x": ["1", "3"], "y": ["2"]})
+        self.assertEqual(parseQuery("/a"), {})
+
+    def test_08_blocking(self):
+        """
+        Route handlers marked as blocking run in the router's handler pool.
+        """
+        threadPool = FakeThreadPool()
+        self.router.handlerPool = offload.HandlerPool(
+            reactor=FakeReactor(), threadPool=threadPool)
+        self.router.add("GET", "/slow/{n}", offload.blocking(named("slow")))
+        d = self.router("GET", "/slow/3", {}, "")
+        self.assertEqual(len(threadPool.calls), 1)
+        threadPool.runNext()
+        response = self.successResultOf(d)
+        self.assertEqual((response.body, response.headers),
+                         ("slow", {"n": "3"}))
+        self.assertEqual(self.request("/users")[1], "/users")
+        self.assertEqual(threadPool.calls, [])
+
+    def test_09_deadline(self):
+        """
+        The Deferred of a route handler with a deadline is cancelled once the
+        deadline has passed, and the request gets a 504 response.
+        """
+        clock = task.Clock()
+        router = Router(reactor=clock)
+        cancelled = []
+
+        @router.route("GET", "/slow")
+        @deadline(2)
+        def slow(method, path, headers, body):
+            return defer.Deferred(cancelled.append)
+
+        d = router("GET", "/slow", {}, "")
+        clock.advance(1)
+        self.assertNoResult(d)
+        clock.advance(1)
+        self.assertEqual(self.successResultOf(d).code, 504)
+        self.assertEqual(len(cancelled), 1)
+
+    def test_10_addAfterLookup(self):
+        """
+        A route added after a path has been looked up matches that path.
+        """
+        self.assertEqual(self.request("/posts/1")[0], 404)
+        self.assertEqual(self.router.label("GET", "/posts/1"), None)
+        self.router.add("GET", "/posts/{id}", named("/posts/{id}"))
+        self.assertEqual(self.router.label("GET", "/posts/1"), "/posts/{id}")
+        self.assertEqual(self.request("/posts/1")[:2], (200, "/posts/{id}"))
+
+    def test_11_nonBlocking(self):
+        """
+        A router is called in the reactor thread even by a server running
+        handlers in its pool, and only offloads the route handlers marked as
+        blocking.
+        """
+        threadPool = FakeThreadPool()
+        pool = offload.HandlerPool(reactor=FakeReactor(),
+                                   threadPool=threadPool)
+        self.router.handlerPool = pool
+        self.router.add("GET", "/slow", offload.blocking(named("slow")))
+        protocol = HTTP(self.router, reactor=task.Clock())
+        protocol.execution = offload.THREADS
+        protocol.handlerPool = pool
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived("GET /users HTTP/1.1\r\n\r\n")
+        self.assertEqual(threadPool.calls, [])
+        self.assertIn("/users", transport.value())
+        protocol.dataReceived("GET /slow HTTP/1.1\r\n\r\n")
+        self.assertEqual(len(threadPool.calls), 1)
+        threadPool.runNext()
+        self.assertTrue(transport.value().endswith("slow"))
+        self.assertEqual(threadPool.calls, [])
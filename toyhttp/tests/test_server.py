@@ -6,8 +6,15 @@ from twisted.trial.unittest import TestCase
 from twisted.test.proto_helpers import StringTransport
 from twisted.internet import defer, reactor, task
 from twisted.internet.protocol import ServerFactory, Protocol
+from twisted.internet.error import ConnectionDone
+from twisted.python.failure import Failure
+from twisted.web.iweb import IBodyProducer
+from zope.interface import implementer
 
-from toyhttp.server import HTTP, HTTPFactory, Response
+from toyhttp.cache import ResponseCache
+from toyhttp.server import (HTTP, HTTPFactory, Request, Response,
+                            PrerenderedResponse, StreamingResponse,
+                            takesRequest)
 
 
 class AbortableTransport(StringTransport):
@@ -57,7 +64,7 @@ class Tests01_Protocol(TestCase, ResponseMixin):
         protocol._writeResponse(Response(200, "Response body!",
                                          {"content-type": "text/plain"}))
         self.assertEqual(transport.value(),
-                         "HTTP/1.1 200 Reason\r\n"
+                         "HTTP/1.1 200 OK\r\n"
                          "Content-Length: 14\r\n"
                          "content-type: text/plain\r\n"
                          "\r\n"
@@ -449,3 +456,901 @@ class Tests03_Protocol(TestCase, ResponseMixin):
 
         result = yield getPage(url, method="POST", postdata="Some data")
         self.assertEqual(result, "Some data")
+
+
+class Tests04_PersistentConnections(TestCase):
+    """
+    Tests for persistent connections and pipelining in L{HTTP}.
+    """
+
+    def connect(self, handler, fakeReactor=None):
+        """
+        Create a L{HTTP} protocol connected to an L{AbortableTransport}.
+        """
+        if fakeReactor is None:
+            fakeReactor = task.Clock()
+        protocol = HTTP(handler, reactor=fakeReactor)
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        return protocol, transport
+
+    def test_21_keepAliveHTTP11(self):
+        """
+        HTTP/1.1 connections stay open after the response is written, and
+        pipelined requests are answered in order.
+        """
+        def handler(method, path, headers, body):
+            return Response(200, path, {})
+
+        protocol, transport = self.connect(handler)
+        protocol.dataReceived("GET /a HTTP/1.1\r\n\r\n"
+                              "GET /bb HTTP/1.1\r\n\r\n")
+        self.assertEqual(transport.value(),
+                         "HTTP/1.1 200 OK\r\n"
+                         "Content-Length: 2\r\n"
+                         "\r\n"
+                         "/a"
+                         "HTTP/1.1 200 OK\r\n"
+                         "Content-Length: 3\r\n"
+                         "\r\n"
+                         "/bb")
+        self.assertFalse(transport.disconnecting)
+
+    def test_22_connectionClose(self):
+        """
+        A HTTP/1.1 request with C{Connection: close} gets a response with the
+        same header, and the connection is closed afterwards.
+        """
+        protocol, transport = self.connect(
+            lambda *args: Response(200, "", {}))
+        protocol.dataReceived("GET / HTTP/1.1\r\n"
+                              "Connection: close\r\n"
+                              "\r\n")
+        self.assertIn("Connection: close\r\n", transport.value())
+        self.assertTrue(transport.disconnecting)
+
+    def test_23_http10(self):
+        """
+        HTTP/1.0 connections are closed after the response unless the client
+        asks for C{Connection: keep-alive}, which is then echoed back.
+        """
+        handler = lambda *args: Response(200, "", {})
+        protocol, transport = self.connect(handler)
+        protocol.dataReceived("GET / HTTP/1.0\r\n\r\n")
+        self.assertNotIn("Connection", transport.value())
+        self.assertTrue(transport.disconnecting)
+
+        protocol, transport = self.connect(handler)
+        protocol.dataReceived("GET / HTTP/1.0\r\n"
+                              "Connection: Keep-Alive\r\n"
+                              "\r\n")
+        self.assertIn("Connection: keep-alive\r\n", transport.value())
+        self.assertFalse(transport.disconnecting)
+
+    def test_24_pipelinedDeferred(self):
+        """
+        A pipelined request is not passed to the handler until the response
+        to the previous request, which the handler returned as a Deferred, has
+        been written.
+        """
+        results = [defer.Deferred(), defer.Deferred()]
+        paths = []
+        def handler(method, path, headers, body):
+            paths.append(path)
+            return results[len(paths) - 1]
+
+        protocol, transport = self.connect(handler)
+        protocol.dataReceived("GET /1 HTTP/1.1\r\n\r\nGET /2 HTTP/1.1\r\n")
+        protocol.dataReceived("\r\n")
+        self.assertEqual(paths, ["/1"])
+        self.assertEqual(transport.producerState, "paused")
+
+        results[0].callback(Response(200, "one", {}))
+        self.assertEqual(paths, ["/1", "/2"])
+        self.assertEqual(transport.producerState, "producing")
+        results[1].callback(Response(200, "two", {}))
+        self.assertTrue(transport.value().endswith("one"
+                                                   "HTTP/1.1 200 OK\r\n"
+                                                   "Content-Length: 3\r\n"
+                                                   "\r\n"
+                                                   "two"))
+
+    def test_25_maxRequestsPerConnection(self):
+        """
+        Once C{maxRequestsPerConnection} requests have been received on a
+        connection, the last response announces C{Connection: close} and the
+        connection is closed.
+        """
+        factory = HTTPFactory(lambda *args: Response(200, "", {}),
+                              maxRequestsPerConnection=2)
+        protocol = factory.buildProtocol(None)
+        protocol.reactor = task.Clock()
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+
+        protocol.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        self.assertNotIn("Connection", transport.value())
+        self.assertFalse(transport.disconnecting)
+        protocol.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        self.assertIn("Connection: close\r\n", transport.value())
+        self.assertTrue(transport.disconnecting)
+
+    def test_26_keepAliveTimeout(self):
+        """
+        An idle persistent connection is closed after C{keepAliveTimeout}
+        seconds; a new request arriving before then restarts the request
+        timeout instead.
+        """
+        fakeReactor = task.Clock()
+        protocol, transport = self.connect(
+            lambda *args: Response(200, "", {}), fakeReactor)
+        protocol.keepAliveTimeout = 5
+
+        protocol.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        fakeReactor.advance(4)
+        protocol.dataReceived("GET")
+        fakeReactor.advance(4)
+        self.assertFalse(transport.disconnecting)
+        protocol.dataReceived(" / HTTP/1.1\r\n\r\n")
+        fakeReactor.advance(5)
+        self.assertTrue(transport.disconnecting)
+        self.assertFalse(transport.aborting)
+
+    def test_27_headerValueWithColon(self):
+        """
+        Header values containing colons are passed to the handler in full.
+        """
+        headers = []
+        def handler(method, path, requestHeaders, body):
+            headers.append(requestHeaders)
+            return Response(200, "", {})
+
+        protocol, transport = self.connect(handler)
+        protocol.dataReceived("GET / HTTP/1.1\r\n"
+                              "Host: localhost:8080\r\n"
+                              "\r\n")
+        self.assertEqual(headers, [{"Host": "localhost:8080"}])
+
+
+class BodyCollector(object):
+    """
+    A handler that receives request bodies as they arrive.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, method, path, headers, body):
+        self.events.append(("buffered", body))
+        return Response(200, "buffered", {})
+
+    def bodyReceiver(self, method, path, headers):
+        if path != "/stream":
+            return None
+        self.events.append(("started", method))
+        return self
+
+    def bodyDataReceived(self, data):
+        self.events.append(("data", data))
+
+    def bodyFinished(self):
+        self.events.append(("finished",))
+        return Response(200, "streamed", {})
+
+    def bodyAborted(self, reason):
+        self.events.append(("aborted", reason.type))
+
+
+class Tests05_RequestBodies(TestCase):
+    """
+    Tests for receiving request bodies in L{HTTP}.
+    """
+
+    def connect(self, handler, maxBodySize=HTTP.maxBodySize):
+        protocol = HTTP(handler, reactor=task.Clock())
+        protocol.maxBodySize = maxBodySize
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        return protocol, transport
+
+    def test_28_chunkedBody(self):
+        """
+        A chunked request body is decoded and passed to the handler.
+        """
+        def handler(method, path, headers, body):
+            return Response(200, body, {})
+
+        protocol, transport = self.connect(handler)
+        protocol.dataReceived("POST / HTTP/1.1\r\n"
+                              "Transfer-Encoding: chunked\r\n"
+                              "\r\n"
+                              "4\r\nSome\r\n5\r\n data\r\n0\r\n\r\n")
+        self.assertTrue(transport.value().endswith("\r\n\r\nSome data"))
+        self.assertFalse(transport.disconnecting)
+
+    def test_29_contentLengthTooLarge(self):
+        """
+        A request announcing a body larger than C{maxBodySize} gets a 413
+        response without the handler being called, and the connection is
+        closed.
+        """
+        called = []
+        protocol, transport = self.connect(lambda *args: called.append(args),
+                                           maxBodySize=10)
+        protocol.dataReceived("POST / HTTP/1.1\r\n"
+                              "Content-Length: 11\r\n"
+                              "\r\n")
+        self.assertTrue(transport.value().startswith("HTTP/1.1 413 "))
+        self.assertTrue(transport.disconnecting)
+        self.assertEqual(called, [])
+
+    def test_30_chunkedTooLarge(self):
+        """
+        A chunked request body growing larger than C{maxBodySize} gets a 413
+        response.
+        """
+        called = []
+        protocol, transport = self.connect(lambda *args: called.append(args),
+                                           maxBodySize=10)
+        protocol.dataReceived("POST / HTTP/1.1\r\n"
+                              "Transfer-Encoding: chunked\r\n"
+                              "\r\n"
+                              "6\r\nabcdef\r\n")
+        self.assertEqual(transport.value(), "")
+        protocol.dataReceived("6\r\nabcdef\r\n")
+        self.assertTrue(transport.value().startswith("HTTP/1.1 413 "))
+        self.assertTrue(transport.disconnecting)
+        self.assertEqual(called, [])
+
+    def test_31_streamingBody(self):
+        """
+        If the handler's C{bodyReceiver} method returns an object, the body is
+        passed to it as it arrives, and its C{bodyFinished} result is written
+        as the response.  Otherwise the body is buffered as usual.
+        """
+        handler = BodyCollector()
+        protocol, transport = self.connect(handler)
+        protocol.dataReceived("PUT /stream HTTP/1.1\r\n"
+                              "Content-Length: 6\r\n"
+                              "\r\n"
+                              "abc")
+        self.assertEqual(handler.events, [("started", "PUT"), ("data", "abc")])
+        protocol.dataReceived("def")
+        self.assertEqual(handler.events[2:], [("data", "def"), ("finished",)])
+        self.assertTrue(transport.value().endswith("streamed"))
+
+        protocol.dataReceived("PUT /other HTTP/1.1\r\n"
+                              "Content-Length: 3\r\n"
+                              "\r\n"
+                              "xyz")
+        self.assertEqual(handler.events[4:], [("buffered", "xyz")])
+
+    def test_32_streamingBodyAborted(self):
+        """
+        If the connection is lost before a streamed body is complete, the
+        body receiver's C{bodyAborted} method is called.
+        """
+        from twisted.internet.error import ConnectionLost
+        from twisted.python.failure import Failure
+
+        handler = BodyCollector()
+        protocol, transport = self.connect(handler)
+        protocol.dataReceived("PUT /stream HTTP/1.1\r\n"
+                              "Content-Length: 6\r\n"
+                              "\r\n"
+                              "abc")
+        protocol.connectionLost(Failure(ConnectionLost()))
+        self.assertEqual(handler.events[-1], ("aborted", ConnectionLost))
+
+    def test_33_expectContinue(self):
+        """
+        A HTTP/1.1 request with C{Expect: 100-continue} gets an interim 100
+        response before the body is read, unless the body is too large.
+        """
+        protocol, transport = self.connect(lambda *args: Response(200, "", {}))
+        protocol.dataReceived("POST / HTTP/1.1\r\n"
+                              "Expect: 100-continue\r\n"
+                              "Content-Length: 3\r\n"
+                              "\r\n")
+        self.assertEqual(transport.value(), "HTTP/1.1 100 Continue\r\n\r\n")
+
+        protocol, transport = self.connect(lambda *args: Response(200, "", {}),
+                                           maxBodySize=2)
+        protocol.dataReceived("POST / HTTP/1.1\r\n"
+                              "Expect: 100-continue\r\n"
+                              "Content-Length: 3\r\n"
+                              "\r\n")
+        self.assertTrue(transport.value().startswith("HTTP/1.1 413 "))
+
+
+class SequenceRecordingTransport(AbortableTransport):
+    """
+    Fake transport that records calls to writeSequence().
+    """
+
+    def __init__(self):
+        AbortableTransport.__init__(self)
+        self.sequences = []
+
+    def writeSequence(self, data):
+        self.sequences.append(data)
+        AbortableTransport.writeSequence(self, data)
+
+
+class Tests06_ResponseSerialization(TestCase):
+    """
+    Tests for writing L{Response} objects.
+    """
+
+    def test_34_reasonPhrases(self):
+        """
+        L{Response.renderHead} uses the standard reason phrase for the status
+        code, and a generic one for unknown codes.
+        """
+        self.assertEqual(Response(404, "", {}).renderHead(),
+                         "HTTP/1.1 404 Not Found\r\n"
+                         "Content-Length: 0\r\n"
+                         "\r\n")
+        self.assertEqual(Response(599, "", {}).renderHead("close"),
+                         "HTTP/1.1 599 Unknown Status\r\n"
+                         "Content-Length: 0\r\n"
+                         "Connection: close\r\n"
+                         "\r\n")
+        # Responses that can't have a body don't announce its length:
+        self.assertEqual(Response(304, "", {}).renderHead(),
+                         "HTTP/1.1 304 Not Modified\r\n"
+                         "\r\n")
+
+    def test_35_bodyNotCopied(self):
+        """
+        L{HTTP._writeResponse} passes the head and the body to the transport
+        as separate buffers, so the body isn't copied.
+        """
+        body = "x" * 1000
+        protocol = HTTP(None, reactor=task.Clock())
+        transport = SequenceRecordingTransport()
+        protocol.makeConnection(transport)
+        protocol._writeResponse(Response(200, body, {}))
+        [[head, written]] = transport.sequences
+        self.assertEqual(head, "HTTP/1.1 200 OK\r\n"
+                               "Content-Length: 1000\r\n"
+                               "\r\n")
+        self.assertIdentical(written, body)
+
+    def test_36_largeBody(self):
+        """
+        Bodies larger than C{largeBodySize} are written a slice at a time by
+        a pull producer; once the last slice is written, the next pipelined
+        request is handled.
+        """
+        from toyhttp import server
+        self.patch(server._BodySender, "sliceSize", 4)
+        paths = []
+        def handler(method, path, headers, body):
+            paths.append(path)
+            return Response(200, "0123456789", {})
+
+        protocol = HTTP(handler, reactor=task.Clock())
+        protocol.largeBodySize = 5
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived("GET /1 HTTP/1.1\r\n\r\nGET /2 HTTP/1.1\r\n\r\n")
+        self.assertEqual(paths, ["/1"])
+        self.assertFalse(transport.streaming)
+        while transport.value().count("0123456789") < 2:
+            transport.producer.resumeProducing()
+        self.assertEqual(paths, ["/1", "/2"])
+        self.assertTrue(transport.value().endswith("\r\n\r\n0123456789"))
+
+
+@implementer(IBodyProducer)
+class FakeBodyProducer(object):
+    """
+    A minimal L{twisted.web.iweb.IBodyProducer} that writes what it's told
+    to.
+    """
+
+    def __init__(self, length):
+        self.length = length
+        self.finished = defer.Deferred()
+
+    def startProducing(self, consumer):
+        self.consumer = consumer
+        consumer.registerProducer(self, True)
+        return self.finished
+
+    def finish(self):
+        self.consumer.unregisterProducer()
+        self.finished.callback(None)
+
+    def pauseProducing(self):
+        pass
+
+    def resumeProducing(self):
+        pass
+
+    def stopProducing(self):
+        pass
+
+
+class Tests07_StreamingResponses(TestCase):
+    """
+    Tests for writing L{StreamingResponse} objects.
+    """
+
+    def respond(self, response, request="GET / HTTP/1.1\r\n\r\n"):
+        """
+        Connect a L{HTTP} protocol whose handler returns C{response}, and
+        send it a request.
+        """
+        protocol = HTTP(lambda *args: response, reactor=task.Clock())
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived(request)
+        return protocol, transport
+
+    def produce(self, transport):
+        """
+        Drive the pull producer registered with C{transport} until it
+        unregisters.
+        """
+        self.assertFalse(transport.streaming)
+        while transport.producer is not None:
+            transport.producer.resumeProducing()
+
+    def test_37_iterableChunked(self):
+        """
+        An iterable body of unknown length is sent to HTTP/1.1 clients with
+        chunked transfer-encoding, and the connection stays open.
+        """
+        protocol, transport = self.respond(
+            StreamingResponse(200, iter(["ab", "", "cde"]), {}))
+        self.produce(transport)
+        self.assertEqual(transport.value(),
+                         "HTTP/1.1 200 OK\r\n"
+                         "Transfer-Encoding: chunked\r\n"
+                         "\r\n"
+                         "2\r\nab\r\n"
+                         "3\r\ncde\r\n"
+                         "0\r\n\r\n")
+        self.assertFalse(transport.disconnecting)
+
+    def test_38_fileWithLength(self):
+        """
+        A file body of known length is read a slice at a time and sent as is,
+        with a C{Content-Length} header; the file is closed afterwards.
+        """
+        from StringIO import StringIO
+        from toyhttp import server
+        self.patch(server._BodyStreamer, "sliceSize", 2)
+        f = StringIO("hello")
+        protocol, transport = self.respond(StreamingResponse(200, f, {}, 5))
+        self.produce(transport)
+        self.assertEqual(transport.value(),
+                         "HTTP/1.1 200 OK\r\n"
+                         "Content-Length: 5\r\n"
+                         "\r\n"
+                         "hello")
+        self.assertTrue(f.closed)
+        self.assertFalse(transport.disconnecting)
+
+    def test_39_http10UnknownLength(self):
+        """
+        A body of unknown length is delimited by closing the connection for
+        HTTP/1.0 clients, even if they asked for keep-alive.
+        """
+        protocol, transport = self.respond(
+            StreamingResponse(200, ["abc"], {}),
+            "GET / HTTP/1.0\r\nConnection: keep-alive\r\n\r\n")
+        self.produce(transport)
+        self.assertEqual(transport.value(),
+                         "HTTP/1.1 200 OK\r\n"
+                         "\r\n"
+                         "abc")
+        self.assertTrue(transport.disconnecting)
+
+    def test_40_bodyProducer(self):
+        """
+        An L{IBodyProducer} body writes to the protocol, and is registered
+        with the transport so it is paused and resumed with it.
+        """
+        producer = FakeBodyProducer(3)
+        protocol, transport = self.respond(
+            StreamingResponse(200, producer, {}))
+        self.assertIdentical(transport.producer, producer)
+        self.assertTrue(transport.streaming)
+        producer.consumer.write("abc")
+        producer.finish()
+        self.assertEqual(transport.value(),
+                         "HTTP/1.1 200 OK\r\n"
+                         "Content-Length: 3\r\n"
+                         "\r\n"
+                         "abc")
+        self.assertIdentical(transport.producer, None)
+        self.assertFalse(transport.disconnecting)
+
+    def test_41_bodyError(self):
+        """
+        If producing the body fails after the head has been written, the
+        error is logged and the connection is aborted.
+        """
+        def body():
+            yield "abc"
+            raise ZeroDivisionError()
+
+        protocol, transport = self.respond(StreamingResponse(200, body(), {}))
+        self.produce(transport)
+        self.assertTrue(transport.aborting)
+        self.assertEqual(len(self.flushLoggedErrors(ZeroDivisionError)), 1)
+
+
+class Tests08_ClosingConnections(TestCase):
+    """
+    Tests for L{HTTP.closeWhenIdle}.
+    """
+
+    def test_42_closeIdleConnection(self):
+        """
+        An idle connection is closed right away.
+        """
+        protocol = HTTP(lambda *args: Response(200, "", {}),
+                        reactor=task.Clock())
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        self.assertFalse(transport.disconnecting)
+        protocol.closeWhenIdle()
+        self.assertTrue(transport.disconnecting)
+
+    def test_43_closeAfterResponse(self):
+        """
+        A connection answering a request is closed once the response has been
+        written, which announces that it will be.
+        """
+        d = defer.Deferred()
+        protocol = HTTP(lambda *args: d, reactor=task.Clock())
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        protocol.closeWhenIdle()
+        self.assertFalse(transport.disconnecting)
+        d.callback(Response(200, "", {}))
+        self.assertEqual(transport.value(),
+                         "HTTP/1.1 200 OK\r\n"
+                         "Content-Length: 0\r\n"
+                         "Connection: close\r\n"
+                         "\r\n")
+        self.assertTrue(transport.disconnecting)
+
+
+class Tests09_Timeouts(TestCase):
+    """
+    Tests for the header, body and write timeouts of L{HTTP}.
+    """
+
+    def connect(self, handler, clock):
+        protocol = HTTP(handler, reactor=clock)
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        return protocol, transport
+
+    def test_44_bodyTimeout(self):
+        """
+        Once the head has been received, the connection is aborted if the
+        client sends none of the body for C{bodyTimeout} seconds.
+        """
+        clock = task.Clock()
+        protocol, transport = self.connect(None, clock)
+        protocol.bodyTimeout = 10
+        protocol.dataReceived("POST / HTTP/1.1\r\n"
+                              "Content-Length: 10\r\n"
+                              "\r\n")
+        for i in range(5):
+            clock.advance(8)
+            protocol.dataReceived("x")
+        self.assertFalse(transport.aborting)
+        clock.advance(11)
+        self.assertTrue(transport.aborting)
+
+    def test_45_writeTimeout(self):
+        """
+        A response body written a slice at a time keeps the connection open
+        while the client reads it, and the connection is aborted once it
+        stops reading for C{writeTimeout} seconds.
+        """
+        clock = task.Clock()
+        body = "x" * (HTTP.largeBodySize * 2)
+        protocol, transport = self.connect(
+            lambda *args: Response(200, body, {}), clock)
+        protocol.writeTimeout = 10
+        protocol.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        clock.advance(8)
+        transport.producer.resumeProducing()
+        clock.advance(8)
+        self.assertFalse(transport.aborting)
+        clock.advance(3)
+        self.assertTrue(transport.aborting)
+
+    def test_46_sharedTimerWheel(self):
+        """
+        The connections of a factory share a single periodic call to track
+        their timeouts.
+        """
+        clock = task.Clock()
+        factory = HTTPFactory(lambda *args: Response(200, "", {}))
+        transports = []
+        for i in range(3):
+            protocol = factory.buildProtocol(None)
+            protocol.reactor = clock
+            transport = AbortableTransport()
+            protocol.makeConnection(transport)
+            transports.append(transport)
+        self.assertEqual(len(clock.getDelayedCalls()), 1)
+        self.assertEqual(len(factory.timerWheel(clock)), 3)
+        clock.advance(HTTP.headerTimeout)
+        self.assertEqual([t.aborting for t in transports], [True] * 3)
+        self.assertEqual(clock.getDelayedCalls(), [])
+
+    def test_47_slowHead(self):
+        """
+        A client sending a request head slower than C{minHeaderRate} bytes
+        per second gets a 408 response, and the connection is closed.
+        """
+        clock = task.Clock()
+        protocol = HTTP(None, reactor=clock)
+        protocol.minHeaderRate = 10
+        protocol.headerRateWindow = 5
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived("GET / HTTP/1.1\r\n" + "X: y\r\n" * 8)
+        clock.advance(6)
+        self.assertFalse(transport.disconnecting)
+        # Then a byte a second:
+        while not transport.disconnecting:
+            protocol.dataReceived("X")
+            clock.advance(1)
+        # Checked every 5 seconds, up to a second late each time:
+        self.assertIn(clock.seconds(), (10, 11, 12))
+        self.assertTrue(transport.value().startswith("HTTP/1.1 408 "))
+        self.assertTrue(transport.disconnecting)
+
+    def test_48_headLimits(self):
+        """
+        Overlong request lines get a 414 response, and heads with too many
+        headers a 431 response.
+        """
+        for code, data in [
+                (414, "GET /" + "x" * HTTP.maxRequestLineSize),
+                (431, "GET / HTTP/1.1\r\n" +
+                 "X: y\r\n" * (HTTP.maxHeaderCount + 1) + "\r\n")]:
+            protocol, transport = self.connect(None, task.Clock())
+            protocol.dataReceived(data)
+            self.assertTrue(transport.value().startswith(
+                "HTTP/1.1 %d " % (code,)))
+            self.assertTrue(transport.disconnecting)
+
+
+class FakeFuture(object):
+    """
+    A future with the C{add_done_callback} and C{result} methods of
+    C{asyncio.Future}.
+    """
+
+    def __init__(self):
+        self._callbacks = []
+
+    def add_done_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def set_result(self, result):
+        self._result = result
+        for callback in self._callbacks:
+            callback(self)
+
+    def result(self):
+        return self._result
+
+    def cancel(self):
+        pass
+
+
+class Tests10_Coroutines(TestCase):
+    """
+    Tests for handlers that are coroutines.
+    """
+
+    def request(self, handler):
+        protocol = HTTP(handler, reactor=task.Clock())
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        return transport
+
+    def test_49_generator(self):
+        """
+        A handler that is a generator is run like an L{inlineCallbacks}
+        function, with the response it returns written once it is done.
+        """
+        pending = defer.Deferred()
+
+        def handler(method, path, headers, body):
+            text = yield pending
+            defer.returnValue(Response(200, text, {}))
+
+        transport = self.request(handler)
+        self.assertEqual(transport.value(), "")
+        pending.callback("done")
+        self.assertEqual(transport.value().split("\r\n\r\n", 1)[1], "done")
+
+    def test_50_future(self):
+        """
+        A handler returning a future has the response it resolves to
+        written.
+        """
+        future = FakeFuture()
+        transport = self.request(lambda *args: future)
+        self.assertEqual(transport.value(), "")
+        future.set_result(Response(200, "done", {}))
+        self.assertEqual(transport.value().split("\r\n\r\n", 1)[1], "done")
+
+
+class Tests11_Disconnect(TestCase):
+    """
+    Tests for abandoning responses when the client disconnects.
+    """
+
+    def test_51_cancelOnDisconnect(self):
+        """
+        If the connection is lost while the handler's Deferred is pending,
+        the Deferred is cancelled, and nothing is written or logged.
+        """
+        cancelled = []
+        protocol = HTTP(lambda *args: defer.Deferred(cancelled.append),
+                        reactor=task.Clock())
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        protocol.connectionLost(Failure(ConnectionDone()))
+        self.assertEqual(len(cancelled), 1)
+        self.assertEqual(transport.value(), "")
+        self.assertEqual(self.flushLoggedErrors(), [])
+
+    def test_52_lateResponse(self):
+        """
+        A response produced after the connection was lost, e.g. by a handler
+        answering cancellation with a response, isn't written.
+        """
+        def handler(*args):
+            return defer.Deferred(
+                lambda d: d.callback(Response(200, "late", {})))
+
+        protocol = HTTP(handler, reactor=task.Clock())
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        protocol.connectionLost(Failure(ConnectionDone()))
+        self.assertEqual(transport.value(), "")
+
+
+class Tests12_Requests(TestCase):
+    """
+    Tests for handlers taking a L{Request}.
+    """
+
+    def test_53_takesRequest(self):
+        """
+        A handler marked with L{takesRequest} is called with a L{Request},
+        whose headers, query arguments and cookies are parsed when first
+        read.
+        """
+        requests = []
+
+        @takesRequest
+        def handler(request):
+            requests.append(request)
+            return Response(200, request.body, {})
+
+        protocol = HTTP(handler, reactor=task.Clock())
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived("POST /a?x=1&x=2 HTTP/1.1\r\n"
+                              "Cookie: id=42; theme=\"dark\"\r\n"
+                              "Content-Length: 4\r\n"
+                              "cookie: id=43\r\n\r\nbody")
+        self.assertTrue(transport.value().endswith("\r\n\r\nbody"))
+        [request] = requests
+        self.assertEqual((request.method, request.path),
+                         ("POST", "/a?x=1&x=2"))
+        self.assertIdentical(request._headers, None)
+        self.assertEqual(request.query, {"x": ["1", "2"]})
+        self.assertEqual(request.cookies, {"id": "42", "theme": "dark"})
+        self.assertEqual(request.headers["content-length"], "4")
+
+    def test_54_takesRequestWithCache(self):
+        """
+        Handlers taking a L{Request} can be answered through a response
+        cache, which reads the headers itself.
+        """
+        calls = []
+
+        @takesRequest
+        def handler(request):
+            calls.append(request.headers.get("Accept"))
+            return Response(200, "hi", {"Cache-Control": "max-age=60"})
+
+        factory = HTTPFactory(handler, responseCache=ResponseCache())
+        for i in range(2):
+            protocol = factory.buildProtocol(None)
+            protocol.reactor = task.Clock()
+            transport = AbortableTransport()
+            protocol.makeConnection(transport)
+            protocol.dataReceived("GET / HTTP/1.1\r\nAccept: */*\r\n\r\n")
+            self.assertTrue(transport.value().endswith("\r\n\r\nhi"))
+        self.assertEqual(calls, ["*/*"])
+
+    def test_55_slots(self):
+        """
+        Requests and responses have no instance dictionary.
+        """
+        for message in [Request("GET", "/", {}, ""),
+                        Response(200, "", {}),
+                        PrerenderedResponse(200, "", {}),
+                        StreamingResponse(200, [], {})]:
+            self.assertFalse(hasattr(message, "__dict__"))
+
+
+class Tests13_HeadRequests(TestCase):
+    """
+    Tests for answering C{HEAD} requests.
+    """
+
+    def connect(self, handler):
+        protocol = HTTP(handler, reactor=task.Clock())
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        return protocol, transport
+
+    def test_56_pipelinedHead(self):
+        """
+        The response to a C{HEAD} request is written without its body but
+        with its C{Content-Length}, so a pipelined request after it gets a
+        response of its own.
+        """
+        protocol, transport = self.connect(
+            lambda *args: Response(200, "hello body", {}))
+        protocol.dataReceived("HEAD /x HTTP/1.1\r\n\r\n"
+                              "GET /x HTTP/1.1\r\n\r\n")
+        self.assertEqual(transport.value(),
+                         "HTTP/1.1 200 OK\r\n"
+                         "Content-Length: 10\r\n"
+                         "\r\n"
+                         "HTTP/1.1 200 OK\r\n"
+                         "Content-Length: 10\r\n"
+                         "\r\n"
+                         "hello body")
+        self.assertFalse(transport.disconnecting)
+
+    def test_57_headStreaming(self):
+        """
+        A L{StreamingResponse} to a C{HEAD} request is written without its
+        body, which is closed, and without chunked transfer-encoding if its
+        length isn't known.
+        """
+        from StringIO import StringIO
+        f = StringIO("hello")
+        protocol, transport = self.connect(
+            lambda *args: StreamingResponse(200, f, {}, 5))
+        protocol.dataReceived("HEAD / HTTP/1.1\r\n\r\n")
+        self.assertEqual(transport.value(),
+                         "HTTP/1.1 200 OK\r\n"
+                         "Content-Length: 5\r\n"
+                         "\r\n")
+        self.assertTrue(f.closed)
+        self.assertIdentical(transport.producer, None)
+
+        protocol, transport = self.connect(
+            lambda *args: StreamingResponse(200, ["abc"], {}))
+        protocol.dataReceived("HEAD / HTTP/1.1\r\n\r\n"
+                              "HEAD / HTTP/1.1\r\n\r\n")
+        self.assertEqual(transport.value(), "HTTP/1.1 200 OK\r\n\r\n" * 2)
+        self.assertFalse(transport.disconnecting)
@@ -0,0 +1,187 @@
+"""
+Tests for toyhttp.static.
+"""
+
+import os
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import task
+from twisted.python import log
+from twisted.web.http import datetimeToString
+
+from toyhttp.server import HTTP
+from toyhttp.static import StaticFiles
+from toyhttp.tests.test_server import AbortableTransport
+
+
+class Tests01_StaticFiles(TestCase):
+    """
+    Tests for L{StaticFiles}.
+    """
+
+    def setUp(self):
+        self.root = self.mktemp()
+        os.makedirs(os.path.join(self.root, "sub"))
+        self.write("hello.txt", "Hello, world!")
+        self.write("sub/index.html", "<html></html>")
+        self.handler = StaticFiles(self.root)
+
+    def write(self, name, content):
+        with open(os.path.join(self.root, name), "wb") as f:
+            f.write(content)
+
+    def get(self, path, headers={}):
+        """
+        Request C{path} and return the response and its full body.
+        """
+        response = self.handler("GET", path, headers, "")
+        body = response.body
+        if hasattr(body, "read"):
+            data = []
+            while True:
+                piece = body.read(4)
+                if not piece:
+                    break
+                data.append(piece)
+            body.close()
+            body = "".join(data)
+        return response, body
+
+    def test_01_get(self):
+        """
+        A file is served with its length, content type and validators.
+        """
+        response, body = self.get("/hello.txt?x=y")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(body, "Hello, world!")
+        self.assertEqual(response.length, 13)
+        self.assertEqual(response.headers["Content-Type"], "text/plain")
+        self.assertEqual(response.headers["Accept-Ranges"], "bytes")
+        self.assertIn("ETag", response.headers)
+        self.assertIn("Last-Modified", response.headers)
+
+    def test_02_index(self):
+        """
+        Requests for a directory are served its index file.
+        """
+        response, body = self.get("/sub/")
+        self.assertEqual(body, "<html></html>")
+        self.assertEqual(response.headers["Content-Type"], "text/html")
+
+    def test_03_notFound(self):
+        """
+        Missing files, paths outside the root and paths outside the prefix
+        get 404 responses, and methods other than GET get 405.
+        """
+        for path in ["/missing", "/../hello.txt", "/%2e%2e/x", "/%00"]:
+            self.assertEqual(self.get(path)[0].code, 404)
+        self.handler.prefix = "/static"
+        self.assertEqual(self.get("/hello.txt")[0].code, 404)
+        self.assertEqual(self.get("/static/hello.txt")[1], "Hello, world!")
+        self.assertEqual(
+            self.handler("POST", "/static/hello.txt", {}, "").code, 405)
+
+    def test_04_notModified(self):
+        """
+        Conditional requests whose cached copy is current get a 304
+        response.
+        """
+        response, body = self.get("/hello.txt")
+        etag = response.headers["ETag"]
+        self.assertEqual(
+            self.get("/hello.txt", {"If-None-Match": "W/" + etag})[0].code,
+            304)
+        self.assertEqual(
+            self.get("/hello.txt", {"if-none-match": '"other"'})[0].code,
+            200)
+        lastModified = response.headers["Last-Modified"]
+        self.assertEqual(
+            self.get("/hello.txt",
+                     {"If-Modified-Since": lastModified})[0].code, 304)
+        self.assertEqual(
+            self.get("/hello.txt",
+                     {"If-Modified-Since": datetimeToString(0)})[0].code,
+            200)
+
+    def test_05_range(self):
+        """
+        Single byte ranges are served as 206 responses; unsatisfiable ranges
+        get a 416 response, and other ranges are ignored.
+        """
+        response, body = self.get("/hello.txt", {"Range": "bytes=7-11"})
+        self.assertEqual((response.code, body), (206, "world"))
+        self.assertEqual(response.headers["Content-Range"], "bytes 7-11/13")
+        response, body = self.get("/hello.txt", {"Range": "bytes=-6"})
+        self.assertEqual((response.code, body), (206, "world!"))
+        response, body = self.get("/hello.txt", {"Range": "bytes=7-"})
+        self.assertEqual((response.code, body), (206, "world!"))
+        response, body = self.get("/hello.txt", {"Range": "bytes=13-"})
+        self.assertEqual(response.code, 416)
+        self.assertEqual(response.headers["Content-Range"], "bytes */13")
+        for byteRange in ["bytes=0-1,3-4", "lines=1-2", "bytes=x-"]:
+            response, body = self.get("/hello.txt", {"Range": byteRange})
+            self.assertEqual((response.code, body), (200, "Hello, world!"))
+
+    def test_06_openFileCache(self):
+        """
+        Open files are cached, up to C{maxOpenFiles}, least recently used
+        first out; a changed file is reopened.
+        """
+        self.handler.maxOpenFiles = 2
+        self.write("other.txt", "other")
+        self.get("/hello.txt")
+        self.get("/other.txt")
+        self.get("/hello.txt")
+        self.get("/sub/")
+        self.assertEqual(
+            [os.path.basename(path) for path in self.handler._cache],
+            ["hello.txt", "index.html"])
+
+        self.write("hello.txt", "Changed!")
+        self.assertEqual(self.get("/hello.txt")[1], "Changed!")
+
+    def test_07_protocol(self):
+        """
+        L{StaticFiles} can be used as the handler of a L{HTTP} protocol.
+        """
+        protocol = HTTP(self.handler, reactor=task.Clock())
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived("GET /hello.txt HTTP/1.1\r\n\r\n")
+        while transport.producer is not None:
+            transport.producer.resumeProducing()
+        self.assertTrue(transport.value().startswith("HTTP/1.1 200 OK\r\n"))
+        self.assertTrue(transport.value().endswith("\r\n\r\nHello, world!"))
+
+    def test_08_head(self):
+        """
+        C{HEAD} requests get the headers a C{GET} request would, including
+        the C{Content-Length} of the file, without the body; other methods
+        get a 405 response.
+        """
+        get, body = self.get("/hello.txt")
+        head = self.handler("HEAD", "/hello.txt", {}, "")
+        self.assertEqual((head.code, head.headers, head.length),
+                         (get.code, get.headers, get.length))
+        self.assertEqual(list(head.body), [])
+        ranged = self.handler("HEAD", "/hello.txt", {"Range": "bytes=0-4"},
+                              "")
+        self.assertEqual((ranged.code, ranged.length), (206, 5))
+        response = self.handler("POST", "/hello.txt", {}, "")
+        self.assertEqual((response.code, response.headers["Allow"]),
+                         (405, "GET, HEAD"))
+
+        messages = []
+        log.addObserver(messages.append)
+        self.addCleanup(log.removeObserver, messages.append)
+        protocol = HTTP(self.handler, reactor=task.Clock())
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived("HEAD /hello.txt HTTP/1.1\r\n\r\n")
+        while transport.producer is not None:
+            transport.producer.resumeProducing()
+        head, body = transport.value().split("\r\n\r\n", 1)
+        self.assertIn("Content-Length: 13", head.split("\r\n"))
+        self.assertEqual(body, "")
+        self.assertFalse(transport.disconnecting)
+        self.assertEqual(messages, [])
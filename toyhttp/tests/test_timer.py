@@ -0,0 +1,99 @@
+"""
+Tests for toyhttp.timer.
+"""
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import task
+
+from toyhttp.timer import TimerWheel
+
+
+class Tests01_TimerWheel(TestCase):
+    """
+    Tests for L{TimerWheel}.
+    """
+
+    def test_01_fire(self):
+        """
+        A timer fires once its delay has passed, within one tick, and is
+        then inactive.
+        """
+        clock = task.Clock()
+        wheel = TimerWheel(clock)
+        fired = []
+        timer = wheel.schedule(2.5, lambda: fired.append(clock.seconds()))
+        clock.advance(2)
+        self.assertEqual(fired, [])
+        self.assertTrue(timer.active())
+        clock.advance(1)
+        self.assertEqual(fired, [3])
+        self.assertFalse(timer.active())
+        self.assertEqual(len(wheel), 0)
+
+    def test_02_cancel(self):
+        """
+        A cancelled timer doesn't fire, and the wheel stops ticking once it
+        has no timers.
+        """
+        clock = task.Clock()
+        wheel = TimerWheel(clock)
+        fired = []
+        timer = wheel.schedule(1, lambda: fired.append(True))
+        self.assertEqual(len(clock.getDelayedCalls()), 1)
+        timer.cancel()
+        self.assertEqual(clock.getDelayedCalls(), [])
+        clock.advance(5)
+        self.assertEqual(fired, [])
+
+    def test_03_reset(self):
+        """
+        Resetting a timer pushes it back, and can replace its action; a
+        fired timer can be reset to fire again.
+        """
+        clock = task.Clock()
+        wheel = TimerWheel(clock)
+        fired = []
+        timer = wheel.schedule(2, lambda: fired.append("a"))
+        clock.advance(1)
+        timer.reset(2)
+        clock.advance(1)
+        self.assertEqual(fired, [])
+        clock.advance(1)
+        self.assertEqual(fired, ["a"])
+        timer.reset(1, lambda: fired.append("b"))
+        clock.advance(1)
+        self.assertEqual(fired, ["a", "b"])
+
+    def test_04_longGap(self):
+        """
+        If the reactor falls behind, all timers that are due fire on the next
+        tick, in the order they were due.
+        """
+        clock = task.Clock()
+        wheel = TimerWheel(clock)
+        fired = []
+        wheel.schedule(50, lambda: fired.append(50))
+        wheel.schedule(10, lambda: fired.append(10))
+        wheel.schedule(500, lambda: fired.append(500))
+        clock.advance(100)
+        self.assertEqual(fired, [10, 50])
+        self.assertEqual(len(wheel), 1)
+
+    def test_05_actionCancelsOther(self):
+        """
+        A timer cancelled by the action of another timer due in the same tick
+        doesn't fire.
+        """
+        clock = task.Clock()
+        wheel = TimerWheel(clock)
+        fired = []
+        timers = []
+        def action(n):
+            fired.append(n)
+            for timer in timers:
+                timer.cancel()
+        timers.append(wheel.schedule(1, lambda: action(1)))
+        timers.append(wheel.schedule(1, lambda: action(2)))
+        clock.advance(1)
+        self.assertEqual(len(fired), 1)
+        self.assertEqual(len(wheel), 0)
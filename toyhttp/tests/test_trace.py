@@ -0,0 +1,72 @@
+"""
+Tests for toyhttp.trace.
+"""
+
+import os
+from StringIO import StringIO
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import task
+
+from toyhttp.server import HTTP, HTTPFactory, Response
+from toyhttp.trace import RequestTracer
+from toyhttp.tests.test_server import AbortableTransport
+
+
+class Tests01_RequestTracer(TestCase):
+    """
+    Tests for L{RequestTracer}.
+    """
+
+    def test_01_ringBuffer(self):
+        """
+        L{RequestTracer} keeps only the most recent C{size} entries.
+        """
+        clock = task.Clock()
+        tracer = RequestTracer(size=2, clock=clock.seconds)
+        tracer.requestReceived("GET", "/1", {})
+        tracer.requestReceived("GET", "/2", {})
+        clock.advance(1)
+        tracer.responseWritten(Response(200, "hello", {"k": "v"}))
+        self.assertEqual(tracer.entries(),
+                         [(0, "request", "GET", "/2", {}),
+                          (1, "response", 200, {"k": "v"}, 5)])
+
+    def test_02_dump(self):
+        """
+        L{RequestTracer.dump} writes one line per entry to the given file.
+        """
+        tracer = RequestTracer(clock=lambda: 1.5)
+        tracer.requestReceived("GET", "/", {"Key": "value"})
+        tracer.responseWritten(Response(404, "", {}))
+        f = StringIO()
+        tracer.dump(f)
+        self.assertEqual(f.getvalue(),
+                         "1.500000 request GET / headers: {'Key': 'value'}\n"
+                         "1.500000 response 404 headers: {} body: 0 bytes\n")
+
+    def test_03_protocol(self):
+        """
+        L{HTTP} records requests and responses in the L{RequestTracer} given
+        to L{HTTPFactory}, and writes nothing to the filesystem.
+        """
+        tracer = RequestTracer(clock=lambda: 0)
+        factory = HTTPFactory(lambda *args: Response(200, "ok", {}),
+                              tracer=tracer)
+        protocol = factory.buildProtocol(None)
+        protocol.reactor = task.Clock()
+        protocol.makeConnection(AbortableTransport())
+        protocol.dataReceived("GET / HTTP/1.1\r\nKey: value\r\n\r\n")
+        self.assertEqual(tracer.entries(),
+                         [(0, "request", "GET", "/", {"Key": "value"}),
+                          (0, "response", 200, {}, 2)])
+        self.assertFalse(os.path.exists("afile"))
+        self.assertFalse(os.path.exists("response"))
+
+    def test_04_disabledByDefault(self):
+        """
+        Tracing is disabled unless a tracer is configured.
+        """
+        self.assertIdentical(HTTP(None).tracer, None)
+        self.assertIdentical(HTTPFactory(None).buildProtocol(None).tracer,
+                             None)
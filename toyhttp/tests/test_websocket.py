@@ -0,0 +1,333 @@
+"""
+Tests for toyhttp.websocket.
+"""
+
+import struct
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import task
+from twisted.internet.error import ConnectionDone
+from twisted.python.failure import Failure
+
+from toyhttp.server import HTTP
+from toyhttp.tests.test_server import AbortableTransport
+from toyhttp.websocket import (WebSocketHandler, accept, acceptKey,
+                               encodeFrame, frameHead, mask, TEXT, BINARY,
+                               CONTINUATION, CLOSE, PING, PONG, NORMAL,
+                               GOING_AWAY, PROTOCOL_ERROR, ABNORMAL,
+                               INVALID_DATA, MESSAGE_TOO_BIG)
+
+
+KEY = "\x01\x02\x03\x04"
+
+HANDSHAKE = ("GET /ws HTTP/1.1\r\n"
+             "Host: example.com\r\n"
+             "Upgrade: websocket\r\n"
+             "Connection: keep-alive, Upgrade\r\n"
+             "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+             "Sec-WebSocket-Version: 13\r\n"
+             "\r\n")
+
+
+class RecordingHandler(WebSocketHandler):
+    """
+    A handler recording the events of its connection, and echoing the
+    messages it receives.
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def messageReceived(self, message):
+        self.events.append(("message", message))
+        self.socket.sendMessage(message)
+
+    def pongReceived(self, data):
+        self.events.append(("pong", data))
+
+    def pauseSending(self):
+        self.events.append(("pause",))
+
+    def resumeSending(self):
+        self.events.append(("resume",))
+
+    def connectionClosed(self, code, reason):
+        self.events.append(("closed", code, reason))
+
+
+def parseFrames(data):
+    """
+    Parse the unmasked frames sent by the server.
+
+    @return: A list of C{(fin, opcode, payload)}.
+    """
+    frames = []
+    while data:
+        first, length = struct.unpack("!BB", data[:2])
+        pos = 2
+        if length == 126:
+            length = struct.unpack("!H", data[2:4])[0]
+            pos = 4
+        elif length == 127:
+            length = struct.unpack("!Q", data[2:10])[0]
+            pos = 10
+        frames.append((bool(first & 0x80), first & 0x0F,
+                       data[pos:pos + length]))
+        data = data[pos + length:]
+    return frames
+
+
+class Tests01_WebSocket(TestCase):
+    """
+    Tests for the WebSocket handshake and L{WebSocket} connections.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.handler = RecordingHandler()
+
+    def connect(self, data=HANDSHAKE, **kwargs):
+        """
+        Make the handshake on a new connection.
+
+        @return: The transport, with the response to the handshake cleared.
+        """
+        kwargs.setdefault("reactor", self.clock)
+
+        def handle(method, path, headers, body):
+            return accept(method, headers, self.handler, **kwargs)
+
+        self.protocol = HTTP(handle, reactor=self.clock)
+        transport = AbortableTransport()
+        self.protocol.makeConnection(transport)
+        self.protocol.dataReceived(data)
+        head = transport.value().split("\r\n\r\n", 1)[0].split("\r\n")
+        self.assertEqual(head[0], "HTTP/1.1 101 Switching Protocols")
+        self.head = head
+        self.sent = transport.value()[len("\r\n".join(head)) + 4:]
+        transport.clear()
+        return transport
+
+    def send(self, opcode, payload, fin=True):
+        self.protocol.dataReceived(encodeFrame(opcode, payload, fin, KEY))
+
+    def test_01_handshake(self):
+        """
+        L{accept} answers a handshake with a 101 response, after which the
+        connection is a L{WebSocket}: masked messages from the client are
+        passed to the handler, and messages sent back unmasked.
+        """
+        transport = self.connect()
+        self.assertIn("Upgrade: websocket", self.head)
+        self.assertIn("Connection: Upgrade", self.head)
+        self.assertIn("Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=",
+                      self.head)
+        self.assertIdentical(transport.producer, self.handler.socket)
+        self.send(TEXT, u"h\xe9llo".encode("utf-8"))
+        self.send(BINARY, "\x00\xff")
+        self.assertEqual(self.handler.events,
+                         [("message", u"h\xe9llo"), ("message", "\x00\xff")])
+        self.assertEqual(parseFrames(transport.value()),
+                         [(True, TEXT, "h\xc3\xa9llo"),
+                          (True, BINARY, "\x00\xff")])
+        self.assertFalse(transport.disconnecting)
+
+    def test_02_badHandshake(self):
+        """
+        Requests that aren't WebSocket handshakes, or are for another
+        version of the protocol, get a 426 response; malformed ones get a
+        400 response.
+        """
+        headers = {"Upgrade": "websocket", "Connection": "Upgrade",
+                   "Sec-WebSocket-Key": "dGhlIHNhbXBsZSBub25jZQ==",
+                   "Sec-WebSocket-Version": "13"}
+        handler = RecordingHandler()
+        self.assertEqual(accept("GET", headers, handler).code, 101)
+        for method, changes, code in [
+                ("GET", {"Upgrade": "h2c"}, 426),
+                ("GET", {"Connection": "close"}, 426),
+                ("GET", {"Sec-WebSocket-Version": "8"}, 426),
+                ("GET", {"Sec-WebSocket-Key": "short"}, 400),
+                ("GET", {"Sec-WebSocket-Key": "not base64!"}, 400),
+                ("POST", {}, 400)]:
+            changed = dict(headers, **changes)
+            self.assertEqual(accept(method, changed, handler).code, code)
+
+    def test_03_subprotocols(self):
+        """
+        The first of the handler's subprotocols offered by the client is
+        chosen.
+        """
+        self.connect(
+            HANDSHAKE[:-2] + "Sec-WebSocket-Protocol: chat, superchat\r\n\r\n",
+            protocols=["superchat", "chat"])
+        self.assertIn("Sec-WebSocket-Protocol: superchat", self.head)
+        self.assertEqual(self.handler.socket.protocol, "superchat")
+
+    def test_04_pipelined(self):
+        """
+        Frames sent along with the handshake are passed on to the
+        L{WebSocket}.
+        """
+        self.connect(HANDSHAKE + encodeFrame(TEXT, "early", key=KEY))
+        self.assertEqual(self.handler.events, [("message", u"early")])
+        self.assertEqual(parseFrames(self.sent), [(True, TEXT, "early")])
+
+    def test_05_fragmentation(self):
+        """
+        A fragmented message is passed to the handler whole, with control
+        frames between its fragments handled as they arrive, however the
+        bytes are split up.
+        """
+        transport = self.connect()
+        data = (encodeFrame(TEXT, "frag", False, KEY) +
+                encodeFrame(PING, "are you there?", key=KEY) +
+                encodeFrame(CONTINUATION, "men", False, KEY) +
+                encodeFrame(CONTINUATION, "ted", key=KEY) +
+                encodeFrame(PONG, "yes", key=KEY))
+        for byte in data:
+            self.protocol.dataReceived(byte)
+        self.assertEqual(self.handler.events,
+                         [("message", u"fragmented"), ("pong", "yes")])
+        self.assertEqual(parseFrames(transport.value()),
+                         [(True, PONG, "are you there?"),
+                          (True, TEXT, "fragmented")])
+
+    def test_06_largeFrames(self):
+        """
+        Frames with 16 and 64-bit lengths are received and sent.
+        """
+        transport = self.connect()
+        for size in [200, 70000]:
+            message = "x" * (size - 1) + "y"
+            self.send(BINARY, message)
+            self.assertEqual(self.handler.events[-1], ("message", message))
+            self.assertEqual(parseFrames(transport.value()),
+                             [(True, BINARY, message)])
+            transport.clear()
+
+    def assertFailed(self, transport, code):
+        """
+        Assert that the connection has been failed with a close frame
+        carrying C{code}.
+        """
+        frames = parseFrames(transport.value())
+        self.assertEqual(frames[-1][1], CLOSE)
+        self.assertEqual(struct.unpack("!H", frames[-1][2][:2])[0], code)
+        self.assertTrue(transport.disconnecting)
+
+    def test_07_protocolErrors(self):
+        """
+        Frames breaking the protocol close the connection with the matching
+        close code, without being passed to the handler.
+        """
+        for data, code in [
+                (frameHead(TEXT, 2) + "hi", PROTOCOL_ERROR),
+                (encodeFrame(TEXT | 0x40, "hi", key=KEY), PROTOCOL_ERROR),
+                (encodeFrame(0x3, "hi", key=KEY), PROTOCOL_ERROR),
+                (encodeFrame(CONTINUATION, "hi", key=KEY), PROTOCOL_ERROR),
+                (encodeFrame(TEXT, "a", False, KEY) +
+                 encodeFrame(TEXT, "b", key=KEY), PROTOCOL_ERROR),
+                (encodeFrame(PING, "x" * 126, key=KEY), PROTOCOL_ERROR),
+                (encodeFrame(PING, "", False, KEY), PROTOCOL_ERROR),
+                (encodeFrame(TEXT, "\xff", key=KEY), INVALID_DATA),
+                (frameHead(BINARY, 101, key=KEY), MESSAGE_TOO_BIG),
+                (encodeFrame(BINARY, "x" * 60, False, KEY) +
+                 frameHead(CONTINUATION, 41, key=KEY), MESSAGE_TOO_BIG)]:
+            self.handler = RecordingHandler()
+            transport = self.connect(maxMessageSize=100)
+            self.protocol.dataReceived(data)
+            self.assertFailed(transport, code)
+            self.assertEqual([event for event in self.handler.events
+                              if event[0] == "message"], [])
+
+    def test_08_clientCloses(self):
+        """
+        A close frame from the client is answered with one echoing its
+        code, and the connection is closed; the handler learns the client's
+        code and reason.
+        """
+        transport = self.connect()
+        self.send(CLOSE, struct.pack("!H", GOING_AWAY) + "bye")
+        self.assertEqual(parseFrames(transport.value()),
+                         [(True, CLOSE, struct.pack("!H", GOING_AWAY))])
+        self.assertTrue(transport.disconnecting)
+        self.handler.socket.sendMessage(u"too late")
+        self.protocol.connectionLost(Failure(ConnectionDone()))
+        self.assertEqual(self.handler.events,
+                         [("closed", GOING_AWAY, u"bye")])
+        self.assertEqual(len(parseFrames(transport.value())), 1)
+
+    def test_09_serverCloses(self):
+        """
+        L{WebSocket.close} sends a close frame and waits for the client's
+        answer, aborting the connection if it doesn't come in time.
+        """
+        transport = self.connect()
+        socket = self.handler.socket
+        socket.close(NORMAL, u"done")
+        self.assertEqual(parseFrames(transport.value()),
+                         [(True, CLOSE, struct.pack("!H", NORMAL) + "done")])
+        self.assertFalse(transport.disconnecting)
+        self.send(TEXT, "ignored")
+        self.send(CLOSE, struct.pack("!H", NORMAL))
+        self.assertTrue(transport.disconnecting)
+        self.protocol.connectionLost(Failure(ConnectionDone()))
+        self.assertEqual(self.handler.events, [("closed", NORMAL, u"")])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+        self.handler = RecordingHandler()
+        transport = self.connect()
+        self.protocol.closeWhenIdle()
+        self.assertEqual(parseFrames(transport.value())[0][2],
+                         struct.pack("!H", GOING_AWAY))
+        self.clock.advance(self.handler.socket.closeTimeout)
+        self.assertTrue(transport.aborting)
+
+    def test_10_connectionLost(self):
+        """
+        A connection lost without a closing handshake is reported to the
+        handler as abnormal.
+        """
+        self.connect()
+        self.protocol.connectionLost(Failure(ConnectionDone()))
+        self.assertEqual(self.handler.events, [("closed", ABNORMAL, u"")])
+
+    def test_11_flowControl(self):
+        """
+        The handler is told when the transport's buffer fills up and
+        drains; L{WebSocket.pauseReading} pauses the transport.
+        """
+        transport = self.connect()
+        socket = self.handler.socket
+        socket.pauseProducing()
+        self.assertTrue(socket.paused)
+        socket.resumeProducing()
+        self.assertEqual(self.handler.events, [("pause",), ("resume",)])
+        socket.pauseReading()
+        self.assertEqual(transport.producerState, "paused")
+        socket.resumeReading()
+        self.assertEqual(transport.producerState, "producing")
+
+    def test_12_http10(self):
+        """
+        HTTP/1.0 requests can't be upgraded.
+        """
+        protocol = HTTP(lambda method, path, headers, body: accept(
+            method, headers, RecordingHandler()), reactor=self.clock)
+        transport = AbortableTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived(HANDSHAKE.replace("HTTP/1.1", "HTTP/1.0", 1))
+        self.assertTrue(transport.value().startswith("HTTP/1.1 400 "))
+
+    def test_13_mask(self):
+        """
+        L{mask} XORs a payload with its key, and undoes itself.
+        """
+        self.assertEqual(mask("\x00\x00\x00\x00\x00\xff", KEY),
+                         "\x01\x02\x03\x04\x01\xfd")
+        payload = "".join(chr(i % 256) for i in range(1000))
+        self.assertEqual(mask(mask(payload, KEY), KEY), payload)
+        self.assertEqual(mask("", KEY), "")
+        self.assertEqual(acceptKey("dGhlIHNhbXBsZSBub25jZQ=="),
+                         "s3pPLMBiTxaQ9kYGzzhZRbK+xOo=")
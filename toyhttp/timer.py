@@ -0,0 +1,176 @@
+"""
+A coarse-grained timer wheel for connection timeouts.
+
+Scheduling a C{reactor.callLater} per connection, and cancelling and
+rescheduling it whenever the connection makes progress, churns the
+reactor's heap of delayed calls.  A L{TimerWheel} instead files each
+timer in a bucket for the tick in which it expires, so scheduling,
+cancelling and pushing back a timer are a few dictionary operations.  A
+single periodic reactor call, made only while timers are pending, fires
+the timers of each tick that has passed.
+
+Timers fire up to one tick late, but never early, which is plenty precise
+for timeouts of several seconds.
+"""
+
+import math
+
+from twisted.internet.task import LoopingCall
+from twisted.python import log
+
+
+class _Timer(object):
+    """
+    A timer scheduled on a L{TimerWheel}.
+    """
+
+    __slots__ = ("_wheel", "_tick", "_action")
+
+    def __init__(self, wheel, action):
+        self._wheel = wheel
+        self._tick = None
+        self._action = action
+
+    def active(self):
+        """
+        Whether the timer has neither fired nor been cancelled.
+        """
+        return self._tick is not None
+
+    def cancel(self):
+        """
+        Stop the timer from firing.  Cancelling an inactive timer does
+        nothing.
+        """
+        if self._tick is not None:
+            self._wheel._remove(self)
+
+    def reset(self, delay, action=None):
+        """
+        Make the timer fire C{delay} seconds from now instead, even if it has
+        already fired or been cancelled.
+
+        @param action: A new function for the timer to call, or C{None} to
+            keep the current one.
+        """
+        if action is not None:
+            self._action = action
+        self._wheel._add(self, delay)
+
+
+class TimerWheel(object):
+    """
+    Timers sharing a single periodic reactor call.
+
+    @ivar resolution: The length of a tick, in seconds.
+    """
+
+    def __init__(self, reactor, resolution=1.0):
+        self.reactor = reactor
+        self.resolution = resolution
+        # Maps tick numbers to the sets of timers expiring in them:
+        self._buckets = {}
+        self._count = 0
+        # The last tick whose timers have been fired:
+        self._processed = 0
+        self._loop = None
+
+    def __len__(self):
+        """
+        @return: The number of pending timers.
+        """
+        return self._count
+
+    def schedule(self, delay, action):
+        """
+        Call C{action} with no arguments after C{delay} seconds (plus up to
+        one tick).
+
+        @return: A timer with C{active()}, C{cancel()} and C{reset(delay)}
+            methods.
+        """
+        timer = _Timer(self, action)
+        self._add(timer, delay)
+        return timer
+
+    def _add(self, timer, delay):
+        if self._loop is None:
+            self._start()
+        tick = int(math.ceil((self.reactor.seconds() + delay) /
+                             self.resolution))
+        if tick <= self._processed:
+            tick = self._processed + 1
+        current = timer._tick
+        if current == tick:
+            return
+        if current is None:
+            self._count += 1
+        else:
+            self._discard(timer)
+        bucket = self._buckets.get(tick)
+        if bucket is None:
+            bucket = self._buckets[tick] = set()
+        bucket.add(timer)
+        timer._tick = tick
+
+    def _remove(self, timer):
+        self._discard(timer)
+        timer._tick = None
+        self._count -= 1
+        if not self._count:
+            self._stop()
+
+    def _discard(self, timer):
+        """
+        Take a timer out of its bucket, if that hasn't been taken out of the
+        wheel to be fired already.
+        """
+        bucket = self._buckets.get(timer._tick)
+        if bucket is not None:
+            bucket.discard(timer)
+            if not bucket:
+                del self._buckets[timer._tick]
+
+    def _start(self):
+        self._processed = int(self.reactor.seconds() / self.resolution)
+        self._loop = LoopingCall(self._advance)
+        self._loop.clock = self.reactor
+        self._loop.start(self.resolution, now=False)
+
+    def _advance(self):
+        """
+        Fire the timers of all ticks up to the current one.
+        """
+        now = int(self.reactor.seconds() / self.resolution)
+        buckets = self._buckets
+        if now - self._processed <= len(buckets):
+            due = range(self._processed + 1, now + 1)
+        else:
+            # After a long gap it's cheaper to look at the buckets.
+            due = sorted(tick for tick in buckets if tick <= now)
+        self._processed = now
+        for tick in due:
+            bucket = buckets.pop(tick, None)
+            if bucket is None:
+                continue
+            for timer in bucket:
+                if timer._tick != tick:
+                    # Cancelled or reset by an earlier timer's action.
+                    continue
+                timer._tick = None
+                self._count -= 1
+                try:
+                    timer._action()
+                except:
+                    log.err(None, "Error in timer action")
+        if not self._count:
+            self._stop()
+
+    def _stop(self):
+        """
+        Stop ticking while there are no timers.
+        """
+        if self._loop is not None:
+            self._loop.stop()
+            self._loop = None
+            self._buckets.clear()
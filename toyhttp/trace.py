@@ -0,0 +1,81 @@
+"""
+Opt-in request/response tracing for the toy HTTP server.
+
+Tracing is off unless a L{RequestTracer} is passed to L{HTTPFactory}; when it
+is on, entries are only appended to a bounded in-memory ring buffer, so the
+reactor thread never blocks on the filesystem.  Call L{RequestTracer.dump}
+whenever you want to look at (or save) the recent history.
+"""
+
+import collections
+import time
+
+
+class RequestTracer(object):
+    """
+    Keep the most recent requests and responses in a ring buffer.
+
+    Each entry is a tuple starting with a timestamp and the kind of event,
+    either C{"request"} followed by the method, path and headers, or
+    C{"response"} followed by the status code, headers and body length
+    (C{None} for streamed bodies of unknown length).  Response bodies are
+    never retained.
+    """
+
+    def __init__(self, size=1000, clock=time.time):
+        """
+        @param size: The maximum number of entries kept; older ones are
+            discarded as new ones arrive.
+
+        @param clock: A function returning the current time.
+        """
+        self._entries = collections.deque(maxlen=size)
+        self._clock = clock
+
+    def requestReceived(self, method, path, headers):
+        """
+        Record a request that is about to be passed to the handler.
+        """
+        self._entries.append((self._clock(), "request", method, path, headers))
+
+    def responseWritten(self, response):
+        """
+        Record a L{Response} that is being written to the client.
+        """
+        body = response.body
+        if isinstance(body, str):
+            length = len(body)
+        else:
+            # A StreamingResponse.
+            length = response.length
+        self._entries.append((self._clock(), "response", response.code,
+                              response.headers, length))
+
+    def entries(self):
+        """
+        @return: A list of the entries currently in the buffer, oldest first.
+        """
+        return list(self._entries)
+
+    def clear(self):
+        """
+        Discard all entries.
+        """
+        self._entries.clear()
+
+    def dump(self, f):
+        """
+        Write the entries currently in the buffer to a file, one per line.
+
+        This does blocking I/O: call it from a manhole, a signal handler or a
+        thread (e.g. with C{reactor.callInThread}), not per request.
+
+        @param f: A file-like object with a C{write} method.
+        """
+        for entry in self.entries():
+            if entry[1] == "request":
+                f.write("%.6f request %s %s headers: %r\n" % (
+                    entry[0], entry[2], entry[3], entry[4]))
+            else:
+                f.write("%.6f response %d headers: %r body: %s bytes\n" % (
+                    entry[0], entry[2], entry[3], entry[4]))
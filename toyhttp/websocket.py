@@ -0,0 +1,530 @@
+"""
+WebSocket (RFC 6455) connections, upgraded from HTTP requests.
+
+A handler accepts a WebSocket by returning the response of L{accept} for
+the request: a 101 response, after which the HTTP connection is handed over
+to a L{WebSocket}, or an error response if the request isn't a valid
+handshake.  For instance, with a L{toyhttp.router.Router}::
+
+    class Updates(WebSocketHandler):
+        def connectionOpened(self, socket):
+            subscribers.add(socket)
+
+        def connectionClosed(self, code, reason):
+            ...
+
+    @router.route("GET", "/updates")
+    def updates(method, path, headers, body):
+        return accept(method, headers, Updates())
+
+Messages are passed to the handler's C{messageReceived} whole, however the
+client fragmented them, as C{unicode} for text messages and C{str} for
+binary ones; L{WebSocket.sendMessage} likewise sends C{unicode} as text and
+C{str} as binary.  Pings are answered with pongs, and the closing handshake
+is carried out, by the L{WebSocket} itself.
+
+The L{WebSocket} is a streaming producer for its transport: when the client
+doesn't read messages as fast as they are sent, the handler's
+C{pauseSending} is called, and C{resumeSending} once the transport's buffer
+has drained, so it can hold back updates rather than buffering them without
+bound.  In the other direction, L{WebSocket.pauseReading} stops reading
+from the client.
+"""
+
+import base64
+import hashlib
+import struct
+
+from twisted.internet.protocol import Protocol
+
+from toyhttp.codec import Headers
+from toyhttp.server import PrerenderedResponse, UpgradeResponse
+
+
+# Frame opcodes:
+CONTINUATION = 0x0
+TEXT = 0x1
+BINARY = 0x2
+CLOSE = 0x8
+PING = 0x9
+PONG = 0xA
+
+# Close codes:
+NORMAL = 1000
+GOING_AWAY = 1001
+PROTOCOL_ERROR = 1002
+UNSUPPORTED_DATA = 1003
+NO_STATUS = 1005
+ABNORMAL = 1006
+INVALID_DATA = 1007
+MESSAGE_TOO_BIG = 1009
+
+# Appended to the client's key to compute Sec-WebSocket-Accept:
+_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+_BAD_HANDSHAKE = PrerenderedResponse(400, "Bad WebSocket handshake.",
+                                     {"Content-Type": "text/plain"})
+
+_UPGRADE_REQUIRED = PrerenderedResponse(
+    426, "WebSocket required.",
+    {"Content-Type": "text/plain", "Upgrade": "websocket",
+     "Connection": "Upgrade", "Sec-WebSocket-Version": "13"})
+
+# Translation tables XORing every byte with a given byte, built when first
+# needed:
+_XOR_TABLES = [None] * 256
+
+
+def _xorTable(byte):
+    table = _XOR_TABLES[byte]
+    if table is None:
+        table = _XOR_TABLES[byte] = "".join(chr(i ^ byte)
+                                            for i in range(256))
+    return table
+
+
+def mask(payload, key):
+    """
+    Mask (or unmask) a frame payload.
+
+    Every fourth byte is XORed with the same byte of the key, so each of
+    the four strides of the payload is translated with a table in one go,
+    rather than byte by byte in Python.
+
+    @param key: The 4-byte masking key.
+    """
+    if not payload:
+        return payload
+    masked = bytearray(payload)
+    for i in range(4):
+        masked[i::4] = payload[i::4].translate(_xorTable(ord(key[i])))
+    return str(masked)
+
+
+def frameHead(opcode, length, fin=True, key=None):
+    """
+    Render the head of a frame.
+
+    @param length: The length of the payload.
+
+    @param key: The 4-byte masking key for a masked frame, or C{None}.
+    """
+    first = opcode | 0x80 if fin else opcode
+    maskBit = 0x80 if key is not None else 0
+    if length < 126:
+        head = struct.pack("!BB", first, maskBit | length)
+    elif length < 0x10000:
+        head = struct.pack("!BBH", first, maskBit | 126, length)
+    else:
+        head = struct.pack("!BBQ", first, maskBit | 127, length)
+    if key is not None:
+        head += key
+    return head
+
+
+def encodeFrame(opcode, payload, fin=True, key=None):
+    """
+    Render a frame, masking its payload with C{key}, as clients must, if it
+    is given.
+    """
+    if key is not None:
+        payload = mask(payload, key)
+    return frameHead(opcode, len(payload), fin, key) + payload
+
+
+def acceptKey(key):
+    """
+    @return: The C{Sec-WebSocket-Accept} value answering a
+        C{Sec-WebSocket-Key}.
+    """
+    return base64.b64encode(hashlib.sha1(key + _GUID).digest())
+
+
+def _tokens(value):
+    return [token.strip().lower() for token in (value or "").split(",")]
+
+
+def accept(method, headers, handler, protocols=(), **kwargs):
+    """
+    Accept a WebSocket handshake.
+
+    @param method: The request method.
+
+    @param headers: The request headers.
+
+    @param handler: The L{WebSocketHandler} for the connection.
+
+    @param protocols: The subprotocols the handler speaks, in order of
+        preference; the first one the client offers is chosen.  If the
+        client offers none of them, no subprotocol is chosen.
+
+    @param kwargs: Attributes of the L{WebSocket}, such as
+        C{maxMessageSize} or C{reactor}.
+
+    @return: A L{toyhttp.server.UpgradeResponse} handing the connection over
+        to a L{WebSocket}, or a 400 or 426 response if the request isn't a
+        valid handshake.
+    """
+    if not isinstance(headers, Headers):
+        headers = Headers(headers)
+    if ("websocket" not in _tokens(headers.get("Upgrade")) or
+            "upgrade" not in _tokens(headers.get("Connection"))):
+        return _UPGRADE_REQUIRED
+    if headers.get("Sec-WebSocket-Version") != "13":
+        return _UPGRADE_REQUIRED
+    key = headers.get("Sec-WebSocket-Key", "").strip()
+    try:
+        valid = len(base64.b64decode(key)) == 16
+    except TypeError:
+        valid = False
+    if method != "GET" or not valid:
+        return _BAD_HANDSHAKE
+
+    responseHeaders = {"Upgrade": "websocket", "Connection": "Upgrade",
+                       "Sec-WebSocket-Accept": acceptKey(key)}
+    protocol = None
+    offered = headers.get("Sec-WebSocket-Protocol")
+    if protocols and offered:
+        offered = [token.strip() for token in offered.split(",")]
+        for candidate in protocols:
+            if candidate in offered:
+                protocol = responseHeaders["Sec-WebSocket-Protocol"] = (
+                    candidate)
+                break
+    socket = WebSocket(handler, protocol)
+    for name, value in kwargs.iteritems():
+        setattr(socket, name, value)
+    return UpgradeResponse(responseHeaders, socket)
+
+
+class WebSocketHandler(object):
+    """
+    The application's side of a WebSocket connection.  Subclass it and
+    override the methods for the events of interest.
+
+    @ivar socket: The L{WebSocket}, once the connection is open.
+    """
+
+    socket = None
+
+    def connectionOpened(self, socket):
+        """
+        The handshake is done; messages can now be sent with C{socket}.
+        """
+        self.socket = socket
+
+    def messageReceived(self, message):
+        """
+        A message has been received, as C{unicode} if it is text, or as
+        C{str} if it is binary.
+        """
+
+    def pongReceived(self, data):
+        """
+        A pong has been received, e.g. in answer to L{WebSocket.ping}.
+        """
+
+    def pauseSending(self):
+        """
+        The client isn't reading messages as fast as they are being sent;
+        hold back further messages until L{resumeSending} is called.
+        """
+
+    def resumeSending(self):
+        """
+        The client has caught up; messages can be sent again.
+        """
+
+    def connectionClosed(self, code, reason):
+        """
+        The connection has been closed.
+
+        @param code: The close code sent by the client, L{NO_STATUS} if it
+            didn't send one, or L{ABNORMAL} if the connection was lost
+            without a closing handshake.
+
+        @param reason: The reason sent by the client, as C{unicode}.
+        """
+
+
+class WebSocket(Protocol):
+    """
+    A WebSocket connection, on the server side.
+
+    @ivar handler: The L{WebSocketHandler}.
+
+    @ivar protocol: The subprotocol chosen in the handshake, or C{None}.
+
+    @ivar maxMessageSize: The largest message accepted, in bytes, however
+        it is fragmented.  Larger messages close the connection with
+        L{MESSAGE_TOO_BIG} as soon as their frame heads announce it, before
+        they are buffered.
+
+    @ivar closeTimeout: Seconds to wait for the client to answer a close
+        frame before aborting the connection.
+
+    @ivar paused: Whether the transport's buffer is full (see
+        L{WebSocketHandler.pauseSending}).
+    """
+
+    maxMessageSize = 1024 * 1024
+    closeTimeout = 10
+    reactor = None
+
+    def __init__(self, handler, protocol=None):
+        self.handler = handler
+        self.protocol = protocol
+        self.paused = False
+        # Bytes of a frame head that has only partly arrived:
+        self._tail = ""
+        # The FIN bit, opcode and masking key of the frame being received,
+        # the pieces of its payload and the number of bytes still to come:
+        self._frame = None
+        self._payload = None
+        self._remaining = 0
+        # The opcode and fragments of a fragmented message being received:
+        self._messageOpcode = None
+        self._fragments = None
+        self._messageSize = 0
+        self._closeSent = False
+        self._closeReceived = None
+        self._failed = False
+        self._closeCall = None
+
+    def connectionMade(self):
+        if self.reactor is None:
+            from twisted.internet import reactor
+            self.reactor = reactor
+        self.transport.registerProducer(self, True)
+        self.handler.connectionOpened(self)
+
+    # Sending:
+
+    def sendMessage(self, message):
+        """
+        Send a message: C{unicode} as a text message, C{str} as a binary
+        one.  Messages sent after the connection started closing are
+        dropped.
+        """
+        if self._closeSent:
+            return
+        if isinstance(message, unicode):
+            self._sendFrame(TEXT, message.encode("utf-8"))
+        else:
+            self._sendFrame(BINARY, message)
+
+    def ping(self, data=""):
+        """
+        Send a ping, which the client answers with a pong carrying the same
+        data (see L{WebSocketHandler.pongReceived}).
+        """
+        if not self._closeSent:
+            self._sendFrame(PING, data)
+
+    def close(self, code=NORMAL, reason=u""):
+        """
+        Start the closing handshake; the connection is closed once the
+        client has answered, or after L{closeTimeout} seconds.
+
+        @param code: The close code, or C{None} to send none.
+        """
+        if self._closeSent:
+            return
+        self._closeSent = True
+        payload = ""
+        if code is not None:
+            payload = struct.pack("!H", code) + reason.encode("utf-8")
+        self._sendFrame(CLOSE, payload)
+        if self._closeReceived is not None:
+            self.transport.loseConnection()
+        else:
+            self._closeCall = self.reactor.callLater(
+                self.closeTimeout, self.transport.abortConnection)
+
+    def closeWhenIdle(self):
+        """
+        The server is shutting down; close the connection.
+        """
+        self.close(GOING_AWAY)
+
+    def _sendFrame(self, opcode, payload):
+        self.transport.writeSequence([frameHead(opcode, len(payload)),
+                                      payload])
+
+    def _fail(self, code, reason=u""):
+        """
+        Close the connection because the client broke the protocol.
+        """
+        self._failed = True
+        self.close(code, reason)
+        self.transport.loseConnection()
+
+    # Flow control:
+
+    def pauseProducing(self):
+        self.paused = True
+        self.handler.pauseSending()
+
+    def resumeProducing(self):
+        self.paused = False
+        self.handler.resumeSending()
+
+    def stopProducing(self):
+        pass
+
+    def pauseReading(self):
+        """
+        Stop reading from the client, e.g. while the handler is busy with a
+        message.
+        """
+        self.transport.pauseProducing()
+
+    def resumeReading(self):
+        self.transport.resumeProducing()
+
+    # Receiving:
+
+    def dataReceived(self, data):
+        if self._tail:
+            data = self._tail + data
+            self._tail = ""
+        pos = 0
+        end = len(data)
+        while pos < end and not self._failed:
+            if self._remaining:
+                take = min(self._remaining, end - pos)
+                if take == end and not pos:
+                    self._payload.append(data)
+                else:
+                    self._payload.append(data[pos:pos + take])
+                pos += take
+                self._remaining -= take
+                if not self._remaining:
+                    self._frameReceived()
+                continue
+            if end - pos < 2:
+                self._tail = data[pos:]
+                return
+            first = ord(data[pos])
+            second = ord(data[pos + 1])
+            if not second & 0x80:
+                # Clients must mask their frames.
+                self._fail(PROTOCOL_ERROR)
+                return
+            length = second & 0x7F
+            if length == 126:
+                size = 8
+            elif length == 127:
+                size = 14
+            else:
+                size = 6
+            if end - pos < size:
+                self._tail = data[pos:]
+                return
+            if length == 126:
+                length = struct.unpack_from("!H", data, pos + 2)[0]
+            elif length == 127:
+                length = struct.unpack_from("!Q", data, pos + 2)[0]
+            key = data[pos + size - 4:pos + size]
+            pos += size
+            if self._frameHeadReceived(first, length, key):
+                self._remaining = length
+                if not length:
+                    self._frameReceived()
+
+    def _frameHeadReceived(self, first, length, key):
+        """
+        Check the head of a frame.
+
+        @return: Whether the frame is valid; otherwise the connection is
+            being failed.
+        """
+        fin = bool(first & 0x80)
+        opcode = first & 0x0F
+        if first & 0x70:
+            # Reserved bits are set, but no extensions were negotiated.
+            self._fail(PROTOCOL_ERROR)
+            return False
+        if opcode >= CLOSE:
+            if opcode not in (CLOSE, PING, PONG) or not fin or length > 125:
+                self._fail(PROTOCOL_ERROR)
+                return False
+        else:
+            if opcode == CONTINUATION:
+                # Only valid within a fragmented message.
+                valid = self._messageOpcode is not None
+            else:
+                valid = (opcode in (TEXT, BINARY) and
+                         self._messageOpcode is None)
+            if not valid:
+                self._fail(PROTOCOL_ERROR)
+                return False
+            if self._messageSize + length > self.maxMessageSize:
+                self._fail(MESSAGE_TOO_BIG)
+                return False
+        self._frame = (fin, opcode, key)
+        self._payload = []
+        return True
+
+    def _frameReceived(self):
+        fin, opcode, key = self._frame
+        payload = mask("".join(self._payload), key)
+        self._frame = self._payload = None
+        if opcode >= CLOSE:
+            self._controlFrameReceived(opcode, payload)
+            return
+        if opcode != CONTINUATION:
+            self._messageOpcode = opcode
+            self._fragments = []
+        self._fragments.append(payload)
+        self._messageSize += len(payload)
+        if not fin:
+            return
+        message = "".join(self._fragments)
+        messageOpcode = self._messageOpcode
+        self._messageOpcode = self._fragments = None
+        self._messageSize = 0
+        if messageOpcode == TEXT:
+            try:
+                message = message.decode("utf-8")
+            except UnicodeDecodeError:
+                self._fail(INVALID_DATA)
+                return
+        if not self._closeSent:
+            self.handler.messageReceived(message)
+
+    def _controlFrameReceived(self, opcode, payload):
+        if opcode == PING:
+            if not self._closeSent:
+                self._sendFrame(PONG, payload)
+        elif opcode == PONG:
+            self.handler.pongReceived(payload)
+        else:
+            code = NO_STATUS
+            reason = u""
+            if len(payload) == 1:
+                self._fail(PROTOCOL_ERROR)
+                return
+            if payload:
+                code = struct.unpack("!H", payload[:2])[0]
+                try:
+                    reason = payload[2:].decode("utf-8")
+                except UnicodeDecodeError:
+                    self._fail(INVALID_DATA)
+                    return
+                if code < 1000 or code in (NO_STATUS, ABNORMAL, 1015):
+                    self._fail(PROTOCOL_ERROR)
+                    return
+            self._closeReceived = (code, reason)
+            if self._closeSent:
+                self.transport.loseConnection()
+            else:
+                # Echo the client's code, as RFC 6455 suggests.
+                self.close(None if code == NO_STATUS else code)
+
+    def connectionLost(self, reason):
+        if self._closeCall is not None and self._closeCall.active():
+            self._closeCall.cancel()
+        self._closeCall = None
+        code, text = self._closeReceived or (ABNORMAL, u"")
+        self.handler.connectionClosed(code, text)